@@ -0,0 +1,337 @@
+"""Synthetic rosbag generator for reproducible extraction benchmarks.
+
+Writes ROS2 split bags (.db3, via the rosbags Writer) that look like the
+vessel's recordings to extract-bag.py: the topics, message types and
+per-bag message counts of rosbag-topics.txt (counts are per ~120 s bag and
+are turned into rates), grouped into recording sessions with gaps between
+them, and a /control_mode/feedback stream that changes mode at random.
+
+  - Topics whose type is in the typestore (ROS2 Humble + CUSTOM_MSG_DEFS in
+    msg_registry.py) get real CDR messages. Each topic cycles through
+    PAYLOAD_VARIANTS pre-serialized random messages; only the battery
+    topics and the mode feedback are built per message, so the battery
+    discharges smoothly and modes follow the generated schedule.
+  - Topics with other types (ublox, sbg extras, bond, ...) are written as
+    opaque filler payloads of --filler-bytes, so file size and SQLite layout
+    stay realistic without their schemas. extract-bag.py never reads them.
+
+Output depends only on the arguments (--seed included), so a dataset can
+be regenerated anywhere. Bags are written in parallel.
+
+Usage:
+    python3 benchmarking/generate-bags.py /tmp/bags --bags 24
+    python3 benchmarking/generate-bags.py /tmp/bags --bags 300 --session-bags 100 --mode-interval 120 --workers 8
+    python3 benchmarking/generate-bags.py /tmp/bags --bags 8 --topics processed --rate-scale 0.1
+"""
+import argparse
+import hashlib
+import importlib.util
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from rosbags.rosbag2 import Writer
+from rosbags.typesys.base import Nodetype
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(extract_bag)
+
+TOPICS_FILE = os.path.join(REPO_DIR, "rosbag-topics.txt")
+REFERENCE_BAG_S = 120          # rosbag-topics.txt counts are per split bag of ~120 s
+PAYLOAD_VARIANTS = 32
+START_TIME_NS = 1_771_822_819_000_000_000  # 2026-02-23 05:00:19 UTC
+MODES = ["Idle", "Navigation", "Direct", "Station", "Voyage"]
+FEEDBACK_TOPIC = "/control_mode/feedback"
+FEEDBACK_TYPE = "rkse_common_interfaces/msg/ControlModeFeedback"
+FILLER_MSGDEF = "uint8[] data"
+
+# Battery topics decline with time instead of cycling random payloads:
+# topic -> (field, value at full charge)
+BATTERY_FIELDS = {
+    "/battery_state": ("percentage", 1.0),
+    "/telemetry/battery_state": ("charge_percentage", 100.0),
+    "/pack_status": ("pack_state_of_charge", 100.0),
+}
+DISCHARGE_PER_HOUR = 0.08      # fraction of full charge
+NAN_BATTERY_RATE = 0.02        # share of /battery_state readings that are NaN, like the real sensor
+
+CARD_IDS = ["card_1", "card_2", "card_3", "card_4", "card_5", "card_6"]
+
+
+def read_topic_list(path=TOPICS_FILE):
+    """Parse rosbag-topics.txt into [(topic, msgtype, messages_per_bag)]."""
+    topics = []
+    with open(path) as f:
+        for line in f:
+            parts = [part.strip() for part in line.split("|")]
+            if len(parts) == 3 and parts[0].startswith("/"):
+                topics.append((parts[0], parts[1], int(parts[2])))
+    return topics
+
+
+# ====================================================================
+# Random message construction from the typestore's field definitions
+# ====================================================================
+def random_message(typestore, msgtype, rng, blob_bytes):
+    cls = typestore.types[msgtype]
+    _, fields = typestore.fielddefs[msgtype]
+    return cls(**{name: random_field(typestore, nodetype, spec, rng, blob_bytes) for name, (nodetype, spec) in fields})
+
+
+def random_field(typestore, nodetype, spec, rng, blob_bytes):
+    if nodetype == Nodetype.NAME:
+        return random_message(typestore, spec, rng, blob_bytes)
+    if nodetype == Nodetype.BASE:
+        return random_scalar(spec[0], rng)
+    (elem_nodetype, elem_spec), length = spec
+    if nodetype == Nodetype.SEQUENCE:
+        if elem_nodetype == Nodetype.BASE and elem_spec[0] in ("uint8", "int8", "byte", "char"):
+            length = blob_bytes
+        else:
+            length = rng.randint(0, 4)
+    if elem_nodetype == Nodetype.BASE and elem_spec[0] != "string":
+        dtype = np.dtype({"bool": "bool", "char": "uint8"}.get(elem_spec[0], elem_spec[0]))  # byte is int8
+        values = [random_scalar(elem_spec[0], rng) for _ in range(length)]
+        return np.array(values, dtype=dtype)
+    return [random_field(typestore, elem_nodetype, elem_spec, rng, blob_bytes) for _ in range(length)]
+
+
+def random_scalar(typename, rng):
+    if typename == "string":
+        return rng.choice(["base_link", "odom", "map", "imu_link"])
+    if typename == "bool":
+        return rng.random() < 0.2
+    if typename.startswith("float"):
+        return rng.uniform(-100.0, 100.0)
+    if typename in ("uint8", "char"):
+        return rng.randint(0, 255)
+    if typename in ("int8", "byte"):
+        return rng.randint(0, 127)
+    return rng.randint(0, 30_000)
+
+
+def stamp(typestore, msg, timestamp):
+    """Set header.stamp (if any) to the bag timestamp."""
+    header = getattr(msg, "header", None)
+    if header is not None:
+        header.stamp = typestore.types["builtin_interfaces/msg/Time"](
+            sec=timestamp // 1_000_000_000, nanosec=timestamp % 1_000_000_000)
+    return msg
+
+
+# ====================================================================
+# Mission layout: bag start times, sessions, mode schedule
+# ====================================================================
+def plan_mission(num_bags, bag_duration_s, session_bags, session_gap_s, mode_interval_s, seed):
+    """Return (bags, mode_changes).
+
+    bags is [(name, start_ns, end_ns)]; mode_changes is [(timestamp_ns, mode)]
+    sorted, starting with the mode active at the first bag's start.
+    """
+    rng = random.Random(seed)
+    bags = []
+    t = START_TIME_NS
+    session_start = t
+    index = 0
+    for i in range(num_bags):
+        if i and i % session_bags == 0:
+            t += int(session_gap_s * 1e9 * rng.uniform(0.5, 1.5))  # recorder restarted
+            session_start = t
+            index = 0
+        stem = time.strftime("%Y%m%d_%H%M%S", time.gmtime(session_start // 1_000_000_000))
+        end = t + int(bag_duration_s * 1e9)
+        bags.append((f"{stem}_{index}.db3", t, end))
+        index += 1
+        t = end + rng.randint(0, 5_000_000)  # split bags are (nearly) back to back
+
+    mode_changes = [(START_TIME_NS, rng.choice(MODES))]
+    if mode_interval_s > 0:
+        t = START_TIME_NS
+        while True:
+            t += int(rng.expovariate(1.0 / mode_interval_s) * 1e9) + 1
+            if t >= bags[-1][2]:
+                break
+            mode = rng.choice([m for m in MODES if m != mode_changes[-1][1]])
+            mode_changes.append((t, mode))
+    return bags, mode_changes
+
+
+def battery_level(field_full, timestamp, rng):
+    hours = (timestamp - START_TIME_NS) / 3.6e12
+    level = max(0.05, 1.0 - DISCHARGE_PER_HOUR * hours) * field_full
+    return level + rng.gauss(0.0, 0.00002 * field_full)
+
+
+# ====================================================================
+# One bag
+# ====================================================================
+def write_bag(args_tuple):
+    """Worker: write one bag to out_dir/name. Returns (name, messages, bytes)."""
+    (out_dir, name, start, end, mode_changes, topics, rate_scale, blob_bytes, filler_bytes, seed) = args_tuple
+    typestore = extract_bag.typestore
+    rng = random.Random(seed)
+
+    # Message times per topic: evenly spaced at the topic's rate with a little jitter
+    schedule = []
+    duration_s = (end - start) / 1e9
+    for topic_index, (topic, msgtype, per_bag) in enumerate(topics):
+        rate = per_bag / REFERENCE_BAG_S * rate_scale
+        expected = rate * duration_s
+        count = int(expected) + (rng.random() < expected - int(expected))
+        if count <= 0:
+            continue
+        period = (end - start) / count
+        offset = rng.uniform(0, period)
+        for k in range(count):
+            jitter = rng.uniform(-0.05, 0.05) * period
+            timestamp = min(end - 1, max(start, int(start + offset + k * period + jitter)))
+            schedule.append((timestamp, topic_index))
+
+    # Mode feedback: the current mode at bag start plus every change inside the bag
+    current = mode_changes[0][1]
+    for timestamp, mode in mode_changes:
+        if timestamp <= start:
+            current = mode
+        elif timestamp < end:
+            schedule.append((timestamp, -1))
+    feedback_modes = {timestamp: mode for timestamp, mode in mode_changes if start < timestamp < end}
+    schedule.append((start, -1))
+    feedback_modes[start] = current
+    schedule.sort()
+
+    tmp_dir = tempfile.mkdtemp(prefix=".gen-", dir=out_dir)
+    bag_dir = os.path.join(tmp_dir, "bag")
+    variants = {}
+    messages = 0
+    with Writer(bag_dir, version=9) as writer:
+        connections = {}
+        for topic, msgtype, _ in topics:
+            if msgtype in typestore.types:
+                connections[topic] = writer.add_connection(topic, msgtype, typestore=typestore)
+                if topic not in BATTERY_FIELDS:
+                    variants[topic] = [
+                        typestore.serialize_cdr(random_message(typestore, msgtype, rng, blob_bytes), msgtype)
+                        for _ in range(PAYLOAD_VARIANTS)
+                    ]
+            else:
+                rihs01 = "RIHS01_" + hashlib.sha256(f"{msgtype}\n{FILLER_MSGDEF}".encode()).hexdigest()
+                connections[topic] = writer.add_connection(topic, msgtype, msgdef=FILLER_MSGDEF, rihs01=rihs01)
+                variants[topic] = [
+                    b"\x00\x01\x00\x00" + int.to_bytes(filler_bytes, 4, "little") + rng.randbytes(filler_bytes)
+                    for _ in range(PAYLOAD_VARIANTS)
+                ]
+        feedback = writer.add_connection(FEEDBACK_TOPIC, FEEDBACK_TYPE, typestore=typestore)
+
+        for timestamp, topic_index in schedule:
+            if topic_index < 0:
+                msg = stamp(typestore, random_message(typestore, FEEDBACK_TYPE, rng, blob_bytes), timestamp)
+                msg.current_mode_name = feedback_modes[timestamp]
+                msg.current_mode = MODES.index(msg.current_mode_name)
+                writer.write(feedback, timestamp, typestore.serialize_cdr(msg, FEEDBACK_TYPE))
+            else:
+                topic, msgtype, _ = topics[topic_index]
+                if topic in BATTERY_FIELDS:
+                    msg = stamp(typestore, random_message(typestore, msgtype, rng, blob_bytes), timestamp)
+                    field, full = BATTERY_FIELDS[topic]
+                    level = battery_level(full, timestamp, rng)
+                    if topic == "/battery_state" and rng.random() < NAN_BATTERY_RATE:
+                        level = math.nan
+                    setattr(msg, field, level)
+                    payload = typestore.serialize_cdr(msg, msgtype)
+                elif topic == "/pm/feedback":
+                    msg = typestore.deserialize_cdr(rng.choice(variants[topic]), msgtype)
+                    msg.header.frame_id = rng.choice(CARD_IDS)
+                    payload = typestore.serialize_cdr(stamp(typestore, msg, timestamp), msgtype)
+                else:
+                    payload = rng.choice(variants[topic])
+                writer.write(connections[topic], timestamp, payload)
+            messages += 1
+
+    db3 = next(entry.path for entry in os.scandir(bag_dir) if entry.name.endswith(".db3"))
+    final_path = os.path.join(out_dir, name)
+    os.replace(db3, final_path)
+    shutil.rmtree(tmp_dir)
+    return name, messages, os.path.getsize(final_path)
+
+
+def generate(out_dir, num_bags, bag_duration_s=REFERENCE_BAG_S, session_bags=100, session_gap_s=600,
+             mode_interval_s=300, rate_scale=1.0, topics="all", blob_bytes=256, filler_bytes=128,
+             seed=0, workers=None, quiet=False):
+    """Generate a mission of num_bags bags in out_dir. Returns [(name, messages, bytes)]."""
+    topic_list = read_topic_list()
+    if topics == "processed":
+        keep = set(extract_bag.TOPIC_PROCESSORS) | {"/battery_state"}
+        topic_list = [entry for entry in topic_list if entry[0] in keep]
+    topic_list = [entry for entry in topic_list if entry[0] != FEEDBACK_TOPIC]
+
+    os.makedirs(out_dir, exist_ok=True)
+    bags, mode_changes = plan_mission(num_bags, bag_duration_s, session_bags, session_gap_s, mode_interval_s, seed)
+    worker_args = [
+        (out_dir, name, start, end, mode_changes, topic_list, rate_scale, blob_bytes, filler_bytes,
+         seed * 1_000_003 + i)
+        for i, (name, start, end) in enumerate(bags)
+    ]
+
+    results = []
+    with Pool(processes=min(workers or os.cpu_count(), len(worker_args))) as pool:
+        for result in pool.imap_unordered(write_bag, worker_args):
+            results.append(result)
+            if not quiet and (len(results) % 10 == 0 or len(results) == len(worker_args)):
+                print(f"  Wrote {len(results)}/{len(worker_args)} bags...")
+    results.sort(key=lambda r: extract_bag.natural_sort_key(r[0]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic rosbags for extraction benchmarks")
+    parser.add_argument("out_dir", help="Output directory for the .db3 files")
+    parser.add_argument("--bags", type=int, default=12, help="Number of split bags (default: 12)")
+    parser.add_argument("--bag-duration", type=float, default=REFERENCE_BAG_S,
+                        help=f"Seconds per bag (default: {REFERENCE_BAG_S})")
+    parser.add_argument("--session-bags", type=int, default=100,
+                        help="Bags per recording session; sessions are separated by a gap (default: 100)")
+    parser.add_argument("--session-gap", type=float, default=600,
+                        help="Mean seconds between recording sessions (default: 600)")
+    parser.add_argument("--mode-interval", type=float, default=300,
+                        help="Mean seconds between mode changes, 0 = one mode throughout (default: 300)")
+    parser.add_argument("--rate-scale", type=float, default=1.0, help="Multiplier on every topic rate")
+    parser.add_argument("--topics", choices=["all", "processed"], default="all",
+                        help="all topics in rosbag-topics.txt, or only those extract-bag.py reads")
+    parser.add_argument("--blob-bytes", type=int, default=256, help="Length of byte arrays (costmaps, streams)")
+    parser.add_argument("--filler-bytes", type=int, default=128, help="Payload size for topics without a schema")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel bag writers")
+    parser.add_argument("--force", action="store_true", help="Delete existing .db3 files in out_dir first")
+    args = parser.parse_args()
+
+    existing = [name for name in os.listdir(args.out_dir) if name.endswith(".db3")] if os.path.isdir(args.out_dir) else []
+    if existing and not args.force:
+        print(f"ERROR: {args.out_dir} already has {len(existing)} .db3 files (use --force to replace them)")
+        sys.exit(1)
+    for name in existing:
+        os.remove(os.path.join(args.out_dir, name))
+
+    start = time.time()
+    print(f"=== Generating {args.bags} bags ({args.bag_duration:.0f}s each) in {args.out_dir} ===")
+    results = generate(args.out_dir, args.bags, args.bag_duration, args.session_bags, args.session_gap,
+                       args.mode_interval, args.rate_scale, args.topics, args.blob_bytes, args.filler_bytes,
+                       args.seed, args.workers)
+    messages = sum(r[1] for r in results)
+    size_mb = sum(r[2] for r in results) / (1024 * 1024)
+    print(f"  {len(results)} bags, {messages:,} messages, {size_mb:.0f} MB "
+          f"({size_mb / len(results):.1f} MB/bag) in {time.time() - start:.1f}s")
+    print(f"  First: {results[0][0]}")
+    print(f"  Last:  {results[-1][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Micro-benchmark for the Pass 2 line-protocol serializer.
+
+Builds synthetic ekf_euler and power_mgmt topic buffers (fields come from
+the real topic processors), then serializes them two ways:
+
+  - point:      create_point(...).to_line_protocol() per row (the original path)
+  - serializer: LineProtocolSerializer.serialize() on the whole buffer
+
+and reports points/sec for each. The serializer output must be
+byte-identical to the Point output (empty Point lines excluded), otherwise
+the script exits non-zero.
+
+Usage:
+    python3 benchmarking/line-protocol-benchmark.py
+    python3 benchmarking/line-protocol-benchmark.py --rows 200000 --repeat 5
+"""
+import argparse
+import importlib.util
+import math
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace as NS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(extract_bag)
+
+MODES = ["UNKNOWN", "Idle", "Navigation", "Direct", "Station"]
+CARD_IDS = ["card_1", "card_2", "card 3", "pm,aux", ""]
+
+
+def _float(rng):
+    # Mix of ordinary, whole-number and occasional non-finite values
+    r = rng.random()
+    if r < 0.01:
+        return math.nan
+    if r < 0.02:
+        return float(rng.randint(0, 50))
+    return rng.uniform(-1000.0, 1000.0)
+
+
+def ekf_euler_msg(rng):
+    status = NS(solution_mode=rng.randint(0, 4),
+                **{name: rng.random() < 0.5 for name in (
+                    "attitude_valid", "heading_valid", "velocity_valid", "position_valid",
+                    "vert_ref_used", "mag_ref_used", "gps1_vel_used", "gps1_pos_used",
+                    "gps1_course_used", "gps1_hdt_used", "gps2_vel_used", "gps2_pos_used",
+                    "gps2_course_used", "gps2_hdt_used", "odo_used")})
+    return NS(angle=NS(x=_float(rng), y=_float(rng), z=rng.uniform(-math.pi, math.pi)),
+              accuracy=NS(x=_float(rng), y=_float(rng), z=_float(rng)),
+              time_stamp=rng.randint(0, 2**32), status=status)
+
+
+def power_mgmt_msg(rng):
+    msg = NS(header=NS(frame_id=rng.choice(CARD_IDS)))
+    for name in ("load_current", "bus_voltage", "temperature", "control_current",
+                 "averaged_time", "value_tripped", "startup_current"):
+        setattr(msg, name, _float(rng))
+    for name in ("load_on_off", "adc_on_off", "card_limit_tripped", "switch_on_off",
+                 "watchdog_status", "reboot", "power_mode_on_off", "power_mode_status",
+                 "curr_max", "curr_max_warn", "volt_max", "volt_max_warn", "volt_min_warn",
+                 "volt_min", "temp_card_max", "temp_card_max_warn"):
+        setattr(msg, name, rng.random() < 0.5)
+    return msg
+
+
+def build_buffer(topic, make_msg, rows, rng):
+    buffers = {}
+    processor = extract_bag.TOPIC_PROCESSORS[topic][1]
+    t = 1_771_822_819_000_000_000
+    for _ in range(rows):
+        fields, extra_tags = processor(make_msg(rng))
+        extract_bag.append_to_buffer(buffers, topic, t, fields, extra_tags)
+        t += rng.randint(1, 50_000_000)
+    buffer = buffers[topic]
+    mode_codes = [rng.randrange(len(MODES)) for _ in range(rows)]
+    return buffer, mode_codes
+
+
+def point_lines(measurement, buffer, mode_codes, tags_by_code):
+    columns = list(buffer["columns"].items())
+    lines = []
+    for row, timestamp in enumerate(buffer["timestamps"]):
+        fields = {name: column[row] for name, column in columns if column[row] is not None}
+        extra_tags = buffer["extra_tags"][row] or {}
+        point = extract_bag.create_point(measurement, timestamp, fields, tags_by_code[mode_codes[row]], extra_tags)
+        line = point.to_line_protocol()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def best_of(repeat, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Line-protocol serializer micro-benchmark")
+    parser.add_argument("--rows", type=int, default=50_000, help="Rows per topic buffer")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method (best is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [
+        ("/imu/ellipse/sbg_ekf_euler", ekf_euler_msg),
+        ("/pm/feedback", power_mgmt_msg),
+    ]
+
+    print(f"{'measurement':<12} {'rows':>8} {'point (pts/s)':>14} {'serializer (pts/s)':>19} {'speedup':>8}  check")
+    failed = False
+    for topic, make_msg in cases:
+        measurement = extract_bag.TOPIC_PROCESSORS[topic][0]
+        buffer, mode_codes = build_buffer(topic, make_msg, args.rows, rng)
+
+        def run_serializer():
+            # Fresh serializer per run so prefix/key caches are built inside the timing
+            serializer = extract_bag.LineProtocolSerializer("bench", "vessel-1", MODES)
+            return serializer.serialize(measurement, buffer, mode_codes)
+
+        tags_by_code = extract_bag.LineProtocolSerializer("bench", "vessel-1", MODES).tags_by_code
+        point_elapsed, expected = best_of(args.repeat, lambda: point_lines(measurement, buffer, mode_codes, tags_by_code))
+        fast_elapsed, actual = best_of(args.repeat, run_serializer)
+
+        check = "identical" if "\n".join(actual).encode() == "\n".join(expected).encode() else "MISMATCH"
+        failed |= check == "MISMATCH"
+        print(f"{measurement:<12} {args.rows:>8} {args.rows / point_elapsed:>14,.0f} "
+              f"{args.rows / fast_elapsed:>19,.0f} {point_elapsed / fast_elapsed:>7.1f}x  {check}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
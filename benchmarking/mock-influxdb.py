@@ -0,0 +1,200 @@
+"""Local stand-in for InfluxDB's /api/v2/write, for offline write-path tests.
+
+Accepts line-protocol writes the way InfluxDB 2.x does (gzip or plain
+bodies, 204 No Content on success) and can add per-request latency and
+reject a fraction of writes with 429 Too Many Requests / 503 Service
+Unavailable (with a Retry-After header), so Pass 2 throughput, the writer
+stage's backpressure and the sink's retry handling can be exercised on a
+laptop with no network. Nothing is stored unless --output is given.
+
+Prints per-interval and final request/line/byte counts and latency
+percentiles; --stats-json writes the final numbers as JSON on exit.
+
+Usage:
+    python3 benchmarking/mock-influxdb.py --port 8087
+    python3 benchmarking/mock-influxdb.py --port 8087 --latency-ms 20 --jitter-ms 10 --error-rate 0.05
+    python3 extract-bag.py --mission test --bag-dir /path/to/rosbags/ --workers 8 \
+        --influx-url http://localhost:8087
+"""
+import argparse
+import gzip
+import json
+import random
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WriteStats:
+    """Counters shared by the handler threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = {}  # status -> count
+        self.deletes = 0    # /api/v2/delete requests (not counted as writes)
+        self.lines = 0
+        self.bytes = 0      # uncompressed body bytes accepted
+        self.latencies = []  # seconds per accepted write, including injected latency
+        self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.time() - self.started
+
+            def percentile(p):
+                return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+            return {
+                "elapsed_s": round(elapsed, 3),
+                "requests": self.requests,
+                "accepted": len(latencies),
+                "rejected": dict(sorted(self.rejected.items())),
+                "deletes": self.deletes,
+                "lines": self.lines,
+                "bytes": self.bytes,
+                "lines_per_s": round(self.lines / elapsed, 1) if elapsed else 0.0,
+                "p50_ms": round(percentile(0.50), 2),
+                "p99_ms": round(percentile(0.99), 2),
+            }
+
+
+def make_handler(args, stats, output):
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+    output_lock = threading.Lock()
+
+    class WriteHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+        def _reply(self, status, body=b"", headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            if body:
+                self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith(("/ping", "/health")):
+                self._reply(204 if self.path.startswith("/ping") else 200,
+                            b"" if self.path.startswith("/ping") else b'{"status":"pass"}')
+            else:
+                self._reply(404, b'{"code":"not found","message":"path not found"}')
+
+        def do_POST(self):
+            start = time.perf_counter()
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.startswith("/api/v2/delete"):
+                # Re-tagging after a timeline change issues deletes; accept and count them
+                with stats.lock:
+                    stats.deletes += 1
+                self._reply(204)
+                return
+            if not self.path.startswith("/api/v2/write"):
+                self._reply(404, b'{"code":"not found","message":"path not found"}')
+                return
+
+            with rng_lock:
+                delay = max(0.0, args.latency_ms + rng.uniform(-args.jitter_ms, args.jitter_ms)) / 1000
+                status = rng.choice(args.error_status) if rng.random() < args.error_rate else None
+            if delay:
+                time.sleep(delay)
+
+            with stats.lock:
+                stats.requests += 1
+                if status:
+                    stats.rejected[status] = stats.rejected.get(status, 0) + 1
+            if status:
+                message = "too many requests" if status == 429 else "service unavailable"
+                self._reply(status, json.dumps({"code": "unavailable", "message": message}).encode(),
+                            [("Retry-After", str(args.retry_after))])
+                return
+
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            lines = sum(1 for line in body.split(b"\n") if line.strip())
+            if output:
+                with output_lock:
+                    output.write(body.rstrip(b"\n") + b"\n")
+            with stats.lock:
+                stats.lines += lines
+                stats.bytes += len(body)
+                stats.latencies.append(time.perf_counter() - start)
+            self._reply(204)
+
+        def log_message(self, format, *log_args):
+            pass
+
+    return WriteHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock InfluxDB /api/v2/write server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8087, help="Listen port (default: 8087, next to a real 8086)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per write request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform ± jitter on --latency-ms")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of write requests rejected (0-1, default: 0)")
+    parser.add_argument("--error-status", type=int, nargs="+", choices=[429, 503], default=[429, 503],
+                        help="Status codes used for rejected writes (default: 429 503)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on rejected writes")
+    parser.add_argument("--output", help="Append accepted line protocol to this file")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="Seconds between progress lines (0 = off)")
+    parser.add_argument("--stats-json", help="Write final counters to this JSON file on exit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not 0.0 <= args.error_rate <= 1.0:
+        print("ERROR: --error-rate must be between 0 and 1")
+        sys.exit(1)
+
+    stats = WriteStats()
+    output = open(args.output, "ab") if args.output else None
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, stats, output))
+    server.daemon_threads = True
+
+    def report():
+        while args.stats_interval > 0:
+            time.sleep(args.stats_interval)
+            s = stats.snapshot()
+            print(f"  {s['elapsed_s']:.0f}s: {s['requests']} requests, {s['lines']} lines "
+                  f"({s['lines_per_s']:,.0f}/s), rejected {s['rejected']}, p50 {s['p50_ms']} ms", flush=True)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # SIGTERM (e.g. kill from a benchmark script) shuts down like Ctrl-C
+    signal.signal(signal.SIGTERM, stop)
+    threading.Thread(target=report, daemon=True).start()
+    print(f"Mock InfluxDB listening on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms}±{args.jitter_ms} ms, error rate {args.error_rate:.0%})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if output:
+            output.close()
+
+    final = stats.snapshot()
+    print("\n=== Mock InfluxDB summary ===")
+    print(f"  Requests: {final['requests']} ({final['accepted']} accepted, rejected {final['rejected']})")
+    print(f"  Lines:    {final['lines']} ({final['bytes'] / (1024 * 1024):.1f} MB, {final['lines_per_s']:,.0f} lines/s)")
+    print(f"  Latency:  p50 {final['p50_ms']} ms, p99 {final['p99_ms']} ms")
+    if final["deletes"]:
+        print(f"  Deletes:  {final['deletes']}")
+    if args.stats_json:
+        with open(args.stats_json, "w") as f:
+            json.dump(final, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Startup and per-task overhead of the message registry (msg_registry.py).
+
+Two measurements:
+
+  - cold start: a fresh interpreter importing extract-bag.py, once without
+    the parsed-definitions cache (tracking/msg-types-<hash>.pkl) and then
+    with it. --script times another copy instead, e.g. an older
+    extract-bag.py from git, for a before/after comparison.
+  - per task: what a worker spends before its first message. "rebuild" is
+    what every task used to do (new typestore, get_types_from_msg over all
+    definitions, register, new CdrDecoders and compiling the decoders for
+    the Pass 2 topics); "shared" is the same through shared_decoders(),
+    which after a worker's first task (here: the import above) is a cache
+    hit.
+
+Usage:
+    python3 benchmarking/registry-startup-benchmark.py
+    python3 benchmarking/registry-startup-benchmark.py --repeat 20
+    git show HEAD~1:extract-bag.py > /tmp/extract-old.py
+    python3 benchmarking/registry-startup-benchmark.py --script /tmp/extract-old.py
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(extract_bag)
+
+import msg_registry  # noqa: E402
+from cdr_decode import CdrDecoders  # noqa: E402
+from rosbags.typesys import Stores, get_typestore  # noqa: E402
+from rosbags.typesys.msg import get_types_from_msg  # noqa: E402
+
+TOPICS_FILE = os.path.join(REPO_DIR, "rosbag-topics.txt")
+
+IMPORT_SNIPPET = """
+import importlib.util, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("extract_bag", {script!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+"""
+
+
+def pass2_msgtypes():
+    """Message types of the topics Pass 2 decodes, from rosbag-topics.txt."""
+    msgtypes = set()
+    with open(TOPICS_FILE) as f:
+        for line in f:
+            parts = [part.strip() for part in line.split("|")]
+            if len(parts) == 3 and parts[0] in extract_bag.TOPIC_PROCESSORS:
+                msgtypes.add(parts[1])
+    return sorted(msgtypes)
+
+
+def import_seconds(script):
+    """Seconds a fresh interpreter spends importing script, and its total wall time."""
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(repo=REPO_DIR, script=script)],
+                         capture_output=True, text=True, check=True, cwd=REPO_DIR)
+    return float(out.stdout.strip().splitlines()[-1]), time.perf_counter() - start
+
+
+def rebuild_task(msgtypes):
+    typestore = get_typestore(Stores.ROS2_HUMBLE)
+    types = {}
+    for msgtype, msgdef in msg_registry.CUSTOM_MSG_DEFS:
+        types.update(get_types_from_msg(msgdef, msgtype))
+    typestore.register(types)
+    decoders = CdrDecoders(typestore)
+    for msgtype in msgtypes:
+        decoders.get(msgtype)
+
+
+def shared_task(msgtypes):
+    decoders = msg_registry.shared_decoders()
+    for msgtype in msgtypes:
+        decoders.get(msgtype)
+
+
+def timed(repeat, fn):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message registry startup / per-task benchmark")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per measurement (median is reported)")
+    parser.add_argument("--script", default=os.path.join(REPO_DIR, "extract-bag.py"),
+                        help="extract-bag.py copy to time the import of (default: this checkout's)")
+    args = parser.parse_args()
+
+    cache_path = os.path.join(msg_registry.TYPES_CACHE_DIR, f"msg-types-{msg_registry.DEFS_HASH[:16]}.pkl")
+    print(f"Cold start (fresh interpreter importing {os.path.relpath(args.script, REPO_DIR)}):")
+    for label, keep_cache in (("no types cache", False), ("types cache", True)):
+        imports, walls = [], []
+        for _ in range(args.repeat):
+            if not keep_cache and os.path.exists(cache_path):
+                os.remove(cache_path)
+            seconds, wall = import_seconds(args.script)
+            imports.append(seconds)
+            walls.append(wall)
+        print(f"  {label:<16} import {statistics.median(imports) * 1000:8.1f} ms   "
+              f"process {statistics.median(walls) * 1000:8.1f} ms")
+
+    msgtypes = pass2_msgtypes()
+    print(f"\nPer-task setup ({len(msgtypes)} Pass 2 message types decoded):")
+    rebuild = timed(args.repeat, lambda: rebuild_task(msgtypes))
+    shared = timed(args.repeat, lambda: shared_task(msgtypes))
+    print(f"  rebuild per task  {statistics.median(rebuild) * 1000:8.2f} ms")
+    print(f"  shared            {statistics.median(shared) * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Reproducible extraction benchmark: synthetic bags → extract-bag.py → results JSON.
+
+For every scale (number of bags) a dataset is generated once with
+generate-bags.py and cached under --data-dir, keyed by the generator
+arguments and the generator's source, so reruns and other machines get
+the same bags. extract-bag.py is then run on it for every worker count
+(with --force and --no-scan-cache, so every pass does its full work, and a
+sink that needs no server — null by default) and its --stats-json output
+is turned into files/sec, points/sec and MB/sec per pass.
+
+Results are written as JSON and compared with a stored baseline: a pass
+whose MB/sec drops by more than --tolerance, or whose point count changes,
+is flagged and the script exits non-zero. Passes shorter than
+--min-seconds are shown but not flagged (too noisy at small scales).
+
+Usage:
+    python3 benchmarking/run-benchmarks.py
+    python3 benchmarking/run-benchmarks.py --scales 8 32 --workers 1 4 8 --repeat 3
+    python3 benchmarking/run-benchmarks.py --extra-args="--fused --columnar"
+    python3 benchmarking/run-benchmarks.py --save-baseline        # record this machine's numbers
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+EXTRACT_SCRIPT = os.path.join(REPO_DIR, "extract-bag.py")
+GENERATOR_SCRIPT = os.path.join(BENCH_DIR, "generate-bags.py")
+BASELINE_PATH = os.path.join(BENCH_DIR, "extraction-baseline.json")
+PASSES = ["pass1", "pass1b", "pass2", "total"]
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("generate_bags", GENERATOR_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["generate_bags"] = module  # its Pool workers are looked up by module name
+    spec.loader.exec_module(module)
+    return module
+
+
+def dataset_dir(data_dir, bags, generator_args):
+    """Cache directory for one scale, keyed by generator arguments and source."""
+    with open(GENERATOR_SCRIPT, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    key = hashlib.sha256(json.dumps([bags, generator_args, source_hash], sort_keys=True).encode()).hexdigest()
+    return os.path.join(data_dir, f"bags-{bags}-{key[:12]}")
+
+
+def ensure_dataset(data_dir, bags, generator_args):
+    """Generate (or reuse) the dataset for one scale. Returns (path, size_mb)."""
+    path = dataset_dir(data_dir, bags, generator_args)
+    manifest = os.path.join(path, "dataset.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            return path, json.load(f)["size_mb"]
+
+    print(f"  Generating {bags} bags in {path}...")
+    start = time.time()
+    for name in os.listdir(path) if os.path.isdir(path) else []:
+        if name.endswith(".db3"):
+            os.remove(os.path.join(path, name))  # partial earlier attempt
+    results = load_generator().generate(path, bags, quiet=True, **generator_args)
+    size_mb = sum(size for _, _, size in results) / (1024 * 1024)
+    with open(manifest, "w") as f:
+        json.dump({"bags": bags, "generator": generator_args, "size_mb": size_mb,
+                   "messages": sum(count for _, count, _ in results)}, f, indent=2)
+    print(f"    {size_mb:.0f} MB in {time.time() - start:.1f}s")
+    return path, size_mb
+
+
+def run_extraction(bag_dir, bags, workers, sink_args, extra_args):
+    """Run extract-bag.py once and return its --stats-json dict."""
+    with tempfile.TemporaryDirectory(prefix="extract-bench-") as tmp:
+        stats_path = os.path.join(tmp, "stats.json")
+        command = [sys.executable, EXTRACT_SCRIPT, "--mission", f"benchmark-{bags}", "--bag-dir", bag_dir,
+                   "--workers", str(workers), "--force", "--no-scan-cache", "--stats-json", stats_path,
+                   *sink_args, *extra_args]
+        proc = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True)
+        if proc.returncode != 0 or not os.path.exists(stats_path):
+            print(f"ERROR: extract-bag.py failed ({' '.join(command[1:])})")
+            print("\n".join((proc.stdout + proc.stderr).splitlines()[-20:]))
+            sys.exit(1)
+        with open(stats_path) as f:
+            return json.load(f)
+
+
+def pass_rates(stats):
+    """Per-pass (and total) seconds, counts and rates from one run's stats."""
+    passes = {}
+    for name, p in stats["passes"].items():
+        passes[name] = dict(p)
+    total_points = sum(p["points"] for p in stats["passes"].values())
+    pass2 = stats["passes"].get("pass2") or stats["passes"]["pass1"]
+    passes["total"] = {"seconds": stats["total_seconds"], "files": pass2["files"], "mb": pass2["mb"],
+                       "points": total_points}
+    for p in passes.values():
+        seconds = max(p["seconds"], 1e-9)
+        p["files_per_s"] = p["files"] / seconds
+        p["mb_per_s"] = p["mb"] / seconds
+        p["points_per_s"] = p["points"] / seconds
+    return passes
+
+
+def best_run(runs):
+    """Combine repeats: fastest time per pass (counts are identical across repeats)."""
+    best = {}
+    for passes in runs:
+        for name, p in passes.items():
+            if name not in best or p["seconds"] < best[name]["seconds"]:
+                best[name] = p
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"\n{'run':<24} {'pass':<7} {'seconds':>8} {'files/s':>8} {'MB/s':>8} {'points/s':>11} {'points':>9}")
+    for run in results["runs"]:
+        for name in PASSES:
+            p = run["passes"].get(name)
+            if p:
+                print(f"{run['key']:<24} {name:<7} {p['seconds']:>8.2f} {p['files_per_s']:>8.2f} "
+                      f"{p['mb_per_s']:>8.1f} {p['points_per_s']:>11,.0f} {p['points']:>9}")
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Print a comparison against the baseline; return the number of flagged passes."""
+    base_meta = baseline.get("meta", {})
+    meta = results["meta"]
+    print(f"\n=== Compared with baseline ({base_meta.get('date', '?')}, commit {base_meta.get('commit')}) ===")
+    if (base_meta.get("host"), base_meta.get("cpu_count")) != (meta["host"], meta["cpu_count"]):
+        print(f"  NOTE: baseline was recorded on {base_meta.get('host')} ({base_meta.get('cpu_count')} CPUs), "
+              f"this run on {meta['host']} ({meta['cpu_count']} CPUs) — compare with care")
+    if base_meta.get("generator") != meta["generator"]:
+        print("  NOTE: generator arguments differ from the baseline's")
+
+    base_runs = {run["key"]: run for run in baseline.get("runs", [])}
+    flagged = 0
+    print(f"{'run':<24} {'pass':<7} {'base MB/s':>10} {'MB/s':>8} {'change':>8}  status")
+    for run in results["runs"]:
+        base_run = base_runs.get(run["key"])
+        if base_run is None:
+            print(f"{run['key']:<24} {'':<7} {'':>10} {'':>8} {'':>8}  not in baseline")
+            continue
+        for name in PASSES:
+            p, b = run["passes"].get(name), base_run["passes"].get(name)
+            if not p or not b:
+                continue
+            change = p["mb_per_s"] / b["mb_per_s"] - 1 if b["mb_per_s"] else 0.0
+            if p["points"] != b["points"]:
+                status = f"POINTS CHANGED ({b['points']} → {p['points']})"
+                flagged += 1
+            elif change < -tolerance and max(p["seconds"], b["seconds"]) >= min_seconds:
+                status = "REGRESSION"
+                flagged += 1
+            elif change < -tolerance:
+                status = "slower (below --min-seconds, not flagged)"
+            elif change > tolerance:
+                status = "faster"
+            else:
+                status = "ok"
+            print(f"{run['key']:<24} {name:<7} {b['mb_per_s']:>10.1f} {p['mb_per_s']:>8.1f} {change:>+8.0%}  {status}")
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the extraction benchmark suite on synthetic bags")
+    parser.add_argument("--scales", type=int, nargs="+", default=[4, 16], help="Bag counts (default: 4 16)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Pass 2 worker counts (default: 1 4)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per configuration, fastest kept (default: 1)")
+    parser.add_argument("--extra-args", default="", help="Extra extract-bag.py arguments, e.g. \"--fused\"")
+    parser.add_argument("--sink", choices=["null", "count"], default="null",
+                        help="extract-bag.py sink when --influx-url is not given (default: null)")
+    parser.add_argument("--influx-url", help="Write to this InfluxDB (or mock-influxdb.py) instead of a local sink")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "extract-bag-benchmark"),
+                        help="Where generated datasets are cached")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed (default: 0)")
+    parser.add_argument("--mode-interval", type=float, default=300, help="Generator: mean seconds between mode changes")
+    parser.add_argument("--session-bags", type=int, default=100, help="Generator: bags per recording session")
+    parser.add_argument("--output", help="Results JSON (default: <data-dir>/results-<timestamp>.json)")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="Baseline results to compare with (default: benchmarking/extraction-baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.20,
+                        help="Allowed MB/s drop before a pass is flagged (default: 0.20 = 20%%)")
+    parser.add_argument("--min-seconds", type=float, default=1.0,
+                        help="Passes shorter than this are not flagged (default: 1.0)")
+    args = parser.parse_args()
+
+    generator_args = {"seed": args.seed, "mode_interval_s": args.mode_interval, "session_bags": args.session_bags}
+    sink_args = ["--sink", "influx", "--influx-url", args.influx_url] if args.influx_url else ["--sink", args.sink]
+    extra_args = shlex.split(args.extra_args)
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "generator": generator_args,
+            "sink": sink_args[1],
+            "extra_args": args.extra_args,
+        },
+        "runs": [],
+    }
+
+    print("=== Extraction benchmark ===")
+    for bags in args.scales:
+        bag_dir, size_mb = ensure_dataset(args.data_dir, bags, generator_args)
+        for workers in args.workers:
+            key = f"{bags} bags x {workers}w" + (f" {args.extra_args}" if args.extra_args else "")
+            runs = []
+            for _ in range(args.repeat):
+                stats = run_extraction(bag_dir, bags, workers, sink_args, extra_args)
+                runs.append(pass_rates(stats))
+            passes = best_run(runs)
+            results["runs"].append({"key": key, "bags": bags, "workers": workers, "input_mb": size_mb,
+                                    "passes": passes})
+            print(f"  {key}: {passes['total']['seconds']:.1f}s total, "
+                  f"pass 2 {passes['pass2']['mb_per_s']:.1f} MB/s")
+
+    print_results(results)
+
+    output = args.output or os.path.join(args.data_dir, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n  Results: {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"  Baseline saved: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"  No baseline at {args.baseline} (run with --save-baseline to record one)")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    flagged = compare(results, baseline, args.tolerance, args.min_seconds)
+    if flagged:
+        print(f"\n  {flagged} pass(es) flagged")
+        sys.exit(1)
+    print("\n  No regressions")
+
+
+if __name__ == "__main__":
+    main()
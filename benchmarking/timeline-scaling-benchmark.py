@@ -0,0 +1,167 @@
+"""Scaling benchmark for the mode-timeline builder (Pass 1, steps 3-7).
+
+Generates synthetic missions — split bags grouped into recording sessions,
+feedback events at random times — and times sweep_mode_segments from
+extract-bag.py at increasing event counts. At small sizes it also runs the
+original step functions (extend/split/gap/merge) and checks the output is
+identical.
+
+It then feeds small missions on a coarse 1 s grid (so events share
+timestamps with each other and with bag starts and ends) to
+IncrementalTimeline in random in-order batches, and checks every update
+against assemble_mode_timeline over the bags seen so far, both the
+timeline and the returned diff.
+
+Usage:
+    python3 benchmarking/timeline-scaling-benchmark.py
+    python3 benchmarking/timeline-scaling-benchmark.py --sizes 1000 10000 100000 1000000 --verify-max 2000
+    python3 benchmarking/timeline-scaling-benchmark.py --sizes 1000 --incremental-checks 20000
+"""
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import os
+import random
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(extract_bag)
+
+MODES = ["Idle", "Navigation", "Direct", "Station", "Voyage"]
+BAG_DURATION_NS = 120 * 1_000_000_000
+
+
+def synthetic_mission(num_events, events_per_bag=4, bags_per_session=250, seed=0):
+    """Return (bag_intervals, mode_events) shaped like a real multi-session mission."""
+    rng = random.Random(seed)
+    num_bags = max(1, num_events // events_per_bag)
+
+    bag_intervals = []
+    t = 1_771_822_819_000_000_000
+    for i in range(num_bags):
+        if i and i % bags_per_session == 0:
+            t += rng.randint(10, 3600) * 1_000_000_000  # recorder restarted
+        bag_intervals.append({"start_time": t, "end_time": t + BAG_DURATION_NS, "path": "", "bag_idx": i})
+        t += BAG_DURATION_NS + rng.randint(0, 500_000_000)
+
+    mode_events = []
+    for _ in range(num_events):
+        bag = bag_intervals[rng.randrange(num_bags)]
+        ts = rng.randint(bag["start_time"], bag["end_time"] - 1)
+        mode_events.append((ts, rng.choice(MODES), bag["bag_idx"]))
+    mode_events.sort(key=lambda x: x[0])
+    return bag_intervals, mode_events
+
+
+def coarse_mission(rng):
+    """A few bags and feedback events on a 1 s grid: ties everywhere."""
+    second = 1_000_000_000
+    bag_intervals = []
+    t = 1_771_822_819 * second
+    for i in range(rng.randint(1, 12)):
+        if i and rng.random() < 0.25:
+            t += rng.randint(3, 20) * second  # recorder restarted
+        duration = rng.randint(1, 6) * second
+        bag_intervals.append({"start_time": t, "end_time": t + duration, "path": "", "bag_idx": i})
+        t += duration + rng.choice([0, 0, second])
+
+    mode_events = []
+    for bag in bag_intervals:
+        for _ in range(rng.randint(0, 4)):
+            ts = rng.randrange(bag["start_time"], bag["end_time"] + 1, second)
+            mode_events.append((ts, rng.choice(MODES), bag["bag_idx"]))
+    mode_events.sort(key=lambda x: x[0])
+    return bag_intervals, mode_events
+
+
+def check_incremental(seed):
+    """Feed one coarse mission to IncrementalTimeline in random batches; False on the first mismatch."""
+    rng = random.Random(seed)
+    bag_intervals, mode_events = coarse_mission(rng)
+    cuts = sorted(rng.sample(range(1, len(bag_intervals)), rng.randint(0, len(bag_intervals) - 1)))
+    timeline = extract_bag.IncrementalTimeline()
+    for lo, hi in zip([0] + cuts, cuts + [len(bag_intervals)]):
+        applied = {(seg["start_time"], seg["mode"]): seg for seg in timeline.segments}
+        written, removed, _ = timeline.update(bag_intervals[lo:hi], [e for e in mode_events if lo <= e[2] < hi])
+        for seg in removed:
+            del applied[(seg["start_time"], seg["mode"])]
+        for seg in written:
+            applied[(seg["start_time"], seg["mode"])] = seg
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = extract_bag.assemble_mode_timeline(bag_intervals[:hi], [e for e in mode_events if e[2] < hi],
+                                                          verbose=False).segments
+        if timeline.segments != expected or sorted(applied.values(), key=lambda s: s["start_time"]) != expected:
+            return False
+    return True
+
+
+def legacy_steps(mode_events, bag_intervals, sessions):
+    segments = extract_bag.build_raw_segments(mode_events)
+    segments = extract_bag.extend_segments_to_sessions(segments, mode_events, bag_intervals, sessions)
+    segments = extract_bag.split_at_session_boundaries(segments, sessions)
+    segments = extract_bag.insert_gap_segments(segments, sessions)
+    return extract_bag.merge_consecutive_segments(segments)
+
+
+def sweep_steps(mode_events, bag_intervals, sessions):
+    segments = extract_bag.build_raw_segments(mode_events)
+    return extract_bag.sweep_mode_segments(segments, mode_events, sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mode timeline builder scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="Feedback event counts to benchmark")
+    parser.add_argument("--verify-max", type=int, default=2_000,
+                        help="Also run (and compare with) the original step functions up to this size")
+    parser.add_argument("--incremental-checks", type=int, default=2_000,
+                        help="Random batch sequences to check IncrementalTimeline against a full rebuild")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'events':>10} {'bags':>8} {'sessions':>8} {'segments':>9} "
+          f"{'sweep (s)':>10} {'ns/event':>9} {'original (s)':>13}  check")
+    for size in args.sizes:
+        bag_intervals, mode_events = synthetic_mission(size, seed=args.seed)
+        sessions = extract_bag.compute_recording_sessions(bag_intervals)
+
+        legacy_result = None
+        legacy_elapsed = None
+        if size <= args.verify_max:
+            legacy_input = copy.deepcopy(mode_events)
+            start = time.perf_counter()
+            legacy_result = legacy_steps(legacy_input, bag_intervals, sessions)
+            legacy_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = sweep_steps(mode_events, bag_intervals, sessions)
+        elapsed = time.perf_counter() - start
+
+        check = "-"
+        if legacy_result is not None:
+            check = "identical" if result == legacy_result else "MISMATCH"
+        legacy_str = f"{legacy_elapsed:.3f}" if legacy_elapsed is not None else "-"
+        print(f"{size:>10} {len(bag_intervals):>8} {len(sessions):>8} {len(result):>9} "
+              f"{elapsed:>10.3f} {elapsed / size * 1e9:>9.0f} {legacy_str:>13}  {check}")
+
+        if check == "MISMATCH":
+            sys.exit(1)
+
+    if args.incremental_checks:
+        failed = [seed for seed in range(args.seed, args.seed + args.incremental_checks)
+                  if not check_incremental(seed)]
+        print(f"\nIncrementalTimeline: {args.incremental_checks} random batch sequences, "
+              + (f"{len(failed)} MISMATCH (seeds {failed[:10]})" if failed else "identical"))
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Check the compiled CDR decoders (cdr_decode.py) against typestore.deserialize_cdr.
+
+For every topic in TOPIC_PROCESSORS found in the given bags, decodes each
+message both ways and compares every field (recursively, NaN == NaN,
+arrays element-wise) and the topic processor's output. Also reports
+decode time per message for both. Exits non-zero on any mismatch, or if a
+processed topic has no compiled decoder.
+
+Usage:
+    python3 benchmarking/verify-cdr-decoders.py /path/to/rosbags/
+    python3 benchmarking/verify-cdr-decoders.py /path/to/file.db3 --limit 2000
+"""
+import argparse
+import glob
+import importlib.util
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(extract_bag)
+
+from cdr_decode import CdrDecoders  # noqa: E402
+from rosbag_db import BagFile  # noqa: E402
+
+
+def same_value(a, b):
+    if isinstance(b, np.ndarray) or isinstance(a, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=np.asarray(b).dtype.kind == "f")
+    if isinstance(b, float) and isinstance(a, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) is type(b) and a == b
+
+
+def diff_message(fast, reference, path=""):
+    """Return the first differing field path, or None if identical."""
+    if hasattr(fast, "_fields"):
+        for name in fast._fields:
+            if not hasattr(reference, name):
+                return f"{path}{name} (missing in typestore message)"
+            result = diff_message(getattr(fast, name), getattr(reference, name), f"{path}{name}.")
+            if result:
+                return result
+        return None
+    if not same_value(fast, reference):
+        return f"{path.rstrip('.')}: {fast!r} != {reference!r}"
+    return None
+
+
+def same_processed(a, b):
+    fields_a, tags_a = a
+    fields_b, tags_b = b
+    return (tags_a == tags_b and fields_a.keys() == fields_b.keys()
+            and all(same_value(fields_a[k], fields_b[k]) for k in fields_a))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify compiled CDR decoders against the typestore")
+    parser.add_argument("paths", nargs="+", help=".db3 files or directories containing them")
+    parser.add_argument("--limit", type=int, default=0, help="Max messages per topic (0 = all)")
+    args = parser.parse_args()
+
+    bag_files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            bag_files.extend(sorted(glob.glob(os.path.join(path, "*.db3")), key=extract_bag.natural_sort_key))
+        else:
+            bag_files.append(path)
+
+    typestore = extract_bag.typestore
+    decoders = CdrDecoders(typestore)
+    stats = {}  # topic -> [count, mismatches, fast_s, typestore_s, first_diff]
+    failed = False
+
+    for bag_path in bag_files:
+        with BagFile(bag_path) as bag:
+            for topic, _, rawdata in bag.messages(extract_bag.TOPIC_PROCESSORS, ordered=False):
+                entry = stats.setdefault(topic, [0, 0, 0.0, 0.0, None, bag.msgtype(topic)])
+                if args.limit and entry[0] >= args.limit:
+                    continue
+                msgtype = bag.msgtype(topic)
+                decoder = decoders.get(msgtype)
+                if decoder is None:
+                    entry[0] += 1
+                    continue
+
+                start = time.perf_counter()
+                fast = decoder(rawdata)
+                mid = time.perf_counter()
+                reference = typestore.deserialize_cdr(rawdata, msgtype)
+                end = time.perf_counter()
+
+                entry[0] += 1
+                entry[2] += mid - start
+                entry[3] += end - mid
+
+                processor = extract_bag.TOPIC_PROCESSORS[topic][1]
+                diff = diff_message(fast, reference)
+                if diff is None and not same_processed(processor(fast), processor(reference)):
+                    diff = "processor output differs"
+                if diff:
+                    entry[1] += 1
+                    entry[4] = entry[4] or diff
+
+    print(f"{'topic':<32} {'msgtype':<50} {'msgs':>7} {'compiled µs':>12} {'typestore µs':>13}  check")
+    for topic in extract_bag.TOPIC_PROCESSORS:
+        if topic not in stats:
+            continue
+        count, mismatches, fast_s, ref_s, first_diff, msgtype = stats[topic]
+        if decoders.get(msgtype) is None:
+            print(f"{topic:<32} {msgtype:<50} {count:>7} {'-':>12} {'-':>13}  NO DECODER (typestore fallback)")
+            failed = True
+            continue
+        check = "identical" if not mismatches else f"{mismatches} MISMATCHES — {first_diff}"
+        failed |= bool(mismatches)
+        print(f"{topic:<32} {msgtype:<50} {count:>7} {fast_s / count * 1e6:>12.2f} "
+              f"{ref_s / count * 1e6:>13.2f}  {check}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""Precompiled CDR decoders for fixed-layout ROS2 messages.
+
+typestore.deserialize_cdr walks every field through a generic per-field
+unpack call and builds nested dataclasses. Our sensor messages are almost
+all fixed-size primitives (plus a header frame_id string), so this module
+flattens a message definition from the typestore into runs of primitives,
+compiles each run into one `struct.Struct`, and generates a decode
+function that goes from raw CDR bytes to nested namedtuples with the same
+field names — a drop-in for the topic processors.
+
+Supported: primitive fields, strings, fixed arrays and sequences of
+numeric primitives, nested messages. Anything else (sequences of
+messages, string arrays, byte/char/wstring, big-endian payloads) has no
+compiled decoder and goes through the typestore. A compiled decoder that
+fails on a message also falls back to the typestore for that message.
+"""
+import keyword
+import struct
+from collections import namedtuple
+
+import numpy as np
+from rosbags.typesys.base import Nodetype
+
+# ROS primitive → (struct format char, size); size is also the CDR alignment
+PRIMITIVES = {
+    "bool": ("?", 1),
+    "int8": ("b", 1),
+    "uint8": ("B", 1),
+    "int16": ("h", 2),
+    "uint16": ("H", 2),
+    "int32": ("i", 4),
+    "uint32": ("I", 4),
+    "int64": ("q", 8),
+    "uint64": ("Q", 8),
+    "float32": ("f", 4),
+    "float64": ("d", 8),
+}
+
+_UINT32 = struct.Struct("<I").unpack_from
+
+
+class UnsupportedLayout(Exception):
+    """The message definition can't be compiled; use the typestore instead."""
+
+
+class _Run:
+    """Consecutive fixed-size fields, unpacked with one struct call.
+
+    CDR aligns each primitive to its size relative to the start of the
+    payload, so the padding inside a run depends on where it starts
+    (mod 8). Layouts for all 8 start phases are precomputed.
+    """
+
+    def __init__(self):
+        self.leaves = []  # (kind, primitive, count) — kind is "scalar" or "array"
+        self.num_scalars = 0
+        self.num_arrays = 0
+        self.array_lines = []  # decode lines run after unpacking (arrays need the layout offsets)
+
+    def add_scalar(self, primitive):
+        self.leaves.append(("scalar", primitive, 1))
+        self.num_scalars += 1
+        return self.num_scalars - 1
+
+    def add_array(self, primitive, count):
+        self.leaves.append(("array", primitive, count))
+        self.num_arrays += 1
+        return self.num_arrays - 1
+
+    def layout(self, phase):
+        fmt = ["<"]
+        offset = phase
+        array_offsets = []
+        for kind, primitive, count in self.leaves:
+            char, size = PRIMITIVES[primitive]
+            pad = -offset % size
+            if pad:
+                fmt.append(f"{pad}x")
+            offset += pad
+            if kind == "scalar":
+                fmt.append(char)
+            else:
+                array_offsets.append(offset - phase)
+                fmt.append(f"{size * count}x")
+            offset += size * count
+        return struct.Struct("".join(fmt)), tuple(array_offsets)
+
+    def layouts(self):
+        return tuple(self.layout(phase) for phase in range(8))
+
+
+class _DecoderBuilder:
+    """Generates the source of decode(data) for one message type."""
+
+    def __init__(self, typestore):
+        self.typestore = typestore
+        self.lines = []
+        self.namespace = {"frombuffer": np.frombuffer, "UINT32": _UINT32}
+        self.run = None
+        self.counter = 0
+
+    def _name(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def _current_run(self):
+        if self.run is None:
+            self.run = (self._name("r"), _Run())
+        return self.run
+
+    def flush_run(self):
+        if self.run is None:
+            return
+        name, run = self.run
+        self.run = None
+        layouts = f"{name}_layouts"
+        self.namespace[layouts] = run.layouts()
+        self.lines.append(f"st, offsets = {layouts}[(pos - 4) & 7]")
+        self.lines.append(f"{name} = st.unpack_from(data, pos)")
+        self.lines.extend(run.array_lines)
+        self.lines.append("pos += st.size")
+
+    def _align4(self):
+        # The payload starts at byte 4, so 4-byte alignment is the same absolute or relative
+        self.lines.append("pos = (pos + 3) & -4")
+
+    def message(self, msgtype):
+        """Emit decode steps for msgtype; return the expression that builds it."""
+        try:
+            consts, fields = self.typestore.fielddefs[msgtype]
+        except KeyError:
+            raise UnsupportedLayout(f"unknown type {msgtype}")
+
+        names = [name for name, _ in fields]
+        if any(not name.isidentifier() or keyword.iskeyword(name) or name.startswith("_") for name in names):
+            raise UnsupportedLayout(f"field names of {msgtype} are not valid identifiers")
+
+        cls_name = self._name("T")
+        cls = namedtuple(msgtype.replace("/", "__"), names)
+        for const_name, _, const_value in consts:
+            setattr(cls, const_name, const_value)
+        cls.__msgtype__ = msgtype
+        self.namespace[cls_name] = cls
+
+        args = [self.field(desc) for _, desc in fields]
+        return f"{cls_name}({', '.join(args)})"
+
+    def field(self, desc):
+        nodetype, detail = desc
+
+        if nodetype == Nodetype.NAME:
+            return self.message(detail)
+
+        if nodetype == Nodetype.BASE:
+            primitive = detail[0]
+            if primitive == "string":
+                return self.string()
+            if primitive not in PRIMITIVES:
+                raise UnsupportedLayout(f"primitive {primitive}")
+            name, run = self._current_run()
+            return f"{name}[{run.add_scalar(primitive)}]"
+
+        (subnode, subdetail), length = detail
+        if subnode != Nodetype.BASE or subdetail[0] not in PRIMITIVES:
+            raise UnsupportedLayout("array/sequence of non-numeric elements")
+        primitive = subdetail[0]
+        dtype = np.dtype("<" + PRIMITIVES[primitive][0])
+
+        if nodetype == Nodetype.ARRAY:
+            name, run = self._current_run()
+            index = run.add_array(primitive, length)
+            var = self._name("a")
+            run.array_lines.append(
+                f"{var} = frombuffer(data, dtype='{dtype.str}', count={length}, offset=pos + offsets[{index}])")
+            return var
+
+        if nodetype == Nodetype.SEQUENCE:
+            self.flush_run()
+            var = self._name("q")
+            size = PRIMITIVES[primitive][1]
+            self._align4()
+            self.lines.append("n = UINT32(data, pos)[0]")
+            self.lines.append("pos += 4")
+            if size > 4:
+                self.lines.append(f"if n: pos = ((pos - 4 + {size - 1}) & -{size}) + 4")
+            self.lines.append(f"{var} = frombuffer(data, dtype='{dtype.str}', count=n, offset=pos)")
+            self.lines.append(f"pos += n * {size}")
+            return var
+
+        raise UnsupportedLayout(f"node type {nodetype}")
+
+    def string(self):
+        self.flush_run()
+        var = self._name("s")
+        self._align4()
+        self.lines.append("n = UINT32(data, pos)[0]")
+        self.lines.append("end = pos + 4 + n")
+        self.lines.append("if n < 1 or end > len(data) or data[end - 1]: raise ValueError('bad string')")
+        self.lines.append(f"{var} = data[pos + 4:end - 1].decode()")
+        self.lines.append("pos = end")
+        return var
+
+
+def compile_decoder(typestore, msgtype):
+    """Return decode(rawdata) -> message for msgtype, or raise UnsupportedLayout."""
+    builder = _DecoderBuilder(typestore)
+    expr = builder.message(msgtype)
+    builder.flush_run()
+
+    body = [
+        "if data[0] != 0 or data[1] != 1: raise ValueError('not little-endian CDR')",
+        "pos = 4",
+        *builder.lines,
+        "if pos + 3 < len(data): raise ValueError('size mismatch')",
+        f"return {expr}",
+    ]
+    source = "def decode(data):\n" + "".join(f"    {line}\n" for line in body)
+    exec(compile(source, f"<cdr decoder {msgtype}>", "exec"), builder.namespace)
+    decode = builder.namespace["decode"]
+    decode.source = source
+    return decode
+
+
+class CdrDecoders:
+    """Per-process cache of compiled decoders with typestore fallback."""
+
+    def __init__(self, typestore):
+        self.typestore = typestore
+        self._decoders = {}
+
+    def get(self, msgtype):
+        """Compiled decoder for msgtype, or None if it has to use the typestore."""
+        if msgtype not in self._decoders:
+            try:
+                self._decoders[msgtype] = compile_decoder(self.typestore, msgtype)
+            except UnsupportedLayout:
+                self._decoders[msgtype] = None
+        return self._decoders[msgtype]
+
+    def deserialize(self, rawdata, msgtype):
+        decoder = self.get(msgtype)
+        if decoder is not None:
+            try:
+                return decoder(rawdata)
+            except Exception:
+                pass
+        return self.typestore.deserialize_cdr(rawdata, msgtype)
+
+
+# ====================================================================
+# Columnar layouts — a whole batch of same-shaped payloads as one array
+# ====================================================================
+def _align(pos, size):
+    # CDR alignment is relative to the payload, which starts after the 4-byte header
+    return ((pos - 4 + size - 1) & -size) + 4
+
+
+class ColumnLayout:
+    """NumPy structured dtype for payloads shaped like one sample message.
+
+    Strings and sequences make CDR messages variable-length, but within a
+    topic they almost never change size (a header frame_id, an empty cell
+    list). The layout is taken from a sample payload: every primitive,
+    fixed array and sequence gets a field at its offset, strings become
+    fixed-width byte fields, and their length prefixes, terminators and
+    the encapsulation header become checks. Payloads of the same length
+    that fail a check are reported invalid and must be decoded one by one.
+    """
+
+    def __init__(self, typestore, msgtype, sample):
+        self.typestore = typestore
+        self.msgtype = msgtype
+        self.itemsize = len(sample)
+        self.names = []
+        self.formats = []
+        self.offsets = []
+        self.checks = [("#encap0", 0), ("#encap1", 1)]
+        self.strings = {}    # path -> expected byte length (without terminator)
+        self.constants = {}  # path -> value for zero-width fields (empty strings/sequences)
+
+        if bytes(sample[:2]) != b"\x00\x01":
+            raise UnsupportedLayout("not little-endian CDR")
+        self._add("#encap0", 0, "u1")
+        self._add("#encap1", 1, "u1")
+        end = self._walk(msgtype, sample, 4, "")
+        if end + 3 < len(sample) or end > len(sample):
+            raise UnsupportedLayout("size mismatch")
+
+        self.dtype = np.dtype({
+            "names": self.names,
+            "formats": self.formats,
+            "offsets": self.offsets,
+            "itemsize": self.itemsize,
+        })
+
+    def _add(self, name, offset, fmt):
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.formats.append(fmt)
+
+    def _check(self, offset, fmt, expected):
+        name = f"#check{len(self.checks)}"
+        self._add(name, offset, fmt)
+        self.checks.append((name, expected))
+
+    def _walk(self, msgtype, sample, pos, prefix):
+        try:
+            _, fields = self.typestore.fielddefs[msgtype]
+        except KeyError:
+            raise UnsupportedLayout(f"unknown type {msgtype}")
+
+        for name, (nodetype, detail) in fields:
+            path = prefix + name
+            if nodetype == Nodetype.NAME:
+                pos = self._walk(detail, sample, pos, path + ".")
+                continue
+
+            if nodetype == Nodetype.BASE:
+                primitive = detail[0]
+                if primitive == "string":
+                    pos = _align(pos, 4)
+                    if pos + 4 > len(sample):
+                        raise UnsupportedLayout("truncated sample")
+                    length = _UINT32(sample, pos)[0]
+                    if length < 1 or pos + 4 + length > len(sample):
+                        raise UnsupportedLayout("bad string in sample")
+                    self._check(pos, "<u4", length)
+                    self._check(pos + 3 + length, "u1", 0)
+                    if length > 1:
+                        self._add(path, pos + 4, f"S{length - 1}")
+                        self.strings[path] = length - 1
+                    else:
+                        self.constants[path] = ""
+                    pos += 4 + length
+                    continue
+                if primitive not in PRIMITIVES:
+                    raise UnsupportedLayout(f"primitive {primitive}")
+                char, size = PRIMITIVES[primitive]
+                pos = _align(pos, size)
+                self._add(path, pos, "<" + char)
+                pos += size
+                continue
+
+            (subnode, subdetail), length = detail
+            if subnode != Nodetype.BASE or subdetail[0] not in PRIMITIVES:
+                raise UnsupportedLayout("array/sequence of non-numeric elements")
+            char, size = PRIMITIVES[subdetail[0]]
+
+            if nodetype == Nodetype.SEQUENCE:
+                pos = _align(pos, 4)
+                if pos + 4 > len(sample):
+                    raise UnsupportedLayout("truncated sample")
+                count = _UINT32(sample, pos)[0]
+                self._check(pos, "<u4", count)
+                pos += 4
+                if count and size > 4:
+                    pos = _align(pos, size)
+                length = count
+            else:
+                pos = _align(pos, size)
+
+            if length:
+                self._add(path, pos, ("<" + char, (length,)))
+            else:
+                self.constants[path] = np.empty(0, dtype="<" + char)
+            pos += size * length
+        return pos
+
+    def decode(self, payloads):
+        """Return (records, valid) for a list of payloads of exactly itemsize bytes."""
+        records = np.frombuffer(b"".join(payloads), dtype=self.dtype)
+        valid = np.ones(len(records), dtype=bool)
+        for name, expected in self.checks:
+            valid &= records[name] == expected
+        for path, length in self.strings.items():
+            # Fixed-width bytes drop trailing NULs; a string that had some isn't this layout
+            valid &= np.char.str_len(records[path]) == length
+        return records, valid
+
+    def column(self, records, path):
+        """One field as an array; strings come back as an object array of str."""
+        if path in self.constants:
+            column = np.empty(len(records), dtype=object)
+            column.fill(self.constants[path])
+            return column
+        values = records[path]
+        if path in self.strings:
+            uniques, inverse = np.unique(values, return_inverse=True)
+            decoded = np.array([value.decode() for value in uniques.tolist()], dtype=object)
+            return decoded[inverse.reshape(-1)]
+        return values
@@ -4,17 +4,35 @@ import glob
 import argparse
 import math
 import bisect
+import heapq
 import time
 import re
 import json
-import hashlib
+import ctypes
+import ctypes.util
+import pickle
+import shutil
+import signal
+import select
+import sqlite3
+import struct
+import tempfile
+import threading
+from array import array
 from multiprocessing import Pool, cpu_count
 
-from rosbags.rosbag2 import Reader
-from rosbags.typesys import Stores, get_typestore
-from rosbags.typesys.msg import get_types_from_msg
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # only needed for --sink parquet
+    pa = None
+
+from cdr_decode import ColumnLayout, UnsupportedLayout
+from msg_registry import init_registry_worker, shared_decoders, shared_typestore
+from rosbag_db import BagFile, load_bag_metadata, may_contain, natural_sort_key
+from sinks import (ESCAPE_KEY, PARQUET_DIR, SINKS, InfluxSink, LineProtocolFileSink, ParquetBagWriter,
+                   ParquetLayout, ParquetSink, QueueSink, WriterPool, create_point, format_series, format_value)
 
 # ====================================================================
 # InfluxDB Configuration
@@ -27,147 +45,56 @@ INFLUX_BUCKET = "vessel-data"
 BATCH_SIZE = 5000
 
 # ====================================================================
-# Custom ROS2 Message Type Registration
+# Custom ROS2 Message Types (msg_registry.py)
 # ====================================================================
-typestore = get_typestore(Stores.ROS2_HUMBLE)
-
-custom_msg_defs = [
-    ("rkse_common_interfaces/msg/KeyValue", "string key\nstring value"),
-
-    ("rkse_common_interfaces/msg/VesselMode",
-     "uint8 VESSEL_MODE_STAGING=0\n"
-     "uint8 VESSEL_MODE_ACTIVE=1\n"
-     "std_msgs/Header header\n"
-     "uint8 value"),
-
-    ("rkse_common_interfaces/msg/ControlModeStatus",
-     "std_msgs/Header header\n"
-     "rkse_common_interfaces/KeyValue[] data"),
-
-    ("rkse_common_interfaces/msg/ControlModeFeedback",
-     "std_msgs/Header header\n"
-     "string manual_preset_name\n"
-     "string stationary_preset_name\n"
-     "string current_mode_name\n"
-     "uint8 current_mode\n"
-     "builtin_interfaces/Duration duration"),
-
-    ("rkse_common_interfaces/msg/LeakStatus",
-     "std_msgs/Header header\n"
-     "uint8 data"),
-
-    ("rkse_telemetry_interfaces/msg/BatteryStateTelemetry",
-     "uint8 NO_ERROR=0\n"
-     "uint8 LOW_BATTERY=1\n"
-     "uint8 ERROR=2\n"
-     "builtin_interfaces/Time stamp\n"
-     "float32 voltage\n"
-     "float32 charge_percentage\n"
-     "bool is_charging\n"
-     "uint8 error_code\n"
-     "string message"),
-
-    ("rkse_telemetry_interfaces/msg/StateTelemetry",
-     "builtin_interfaces/Time stamp\n"
-     "float64 latitude\n"
-     "float64 longitude\n"
-     "float32 heading\n"
-     "float32 vertical_speed\n"
-     "float32 depth\n"
-     "float32 altitude\n"
-     "float32 course_over_ground\n"
-     "float32 speed_over_ground\n"
-     "float32 yaw_rate"),
-
-    ("rkse_orion_interfaces/msg/PackStatus",
-     "builtin_interfaces/Time stamp\n"
-     "bool charge_power_status\n"
-     "bool ready_power_status\n"
-     "bool multipurpose_input\n"
-     "bool bms_errors_present\n"
-     "bool charger_safety\n"
-     "bool charge_enable\n"
-     "bool discharge_enable\n"
-     "float32 pack_state_of_charge\n"
-     "float32 pack_charge_current_limit\n"
-     "float32 pack_discharge_current_limit\n"
-     "float32 pack_current\n"
-     "float32 pack_voltage\n"
-     "float32 pack_amphours\n"
-     "float32 pack_depth_of_discharge\n"
-     "float32 pack_health\n"
-     "float32 pack_summed_voltage\n"
-     "float32 total_pack_cycles"),
-
-    ("rkse_driver_interfaces/msg/PowerManagementFeedback",
-     "std_msgs/Header header\n"
-     "bool load_on_off\n"
-     "bool adc_on_off\n"
-     "bool card_limit_tripped\n"
-     "float32 load_current\n"
-     "float32 bus_voltage\n"
-     "float32 temperature\n"
-     "float32 control_current\n"
-     "float32 averaged_time\n"
-     "float32 value_tripped\n"
-     "float32 startup_current\n"
-     "bool switch_on_off\n"
-     "bool watchdog_status\n"
-     "bool reboot\n"
-     "bool power_mode_on_off\n"
-     "bool power_mode_status\n"
-     "bool curr_max\n"
-     "bool curr_max_warn\n"
-     "bool volt_max\n"
-     "bool volt_max_warn\n"
-     "bool volt_min_warn\n"
-     "bool volt_min\n"
-     "bool temp_card_max\n"
-     "bool temp_card_max_warn"),
-
-    ("sbg_driver/msg/SbgEkfStatus",
-     "uint8 solution_mode\n"
-     "bool attitude_valid\n"
-     "bool heading_valid\n"
-     "bool velocity_valid\n"
-     "bool position_valid\n"
-     "bool vert_ref_used\n"
-     "bool mag_ref_used\n"
-     "bool gps1_vel_used\n"
-     "bool gps1_pos_used\n"
-     "bool gps1_course_used\n"
-     "bool gps1_hdt_used\n"
-     "bool gps2_vel_used\n"
-     "bool gps2_pos_used\n"
-     "bool gps2_course_used\n"
-     "bool gps2_hdt_used\n"
-     "bool odo_used"),
-
-    ("sbg_driver/msg/SbgEkfEuler",
-     "std_msgs/Header header\n"
-     "uint32 time_stamp\n"
-     "geometry_msgs/Vector3 angle\n"
-     "geometry_msgs/Vector3 accuracy\n"
-     "sbg_driver/SbgEkfStatus status"),
-]
-
-all_types = {}
-for msgtype, msgdef in custom_msg_defs:
-    all_types.update(get_types_from_msg(msgdef, msgtype))
-typestore.register(all_types)
+typestore = shared_typestore()
 
 
 # ====================================================================
 # Mode Timeline — Pass 1
 # ====================================================================
 class ModeTimeline:
-    def __init__(self, segments):
+    def __init__(self, segments, bag_intervals=None):
         self.segments = segments
+        self.bag_intervals = bag_intervals or []  # scanned bags (Pass 1 only; workers don't need them)
         self.start_times = [seg["start_time"] for seg in segments]
         self.end_times = [seg["end_time"] for seg in segments]
 
+        # Modes as a small integer-coded categorical: mode_names[code] → name.
+        # Code 0 is always UNKNOWN (no segment covers the timestamp).
+        self.mode_names = ["UNKNOWN"]
+        self.mode_index = {"UNKNOWN": 0}
+        codes = []
+        for seg in segments:
+            code = self.mode_index.get(seg["mode"])
+            if code is None:
+                code = self.mode_index[seg["mode"]] = len(self.mode_names)
+                self.mode_names.append(seg["mode"])
+            codes.append(code)
+
+        self.start_array = np.array(self.start_times, dtype=np.int64)
+        self.end_array = np.array(self.end_times, dtype=np.int64)
+        self.code_array = np.array(codes, dtype=np.int16)
+
+    @classmethod
+    def from_arrays(cls, start_array, end_array, code_array, mode_names):
+        """Timeline over existing (e.g. memory-mapped) arrays, without segment dicts.
+
+        Pass 1b/2 workers build theirs this way from the timeline file (see
+        load_timeline_file); segments is None, lookups work as usual.
+        """
+        timeline = cls.__new__(cls)
+        timeline.segments = None
+        timeline.bag_intervals = []
+        timeline.start_times = timeline.start_array = start_array
+        timeline.end_times = timeline.end_array = end_array
+        timeline.code_array = code_array
+        timeline.mode_names = list(mode_names)
+        timeline.mode_index = {mode: code for code, mode in enumerate(timeline.mode_names)}
+        return timeline
+
     def lookup(self, timestamp_ns):
-        if not self.segments:
+        if not len(self.start_times):
             return "UNKNOWN"
 
         idx = bisect.bisect_right(self.start_times, timestamp_ns) - 1
@@ -179,73 +106,166 @@ class ModeTimeline:
         if timestamp_ns >= self.end_times[idx]:
             return "UNKNOWN"
 
-        return self.segments[idx]["mode"]
+        return self.mode_names[self.code_array[idx]]
+
+    def lookup_many(self, timestamps):
+        """Vectorized lookup: int64 ns timestamps → int16 mode codes (index into mode_names).
+
+        Same rules as lookup(): one searchsorted for the segment, then an
+        end-time mask; uncovered timestamps get code 0 (UNKNOWN).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(self.start_array):
+            return np.zeros(len(timestamps), dtype=np.int16)
+
+        idx = np.searchsorted(self.start_array, timestamps, side="right") - 1
+        in_range = idx >= 0
+        idx = np.where(in_range, idx, 0)
+        covered = in_range & (timestamps < self.end_array[idx])
+        return np.where(covered, self.code_array[idx], 0).astype(np.int16)
+
+
+# --- Timeline file: one copy of the timeline for all Pass 1b/2 workers ---
+# The parent writes the timeline's start/end/mode-code arrays to a file
+# once; workers memory-map it read-only, so every worker shares the same
+# page-cache copy and tasks carry only the file's path instead of the
+# pickled segment list. Layout: TIMELINE_HEADER (segments, bytes of the
+# JSON mode-name list), int64 starts, int64 ends, int16 codes, names.
+TIMELINE_HEADER = struct.Struct("<qq")
+_mode_timeline = None  # (path, ModeTimeline) of the timeline file this worker has mapped
+
+
+def write_timeline_file(mode_timeline, directory=None):
+    """Serialize mode_timeline for workers; returns the file path (the caller removes it)."""
+    names = json.dumps(mode_timeline.mode_names).encode()
+    fd, path = tempfile.mkstemp(prefix="timeline-", suffix=".bin", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(TIMELINE_HEADER.pack(len(mode_timeline.start_array), len(names)))
+        f.write(mode_timeline.start_array.astype(np.int64).tobytes())
+        f.write(mode_timeline.end_array.astype(np.int64).tobytes())
+        f.write(mode_timeline.code_array.astype(np.int16).tobytes())
+        f.write(names)
+    return path
+
+
+def load_timeline_file(path):
+    """ModeTimeline over a memory-mapped timeline file written by write_timeline_file."""
+    with open(path, "rb") as f:
+        count, names_size = TIMELINE_HEADER.unpack(f.read(TIMELINE_HEADER.size))
+        f.seek(TIMELINE_HEADER.size + count * 18)
+        mode_names = json.loads(f.read(names_size))
+    arrays = []
+    offset = TIMELINE_HEADER.size
+    for dtype in (np.int64, np.int64, np.int16):
+        if count:
+            arrays.append(np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)))
+        else:
+            arrays.append(np.empty(0, dtype=dtype))  # mmap can't map zero bytes
+        offset += count * np.dtype(dtype).itemsize
+    return ModeTimeline.from_arrays(*arrays, mode_names)
+
+
+def worker_timeline(path):
+    """This worker's ModeTimeline for the timeline file at path, mapped once per file."""
+    global _mode_timeline
+    if _mode_timeline is None or _mode_timeline[0] != path:
+        _mode_timeline = (path, load_timeline_file(path))
+    return _mode_timeline[1]
 
 
 # --- Sub-functions for building the mode timeline ---
 
 def _scan_single_bag(bag_path):
     """Worker function: scan one bag for time bounds and feedback events."""
-    worker_typestore = get_typestore(Stores.ROS2_HUMBLE)
-    worker_types = {}
-    for msgtype, msgdef in custom_msg_defs:
-        worker_types.update(get_types_from_msg(msgdef, msgtype))
-    worker_typestore.register(worker_types)
+    worker_typestore = shared_typestore()
 
     try:
-        with Reader(bag_path) as reader:
-            if reader.message_count == 0:
+        with BagFile(bag_path) as bag:
+            if bag.is_empty:
                 return None, []
 
             bag_info = {
-                "start_time": reader.start_time,
-                "end_time": reader.end_time,
+                "start_time": bag.start_time,
+                "end_time": bag.end_time,
                 "path": bag_path,
             }
 
             events = []
-            if "/control_mode/feedback" in reader.topics:
-                for connection, timestamp, rawdata in reader.messages():
-                    if connection.topic == "/control_mode/feedback":
-                        msg = worker_typestore.deserialize_cdr(rawdata, connection.msgtype)
-                        mode_name = msg.current_mode_name or "UNKNOWN"
-                        events.append((timestamp, mode_name))
+            if may_contain(bag_path, ["/control_mode/feedback"]):
+                messages = bag.messages(["/control_mode/feedback"])
+                if _profile is not None:
+                    messages = profiled_messages(messages)
+                for topic, timestamp, rawdata in messages:
+                    if _profile is None:
+                        msg = worker_typestore.deserialize_cdr(rawdata, bag.msgtype(topic))
+                    else:
+                        start = time.perf_counter()
+                        msg = worker_typestore.deserialize_cdr(rawdata, bag.msgtype(topic))
+                        _profile.add("decode", topic, time.perf_counter() - start)
+                    mode_name = msg.current_mode_name or "UNKNOWN"
+                    events.append((timestamp, mode_name))
 
             return bag_info, events
     except Exception as e:
         print(f"    WARNING: Could not read {os.path.basename(bag_path)}: {e}")
-        return None, []
+        # events=None marks a failed read so it isn't cached as an empty bag
+        return None, None
 
 
-def collect_bag_intervals_and_mode_events(bag_files, num_workers=16):
-    """Scan all bags in parallel: collect bag start/end times and feedback events."""
+def collect_bag_intervals_and_mode_events(bag_files, num_workers=16, scan_cache=None, profile=None):
+    """Scan all bags in parallel: collect bag start/end times and feedback events.
+
+    With a scan_cache, bags whose fingerprint is cached are merged from the
+    cache and only new or changed files are scanned.
+    """
     bag_intervals = []
     mode_events = []
 
-    workers = min(num_workers, len(bag_files))
-    completed = 0
-
-    with Pool(processes=workers) as pool:
-        for bag_info, events in pool.imap_unordered(_scan_single_bag, bag_files):
-            completed += 1
-            if completed % 100 == 0 or completed == len(bag_files):
-                print(f"    Scanned {completed}/{len(bag_files)} files...")
+    to_scan = []
+    for bag_path in bag_files:
+        cached = scan_cache.get_scan(bag_path) if scan_cache else None
+        if cached is None:
+            to_scan.append(bag_path)
+        else:
+            add_scanned_bag(bag_intervals, mode_events, *cached)
+    if scan_cache:
+        print(f"    {len(bag_files) - len(to_scan)} files from scan cache, {len(to_scan)} to scan")
 
-            if bag_info is None:
-                continue
+    workers = min(num_workers, len(to_scan))
+    completed = 0
 
-            bag_idx = len(bag_intervals)
-            bag_info["bag_idx"] = bag_idx
-            bag_intervals.append(bag_info)
+    if to_scan:
+        with Pool(processes=workers, initializer=init_registry_worker) as pool:
+            scans = profiled_imap(profile, "pass1", pool.imap, _scan_single_bag, to_scan)
+            for bag_path, (bag_info, events) in zip(to_scan, scans):
+                completed += 1
+                if completed % 100 == 0 or completed == len(to_scan):
+                    print(f"    Scanned {completed}/{len(to_scan)} files...")
 
-            for ts, mode in events:
-                mode_events.append((ts, mode, bag_idx))
+                if scan_cache and events is not None:
+                    scan_cache.put_scan(bag_path, bag_info, events)
+                add_scanned_bag(bag_intervals, mode_events, bag_info, events)
+        if scan_cache:
+            scan_cache.commit()
 
     mode_events.sort(key=lambda x: x[0])
     bag_intervals.sort(key=lambda x: x["start_time"])
     return bag_intervals, mode_events
 
 
+def add_scanned_bag(bag_intervals, mode_events, bag_info, events):
+    """Append one bag's scan result, tagging its feedback events with the bag index."""
+    if bag_info is None:
+        return
+
+    bag_idx = len(bag_intervals)
+    bag_info["bag_idx"] = bag_idx
+    bag_intervals.append(bag_info)
+
+    for ts, mode in events:
+        mode_events.append((ts, mode, bag_idx))
+
+
 def compute_recording_sessions(bag_intervals, gap_threshold_ns=2_000_000_000):
     """Merge adjacent bag intervals into recording sessions.
 
@@ -459,7 +479,108 @@ def merge_consecutive_segments(segments):
     return merged
 
 
-def build_mode_timeline(bag_files):
+def sweep_mode_segments(segments, mode_events, sessions):
+    """Steps 4-7 as sorted sweeps — same output as the step functions above.
+
+    extend_segments_to_sessions / split_at_session_boundaries /
+    insert_gap_segments compare every segment with every session and look
+    up modes with linear scans. Raw segments are contiguous with
+    non-decreasing start and end times and sessions are sorted and
+    disjoint, so each step can instead walk both lists with pointers
+    (plus bisect on event/session times). Tie-breaking follows the
+    original stable sorts and first-match lookups exactly.
+    """
+    if not segments or not sessions:
+        return segments
+
+    sess_starts = [sess["start_time"] for sess in sessions]
+    sess_ends = [sess["end_time"] for sess in sessions]
+
+    # Step 4: extend first/last segment of each session to its boundaries.
+    # Segments overlapping a session form the index range [lo, hi).
+    event_times = [ts for ts, _, _ in mode_events]
+    n = len(segments)
+    lo = 0
+    added = []
+    for sess_start, sess_end in zip(sess_starts, sess_ends):
+        while lo < n and segments[lo]["end_time"] <= sess_start:
+            lo += 1
+        hi = lo
+        while hi < n and segments[hi]["start_time"] < sess_end:
+            hi += 1
+
+        if lo == hi:
+            # No segment in this session — carry the last mode seen before it
+            idx = bisect.bisect_right(event_times, sess_start) - 1
+            if idx >= 0:
+                added.append({"mode": mode_events[idx][1], "start_time": sess_start, "end_time": sess_end})
+            continue
+
+        if segments[lo]["start_time"] > sess_start:
+            segments[lo]["start_time"] = sess_start
+        if segments[hi - 1]["end_time"] < sess_end:
+            segments[hi - 1]["end_time"] = sess_end
+
+    segments = sorted(segments + added, key=lambda s: s["start_time"])
+
+    # Step 5: split segments that span more than one session
+    split = []
+    for seg in segments:
+        first = bisect.bisect_right(sess_ends, seg["start_time"])
+        last = first
+        while last < len(sessions) and sess_starts[last] < seg["end_time"]:
+            last += 1
+
+        if last - first <= 1:
+            split.append(seg)
+            continue
+        for i in range(first, last):
+            split_start = max(seg["start_time"], sess_starts[i])
+            split_end = min(seg["end_time"], sess_ends[i])
+            if split_end > split_start:
+                split.append({"mode": seg["mode"], "start_time": split_start, "end_time": split_end})
+
+    split.sort(key=lambda s: s["start_time"])
+    if not split:
+        return split
+
+    # Step 6: walk the sorted boundaries; the mode at each boundary is the
+    # earliest-listed segment covering it (min-heap on list index, with
+    # expired segments dropped lazily)
+    boundaries = {sess_starts[0], sess_ends[-1]}
+    for seg in split:
+        boundaries.add(seg["start_time"])
+        boundaries.add(seg["end_time"])
+    boundaries.update(sess_starts)
+    boundaries.update(sess_ends)
+    sorted_bounds = sorted(boundaries)
+
+    final = []
+    active = []
+    next_seg = 0
+    for start, end in zip(sorted_bounds, sorted_bounds[1:]):
+        while next_seg < len(split) and split[next_seg]["start_time"] <= start:
+            heapq.heappush(active, (next_seg, split[next_seg]["end_time"]))
+            next_seg += 1
+        while active and active[0][1] <= start:
+            heapq.heappop(active)
+
+        if active:
+            final.append({"mode": split[active[0][0]]["mode"], "start_time": start, "end_time": end})
+            continue
+
+        mid = (start + end) // 2
+        idx = bisect.bisect_right(sess_starts, mid) - 1
+        if idx >= 0 and mid <= sess_ends[idx]:
+            final.append({"mode": "NO_DATA", "start_time": start, "end_time": end})
+        else:
+            final.append({"mode": "NO_BAG_RECORD", "start_time": start, "end_time": end})
+
+    # Step 7: merge consecutive same-mode segments
+    return merge_consecutive_segments(final)
+
+
+def build_mode_timeline(bag_files, scan_cache=None, profile=None):
     """Main orchestrator: build mode timeline matching mission_time_analysis behavior.
 
     Pipeline:
@@ -475,35 +596,39 @@ def build_mode_timeline(bag_files):
     print(f"  Scanning {len(bag_files)} bag files...")
 
     # Step 1: Collect bag intervals and feedback events
-    bag_intervals, mode_events = collect_bag_intervals_and_mode_events(bag_files)
-    print(f"  Found {len(bag_intervals)} bags with data, {len(mode_events)} feedback messages")
+    bag_intervals, mode_events = collect_bag_intervals_and_mode_events(bag_files, scan_cache=scan_cache,
+                                                                       profile=profile)
+    return assemble_mode_timeline(bag_intervals, mode_events)
+
+
+def assemble_mode_timeline(bag_intervals, mode_events, verbose=True):
+    """Run steps 2-7 of build_mode_timeline on already-collected scan results.
+
+    verbose=False (--watch, which reassembles after every batch) prints a
+    single summary line instead of the per-session and per-mode breakdown.
+    """
+    if verbose:
+        print(f"  Found {len(bag_intervals)} bags with data, {len(mode_events)} feedback messages")
 
     if not mode_events:
         print("  WARNING: No /control_mode/feedback messages found!")
-        return ModeTimeline([])
+        return ModeTimeline([], bag_intervals)
 
     # Step 2: Compute recording sessions
     sessions = compute_recording_sessions(bag_intervals)
-    print(f"  Recording sessions: {len(sessions)}")
-    for i, sess in enumerate(sessions):
-        duration_s = (sess["end_time"] - sess["start_time"]) / 1e9
-        print(f"    Session {i+1}: {sess['bag_count']} bags, {duration_s:.0f}s ({duration_s/3600:.1f}h)")
+    if verbose:
+        print(f"  Recording sessions: {len(sessions)}")
+        for i, sess in enumerate(sessions):
+            duration_s = (sess["end_time"] - sess["start_time"]) / 1e9
+            print(f"    Session {i+1}: {sess['bag_count']} bags, {duration_s:.0f}s ({duration_s/3600:.1f}h)")
 
     # Step 3: Build raw segments
     segments = build_raw_segments(mode_events)
     raw_count = len(segments)
 
-    # Step 4: Extend segments to session boundaries
-    segments = extend_segments_to_sessions(segments, mode_events, bag_intervals, sessions)
-
-    # Step 5: Split at session boundaries
-    segments = split_at_session_boundaries(segments, sessions)
-
-    # Step 6: Insert gap segments
-    segments = insert_gap_segments(segments, sessions)
-
-    # Step 7: Merge consecutive same-mode segments
-    segments = merge_consecutive_segments(segments)
+    # Steps 4-7: Extend to sessions, split at session boundaries, insert
+    # gap segments, merge — one sorted sweep per step (see sweep_mode_segments)
+    segments = sweep_mode_segments(segments, mode_events, sessions)
 
     # Assign segment numbers and calculate durations
     for i, seg in enumerate(segments):
@@ -511,6 +636,11 @@ def build_mode_timeline(bag_files):
         seg["duration_ns"] = seg["end_time"] - seg["start_time"]
         seg["duration_s"] = seg["duration_ns"] / 1e9
 
+    if not verbose:
+        print(f"  Timeline: {len(bag_intervals)} bags, {len(sessions)} sessions, "
+              f"{len(mode_events)} feedback messages → {len(segments)} segments")
+        return ModeTimeline(segments, bag_intervals)
+
     # Print summary
     mode_counts = {}
     for seg in segments:
@@ -521,7 +651,174 @@ def build_mode_timeline(bag_files):
         total_s = sum(s["duration_s"] for s in segments if s["mode"] == mode)
         print(f"    {mode}: {count} segments ({total_s:.0f}s / {total_s/3600:.1f}h)")
 
-    return ModeTimeline(segments)
+    return ModeTimeline(segments, bag_intervals)
+
+
+# --- Incremental updates (--watch, re-runs on a grown bag directory) ---
+
+def diff_timelines(old_segments, new_segments):
+    """Compare two timelines: (segments to write, segments to delete, mode-changed ranges).
+
+    A mission_segments point is keyed by its start time and mode tag, so a
+    segment is written if its key is new or its end or number changed, and
+    deleted if its key is gone. Ranges are [(start, end, old_mode,
+    new_mode)] wherever a timestamp's mode differs (UNKNOWN outside a
+    timeline), with adjacent ranges of the same change merged.
+    """
+    old_by_key = {(seg["start_time"], seg["mode"]): seg for seg in old_segments}
+    new_keys = set()
+    written = []
+    for seg in new_segments:
+        key = (seg["start_time"], seg["mode"])
+        new_keys.add(key)
+        old = old_by_key.get(key)
+        if old is None or old["end_time"] != seg["end_time"] or old["segment_number"] != seg["segment_number"]:
+            written.append(seg)
+    removed = [seg for key, seg in old_by_key.items() if key not in new_keys]
+
+    # Both timelines are constant between consecutive boundaries of either
+    old_timeline = ModeTimeline(old_segments)
+    new_timeline = ModeTimeline(new_segments)
+    bounds = sorted({t for seg in old_segments + new_segments for t in (seg["start_time"], seg["end_time"])})
+    ranges = []
+    for start, end in zip(bounds, bounds[1:]):
+        old_mode = old_timeline.lookup(start)
+        new_mode = new_timeline.lookup(start)
+        if old_mode == new_mode:
+            continue
+        if ranges and ranges[-1][1] == start and ranges[-1][2:] == (old_mode, new_mode):
+            ranges[-1] = (ranges[-1][0], end, old_mode, new_mode)
+        else:
+            ranges.append((start, end, old_mode, new_mode))
+    return written, removed, ranges
+
+
+class IncrementalTimeline:
+    """Mode timeline that accepts newly scanned bags and reports what changed.
+
+    Holds the sorted bag intervals, feedback events, sessions and final
+    segments. update() reruns steps 2-7 only from a cut point, keeps the
+    segments before it and diffs the rest:
+
+    - If the new bags and events can only touch a session that already
+      had a mode change before them, the cut is that last change: final
+      segments always break at a mode change, and nothing before it
+      depends on later events or on the session's end.
+    - Otherwise the cut is the end of the previous session (sessions are
+      separated by NO_BAG_RECORD gaps), recomputing from there with the
+      last earlier event carried in.
+
+    For bags appended in recording order an update costs the events
+    since the last mode change, not the whole mission.
+    """
+
+    def __init__(self, gap_threshold_ns=2_000_000_000):
+        self.gap_threshold_ns = gap_threshold_ns
+        self.bag_intervals = []    # sorted by start_time
+        self.interval_starts = []
+        self.mode_events = []      # (timestamp, mode, bag_idx), sorted by timestamp
+        self.event_times = []
+        self.sessions = []
+        self.segments = []
+
+    def update(self, bag_intervals, mode_events):
+        """Add scanned bags (bag_info dicts) and their feedback events.
+
+        Returns (segments to write, segments to delete, mode-changed
+        ranges) as diff_timelines does, for the recomputed part only.
+        """
+        if not bag_intervals and not mode_events:
+            return [], [], []
+        t0 = min([bag["start_time"] for bag in bag_intervals] + [event[0] for event in mode_events])
+        for bag in sorted(bag_intervals, key=lambda b: b["start_time"]):
+            i = bisect.bisect_right(self.interval_starts, bag["start_time"])
+            self.interval_starts.insert(i, bag["start_time"])
+            self.bag_intervals.insert(i, bag)
+        for event in sorted(mode_events, key=lambda e: e[0]):
+            i = bisect.bisect_right(self.event_times, event[0])
+            self.event_times.insert(i, event[0])
+            self.mode_events.insert(i, event)
+
+        old_segments = self.segments
+        # First session the new data can extend or merge into
+        a = bisect.bisect_left(self.sessions, t0 - self.gap_threshold_ns, key=lambda s: s["end_time"])
+
+        cut = None  # index of the last raw-segment start before t0, inside session a
+        if old_segments and a < len(self.sessions) and self.sessions[a]["start_time"] <= t0:
+            i = bisect.bisect_left(self.event_times, t0) - 1
+            while i > 0 and (self.mode_events[i - 1][1] == self.mode_events[i][1]
+                             or self.event_times[i - 1] == self.event_times[i]):
+                i -= 1
+            # (not the mission's first event: that segment is extended back to its session start)
+            if i > 0 and self.event_times[i] > self.sessions[a]["start_time"]:
+                cut = i
+
+        if cut is not None:
+            cut_time = self.event_times[cut]
+            events = self.mode_events[cut:]
+            first_bag = bisect.bisect_left(self.interval_starts, self.sessions[a]["start_time"])
+        elif old_segments and a > 0:
+            cut_time = self.sessions[a - 1]["end_time"]
+            # Carry the last earlier event in for sessions without their own
+            first_event = max(bisect.bisect_right(self.event_times, cut_time) - 1, 0)
+            events = self.mode_events[first_event:]
+            first_bag = bisect.bisect_right(self.interval_starts, cut_time)
+        else:
+            cut_time = None
+            events = self.mode_events
+            first_bag = 0
+            a = 0
+
+        sessions, suffix = self._sweep(first_bag, events, cut_time, cut is not None)
+        keep = 0 if cut_time is None else bisect.bisect_left(old_segments, cut_time,
+                                                              key=lambda s: s["start_time"])
+        if keep and (old_segments[keep - 1]["end_time"] != cut_time
+                     or not suffix or suffix[0]["start_time"] != cut_time
+                     or suffix[0]["mode"] == old_segments[keep - 1]["mode"]
+                     or self._boundary_event(self.sessions[:a] + sessions)):
+            # The cut fell inside a kept segment or next to one of the same mode (events at
+            # the same timestamp), or an event sits on a session boundary: the segments
+            # before the cut aren't final, so start over
+            a, keep = 0, 0
+            sessions, suffix = self._sweep(0, self.mode_events, None, False)
+
+        for i, seg in enumerate(suffix, start=keep):
+            seg["segment_number"] = i + 1
+            seg["duration_ns"] = seg["end_time"] - seg["start_time"]
+            seg["duration_s"] = seg["duration_ns"] / 1e9
+
+        self.sessions = self.sessions[:a] + sessions
+        self.segments = old_segments[:keep] + suffix
+        return diff_timelines(old_segments[keep:], suffix)
+
+    def _boundary_event(self, sessions):
+        """True if a feedback event has the same timestamp as a session start or end."""
+        for sess in sessions:
+            for t in (sess["start_time"], sess["end_time"]):
+                i = bisect.bisect_left(self.event_times, t)
+                if i < len(self.event_times) and self.event_times[i] == t:
+                    return True
+        return False
+
+    def _sweep(self, first_bag, events, cut_time, at_event):
+        """(sessions, final segments from cut_time) for the bags from first_bag on.
+
+        at_event: cut_time is an event's, inside the first session; otherwise
+        it is the end of the previous session, or None to start from scratch.
+        """
+        sessions = compute_recording_sessions(self.bag_intervals[first_bag:])
+        suffix = []
+        if self.mode_events and sessions:
+            sweep_sessions = [dict(sess) for sess in sessions]
+            if at_event:
+                sweep_sessions[0]["start_time"] = cut_time
+            clip = sweep_sessions[0]["start_time"]
+            for seg in sweep_mode_segments(build_raw_segments(events), events, sweep_sessions):
+                if seg["end_time"] > clip:
+                    suffix.append({**seg, "start_time": max(seg["start_time"], clip)})
+            if not at_event and cut_time is not None:
+                suffix.insert(0, {"mode": "NO_BAG_RECORD", "start_time": cut_time, "end_time": clip})
+        return sessions, suffix
 
 
 # ====================================================================
@@ -749,129 +1046,2152 @@ def process_ekf_euler(msg):
 
 
 # ====================================================================
-# Topic → (measurement_name, processor_function)
+# Topic → (measurement_name, processor_function, ingest_policy)
 # ====================================================================
+# ingest_policy is the topic's default --decimate policy, None = keep all
 TOPIC_PROCESSORS = {
-    "/battery_state":                 ("battery_state",     process_battery_state),
-    "/temperature":                   ("temperature",       process_temperature),
-    "/humidity":                      ("humidity",          process_humidity),
-    "/pressure":                      ("pressure",          process_pressure),
-    "/odometry/filtered":             ("odometry",          process_odometry),
-    "/moving_base_second/navheading": ("navheading",        process_navheading),
-    "/gnss/fix":                      ("gnss",              process_gnss),
-    "/vessel/mode":                   ("vessel_mode",       process_vessel_mode),
-    "/telemetry/state":               ("telemetry_state",   process_telemetry_state),
-    "/telemetry/battery_state":       ("battery_telemetry", process_battery_telemetry),
-    "/pack_status":                   ("pack_status",       process_pack_status),
-    "/pm/feedback":                   ("power_mgmt",        process_power_mgmt),
-    "/leak_detect":                   ("leak_detect",       process_leak_detect),
-    "/imu/ellipse/sbg_ekf_euler":     ("ekf_euler",         process_ekf_euler),
-    "/imu/ahrs8/data":                ("ahrs8",             process_ahrs8),
+    "/battery_state":                 ("battery_state",     process_battery_state,     None),
+    "/temperature":                   ("temperature",       process_temperature,       None),
+    "/humidity":                      ("humidity",          process_humidity,          None),
+    "/pressure":                      ("pressure",          process_pressure,          None),
+    "/odometry/filtered":             ("odometry",          process_odometry,          None),
+    "/moving_base_second/navheading": ("navheading",        process_navheading,        None),
+    "/gnss/fix":                      ("gnss",              process_gnss,              None),
+    "/vessel/mode":                   ("vessel_mode",       process_vessel_mode,       None),
+    "/telemetry/state":               ("telemetry_state",   process_telemetry_state,   None),
+    "/telemetry/battery_state":       ("battery_telemetry", process_battery_telemetry, None),
+    "/pack_status":                   ("pack_status",       process_pack_status,       None),
+    "/pm/feedback":                   ("power_mgmt",        process_power_mgmt,        None),
+    "/leak_detect":                   ("leak_detect",       process_leak_detect,       None),
+    "/imu/ellipse/sbg_ekf_euler":     ("ekf_euler",         process_ekf_euler,         None),
+    "/imu/ahrs8/data":                ("ahrs8",             process_ahrs8,             None),
 }
 
 
 # ====================================================================
-# Helper: create an InfluxDB Point from processed fields
+# Line protocol serializer — sensor points without Point objects
+# ====================================================================
+# Produces exactly the lines create_point(...).to_line_protocol() would,
+# but builds the "measurement,tags " prefix once per (measurement, mode,
+# extra tags) and the escaped "field=" keys once per measurement, then
+# formats whole columns at a time. Rows with no writable fields are
+# dropped (Point would emit an empty line, which InfluxDB ignores). The
+# escaping rules are sinks.py's, shared with the summary rows.
+
+
+def _format_column(key, column):
+    """Format one field column as "key=value" strings (None where skipped)."""
+    kinds = {type(value) for value in column}
+    kinds.discard(type(None))
+
+    if kinds == {float}:
+        out = []
+        append = out.append
+        for value in column:
+            # v - v is 0.0 for finite floats and NaN (truthy) for NaN/Inf
+            if value is None or value - value:
+                append(None)
+            else:
+                text = str(value)
+                append(key + (text[:-2] if text.endswith(".0") else text))
+        return out
+    if kinds == {bool}:
+        return [None if value is None else (key + "true" if value else key + "false") for value in column]
+    if kinds == {int}:
+        return [None if value is None else f"{key}{value}i" for value in column]
+
+    out = []
+    for value in column:
+        text = None if value is None else format_value(value)
+        out.append(None if text is None else key + text)
+    return out
+
+
+class LineProtocolSerializer:
+    """Caches tag prefixes and field keys for one (mission, vessel, mode timeline)."""
+
+    def __init__(self, mission, vessel, mode_names):
+        self.tags_by_code = [
+            {"mission": mission, "vessel": vessel, "mode": mode}
+            for mode in mode_names
+        ]
+        self._prefixes = {}
+        self._field_keys = {}
+
+    def prefix(self, measurement, code, extra_tags=None):
+        """Return "measurement,k=v,... " for a mode code and a point's extra tags."""
+        cache_key = (measurement, code, tuple(extra_tags.items()) if extra_tags else ())
+        prefix = self._prefixes.get(cache_key)
+        if prefix is None:
+            tags = dict(self.tags_by_code[code])
+            for tag_name, tag_value in (extra_tags or {}).items():
+                tags[tag_name] = str(tag_value)
+            prefix = self._prefixes[cache_key] = format_series(measurement, tags) + " "
+        return prefix
+
+    def field_keys(self, measurement, field_names):
+        """Return [(field_name, "escaped_name=")] sorted the way Point sorts fields."""
+        cache_key = (measurement, tuple(field_names))
+        keys = self._field_keys.get(cache_key)
+        if keys is None:
+            keys = self._field_keys[cache_key] = [
+                (name, str(name).translate(ESCAPE_KEY) + "=") for name in sorted(field_names)
+            ]
+        return keys
+
+    def serialize(self, measurement, buffer, mode_codes):
+        """Return one line-protocol line per row of a topic buffer that has fields."""
+        columns = buffer["columns"]
+        formatted = [
+            _format_column(key, columns[name])
+            for name, key in self.field_keys(measurement, columns.keys())
+        ]
+
+        extra_tags = buffer["extra_tags"]
+        if any(extra_tags):
+            prefixes = [
+                self.prefix(measurement, code, tags)
+                for code, tags in zip(mode_codes, extra_tags)
+            ]
+        else:
+            by_code = [self.prefix(measurement, code) for code in range(len(self.tags_by_code))]
+            prefixes = [by_code[code] for code in mode_codes]
+
+        lines = []
+        append = lines.append
+        for prefix, parts, timestamp in zip(prefixes, zip(*formatted), buffer["timestamps"]):
+            fields = ",".join(filter(None, parts))
+            if fields:
+                append(f"{prefix}{fields} {timestamp}")
+        return lines
+
+
+# ====================================================================
+# Stage profiling (--profile) — where a run's time goes
+# ====================================================================
+# Off by default. With --profile every pool task runs through
+# ProfiledTask, which gives the worker process a fresh StageProfile (the
+# module global _profile) and returns its timings with the task result;
+# main() merges them per pass. Stages, each per topic:
+#   read       fetching rows from SQLite (an ORDER BY sort lands on the first row)
+#   decode     CDR → message: compiled decoder, typestore or ColumnLayout
+#   process    the TOPIC_PROCESSORS function (process_columns with --columnar)
+#   rollup     folding rows into --rollups windows (RollupAccumulator.add)
+#   encode     --change-only encoding, incl. replaying lead-ins (ChangeEncoder.encode)
+#   tag        ModeTimeline.lookup_many
+#   serialize  line protocol for the whole topic buffer
+#   write      hand-off to the sink from the worker (queue put, incl. backpressure
+#              waits), or the Parquet files with --sink parquet
+#   sink       the sink's own writes in the parent's writer threads (HTTP for InfluxDB)
+# Per-message stages cost two perf_counter() calls; the others are per batch. With profiling
+# off no worker stage reads the clock; only the writer threads time their sink writes, once per chunk.
+PROFILE_STAGES = ["read", "decode", "process", "rollup", "encode", "tag", "serialize", "write", "sink"]
+_profile = None
+
+
+class StageProfile:
+    """Cumulative seconds and item counts per (stage, topic)."""
+
+    def __init__(self):
+        self.stats = {}  # (stage, topic) -> [seconds, count]
+
+    def add(self, stage, topic, seconds, count=1):
+        entry = self.stats.get((stage, topic))
+        if entry is None:
+            self.stats[(stage, topic)] = [seconds, count]
+        else:
+            entry[0] += seconds
+            entry[1] += count
+
+    def merge(self, stats):
+        for (stage, topic), (seconds, count) in stats.items():
+            self.add(stage, topic, seconds, count)
+
+
+class ProfiledTask:
+    """Pool task wrapper: runs fn with a fresh _profile and returns (result, stage stats)."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, arg):
+        global _profile
+        _profile = StageProfile()
+        try:
+            result = self.fn(arg)
+            return result, _profile.stats
+        finally:
+            _profile = None
+
+
+def profiled_imap(run_profile, pass_name, imap, fn, iterable):
+    """imap(fn, iterable) — with profiling on, each task's timings are merged into run_profile[pass_name].
+
+    imap is pool.imap / pool.imap_unordered, or the builtin map for
+    in-process runs.
+    """
+    if run_profile is None:
+        return imap(fn, iterable)
+    profile = run_profile.setdefault(pass_name, StageProfile())
+
+    def results():
+        for result, stats in imap(ProfiledTask(fn), iterable):
+            profile.merge(stats)
+            yield result
+    return results()
+
+
+def profiled_messages(messages):
+    """Wrap a BagFile.messages() iterator, adding each row's fetch time to the read stage."""
+    profile = _profile
+    clock = time.perf_counter
+    iterator = iter(messages)
+    while True:
+        start = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        profile.add("read", item[0], clock() - start)
+        yield item
+
+
+def print_profile(run_profile):
+    """Per pass: seconds per stage for each topic, summed over all workers."""
+    for pass_name, profile in run_profile.items():
+        stages = [stage for stage in PROFILE_STAGES if any(key[0] == stage for key in profile.stats)]
+        topics = {}
+        for (stage, topic), (seconds, count) in profile.stats.items():
+            row = topics.setdefault(topic, {"count": 0})
+            row[stage] = seconds
+            if stage != "sink":
+                row["count"] = max(row["count"], count)
+
+        print(f"\n  {pass_name} — seconds per stage (summed over workers)")
+        print(f"    {'topic':<34} {'msgs':>9}" + "".join(f" {stage:>9}" for stage in stages)
+              + f" {'total':>9} {'µs/msg':>8}")
+        totals = {stage: 0.0 for stage in stages}
+        rows = sorted(topics.items(), key=lambda item: -sum(v for k, v in item[1].items() if k != "count"))
+        for topic, row in rows:
+            total = sum(row.get(stage, 0.0) for stage in stages)
+            for stage in stages:
+                totals[stage] += row.get(stage, 0.0)
+            per_msg = f"{total / row['count'] * 1e6:>8.1f}" if row["count"] else f"{'':>8}"
+            print(f"    {topic:<34} {row['count'] or '':>9}"
+                  + "".join(f" {row[stage]:>9.2f}" if stage in row else f" {'':>9}" for stage in stages)
+                  + f" {total:>9.2f} {per_msg}")
+        print(f"    {'all':<34} {'':>9}" + "".join(f" {totals[stage]:>9.2f}" for stage in stages)
+              + f" {sum(totals.values()):>9.2f}")
+
+
+def profile_records(run_profile):
+    """Flatten the run profile into [{"pass", "stage", "topic", "seconds", "count"}]."""
+    return [
+        {"pass": pass_name, "stage": stage, "topic": topic, "seconds": seconds, "count": count}
+        for pass_name, profile in run_profile.items()
+        for (stage, topic), (seconds, count) in sorted(profile.stats.items())
+    ]
+
+
+def profile_metric_rows(run_profile, run_stats, mission, vessel, timestamp):
+    """extraction_metrics rows: one per (pass, stage, topic), plus each pass's wall time (stage "wall")."""
+    rows = []
+    for record in profile_records(run_profile):
+        tags = {"mission": mission, "vessel": vessel, "pass": record["pass"], "stage": record["stage"],
+                "topic": record["topic"]}
+        fields = {"seconds": record["seconds"], "count": record["count"],
+                  "us_per_item": record["seconds"] / record["count"] * 1e6 if record["count"] else 0.0}
+        rows.append((timestamp, tags, fields))
+    for pass_name, stats in run_stats["passes"].items():
+        tags = {"mission": mission, "vessel": vessel, "pass": pass_name, "stage": "wall", "topic": "all"}
+        rows.append((timestamp, tags, {"seconds": stats["seconds"], "count": stats["files"],
+                                       "points": stats["points"], "mb": stats["mb"]}))
+    return rows
+
+
+# ====================================================================
+# Columnar topic buffers — decoded sensor data, not yet mode-tagged
 # ====================================================================
-def create_point(measurement, timestamp, fields, tags, extra_tags):
-    point = Point(measurement)
+def new_topic_buffer():
+    return {"timestamps": [], "columns": {}, "extra_tags": []}
+
 
-    for tag_name, tag_value in tags.items():
-        point.tag(tag_name, tag_value)
-    for tag_name, tag_value in extra_tags.items():
-        point.tag(tag_name, str(tag_value))
+def append_to_buffer(buffers, topic, timestamp, fields, extra_tags):
+    """Append one processed message to its topic buffer (one list per field)."""
+    buffer = buffers.get(topic)
+    if buffer is None:
+        buffer = buffers[topic] = new_topic_buffer()
 
+    columns = buffer["columns"]
+    row = len(buffer["timestamps"])
     for field_name, value in fields.items():
-        if isinstance(value, bool):
-            point.field(field_name, value)
-        elif isinstance(value, int):
-            point.field(field_name, value)
-        elif isinstance(value, float):
-            if math.isnan(value) or math.isinf(value):
+        column = columns.get(field_name)
+        if column is None:
+            column = columns[field_name] = [None] * row
+        column.append(value)
+    for column in columns.values():
+        if len(column) == row:
+            column.append(None)
+    buffer["timestamps"].append(timestamp)
+    buffer["extra_tags"].append(extra_tags or None)
+
+
+def drop_written_rows(buffers, resume):
+    """Drop the rows of each topic up to its last written timestamp (buffers are in time order)."""
+    for topic, last_ts in resume.items():
+        buffer = buffers.get(topic)
+        if buffer is None:
+            continue
+        keep = bisect.bisect_right(buffer["timestamps"], last_ts)
+        buffer["timestamps"] = buffer["timestamps"][keep:]
+        buffer["extra_tags"] = buffer["extra_tags"][keep:]
+        buffer["columns"] = {name: column[keep:] for name, column in buffer["columns"].items()}
+        if not buffer["timestamps"]:
+            del buffers[topic]
+
+
+def decode_message(decoders, topic, rawdata, msgtype):
+    """Deserialize one sensor message and run its topic processor."""
+    if _profile is None:
+        return TOPIC_PROCESSORS[topic][1](decoders.deserialize(rawdata, msgtype))
+
+    start = time.perf_counter()
+    msg = decoders.deserialize(rawdata, msgtype)
+    decoded = time.perf_counter()
+    result = TOPIC_PROCESSORS[topic][1](msg)
+    _profile.add("decode", topic, decoded - start)
+    _profile.add("process", topic, time.perf_counter() - decoded)
+    return result
+
+
+def write_topic_buffers(buffers, mission, vessel, mode_timeline, sink, topic_errors):
+    """Mode-tag decoded topic buffers and write them in BATCH_SIZE chunks.
+
+    Returns {topic: points_written}. A topic the fast serializer can't
+    handle falls back to per-point create_point, where points that fail
+    to build are counted in topic_errors as in the original Pass 2.
+    """
+    serializer = LineProtocolSerializer(mission, vessel, mode_timeline.mode_names)
+    topic_counts = {}
+
+    for topic, buffer in buffers.items():
+        measurement_name = TOPIC_PROCESSORS[topic][0]
+        rows = len(buffer["timestamps"])
+        if _profile is not None:
+            start = time.perf_counter()
+        mode_codes = mode_timeline.lookup_many(buffer["timestamps"]).tolist()
+        if _profile is not None:
+            tagged = time.perf_counter()
+
+        try:
+            lines = serializer.serialize(measurement_name, buffer, mode_codes)
+        except Exception:
+            write_topic_points(topic, measurement_name, buffer, mode_codes, serializer.tags_by_code,
+                               sink, topic_counts, topic_errors)
+            continue
+        if _profile is not None:
+            serialized = time.perf_counter()
+
+        topic_counts[topic] = rows
+        if sink:
+            for i in range(0, len(lines), BATCH_SIZE):
+                chunk = lines[i:i + BATCH_SIZE]
+                # Each line ends with its timestamp; the chunk's last one is the topic's resume point
+                sink.write_chunk("\n".join(chunk).encode("utf-8"), topic, len(chunk),
+                                 int(chunk[-1].rsplit(" ", 1)[1]))
+        if _profile is not None:
+            _profile.add("tag", topic, tagged - start, rows)
+            _profile.add("serialize", topic, serialized - tagged, rows)
+            _profile.add("write", topic, time.perf_counter() - serialized, rows)
+
+    return topic_counts
+
+
+def write_topic_points(topic, measurement_name, buffer, mode_codes, tags_by_code,
+                       sink, topic_counts, topic_errors):
+    """Fallback writer: one Point per row, errors counted per row."""
+    timestamps = buffer["timestamps"]
+    columns = list(buffer["columns"].items())
+    lines = []
+
+    for row, timestamp in enumerate(timestamps):
+        try:
+            fields = {name: column[row] for name, column in columns if column[row] is not None}
+            extra_tags = buffer["extra_tags"][row] or {}
+            tags = tags_by_code[mode_codes[row]]
+
+            line = create_point(measurement_name, timestamp, fields, tags, extra_tags).to_line_protocol()
+            topic_counts[topic] = topic_counts.get(topic, 0) + 1
+        except Exception:
+            topic_errors[topic] = topic_errors.get(topic, 0) + 1
+            continue
+
+        if line:
+            lines.append(line)
+            last_ts = timestamp
+        if sink and len(lines) >= BATCH_SIZE:
+            sink.write_chunk("\n".join(lines).encode("utf-8"), topic, len(lines), last_ts)
+            lines = []
+
+    if lines and sink:
+        sink.write_chunk("\n".join(lines).encode("utf-8"), topic, len(lines), last_ts)
+
+
+# ====================================================================
+# Ingest policies (--decimate) — rate caps and decimation per measurement
+# ====================================================================
+# Not every consumer needs full rate. A policy thins one measurement's
+# messages before they are written (and before rollups see them):
+#   every:N           keep every Nth message (counted per Pass 2 task)
+#   hz:N              at most N messages per second: the first one in each
+#                     1/N s slot of the timestamp grid
+#   minmax:WINDOW:F   per window (e.g. 1s) and series, the rows holding the
+#                     min and the max of field F (LTTB-style plot thinning)
+#   all               keep everything (overrides a TOPIC_PROCESSORS default)
+# every and hz only look at the timestamp, so dropped messages are never
+# deserialized — except on SERIES_TOPICS, where one topic interleaves
+# several series (power_mgmt's cards) and the rate has to be counted per
+# series after decoding. minmax always needs the decoded values. hz slots
+# depend on the timestamp alone, so re-reading a range (resume, re-tag)
+# keeps the same messages, though a slot cut by a bag or shard edge can
+# keep one message on each side; every:N restarts its count per task.
+SERIES_TOPICS = {"/pm/feedback"}  # topics whose processor returns per-message extra tags
+DURATION_UNITS = {"ms": 1_000_000, "s": 1_000_000_000, "m": 60_000_000_000, "h": 3_600_000_000_000}
+_decimation = None  # {topic: policy} in Pass 2 workers when --decimate is used
+
+
+def parse_duration(text):
+    """'500ms', '1s', '10m', '1h' → ns (positive whole number of a unit), or None."""
+    match = re.fullmatch(r"(\d+)(ms|s|m|h)", text.strip())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_ingest_policy(text):
+    """Policy text → ("every", N), ("hz", slot_ns), ("minmax", window_ns, field) or None ('all').
+
+    Raises ValueError for anything else.
+    """
+    kind, _, arg = text.strip().partition(":")
+    if kind == "all" and not arg:
+        return None
+    if kind == "every" and arg.isdigit() and int(arg) > 0:
+        return ("every", int(arg))
+    if kind == "hz":
+        try:
+            rate = float(arg)
+        except ValueError:
+            rate = 0.0
+        if rate > 0:
+            return ("hz", max(int(round(1e9 / rate)), 1))
+    if kind == "minmax":
+        window, _, field = arg.partition(":")
+        width = parse_duration(window)
+        if width and field:
+            return ("minmax", width, field)
+    raise ValueError(f"bad policy '{text}' (use every:N, hz:N, minmax:WINDOW:FIELD or all)")
+
+
+def describe_policy(policy):
+    if policy is None:
+        return "all"
+    if policy[0] == "every":
+        return f"every:{policy[1]}"
+    if policy[0] == "hz":
+        return f"hz:{1e9 / policy[1]:g}"
+    return f"minmax:{policy[1] / 1e9:g}s:{policy[2]}"
+
+
+def measurement_topics():
+    """{measurement: [topics]} from TOPIC_PROCESSORS."""
+    by_measurement = {}
+    for topic, entry in TOPIC_PROCESSORS.items():
+        by_measurement.setdefault(entry[0], []).append(topic)
+    return by_measurement
+
+
+def topic_fields(topic):
+    """Names of the fields a topic's processor writes (COLUMNAR_FIELDS + PARQUET_DERIVED_FIELDS)."""
+    return ([name for name, _, _ in COLUMNAR_FIELDS[topic]]
+            + [name for name, _ in PARQUET_DERIVED_FIELDS.get(topic, [])])
+
+
+def ingest_policies(config_path=None, specs=()):
+    """{topic: policy} for every decimated topic.
+
+    Starts from the TOPIC_PROCESSORS defaults; a JSON config file
+    ({"power_mgmt": "hz:5", ...}) and then each --decimate
+    MEASUREMENT=POLICY override them. Keys are measurement names or topics.
+    Raises ValueError for unknown names, bad policies or a minmax field the
+    measurement doesn't have.
+    """
+    policies = {topic: entry[2] for topic, entry in TOPIC_PROCESSORS.items()}
+    overrides = []
+    if config_path:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError(f"{config_path}: expected a JSON object of measurement → policy")
+        overrides += list(config.items())
+    for spec in specs:
+        name, sep, policy = spec.partition("=")
+        if not sep:
+            raise ValueError(f"bad --decimate '{spec}' (use MEASUREMENT=POLICY)")
+        overrides.append((name, policy))
+
+    by_measurement = measurement_topics()
+    for name, policy in overrides:
+        topics = [name] if name in TOPIC_PROCESSORS else by_measurement.get(name.strip())
+        if not topics:
+            raise ValueError(f"unknown measurement or topic '{name}'")
+        for topic in topics:
+            parsed = parse_ingest_policy(str(policy))
+            if parsed and parsed[0] == "minmax" and parsed[2] not in topic_fields(topic):
+                raise ValueError(f"unknown field '{parsed[2]}' for {TOPIC_PROCESSORS[topic][0]} "
+                                 f"(fields: {', '.join(topic_fields(topic))})")
+            policies[topic] = parsed
+    return {topic: policy for topic, policy in policies.items() if policy is not None}
+
+
+def dropped_note(topic, topic_dropped, decimation):
+    """' (N dropped by POLICY)' for a summary line, or '' for a topic without a policy."""
+    if not decimation or topic not in decimation:
+        return ""
+    return f" ({topic_dropped.get(topic, 0)} dropped by {describe_policy(decimation[topic])})"
+
+
+def decimation_summary(topic_counts, topic_dropped, decimation):
+    kept = sum(topic_counts.get(topic, 0) for topic in decimation)
+    dropped = sum(topic_dropped.get(topic, 0) for topic in decimation)
+    return (f"  Decimated: kept {kept} of {kept + dropped} messages in {len(decimation)} topics "
+            f"({dropped} dropped at ingest)")
+
+
+class IngestGate:
+    """One Pass 2 task's ingest policies.
+
+    keep() makes the every:N / hz:N decision on the timestamp, before a
+    message is deserialized. thin() applies what needs decoded rows to
+    topic buffers: minmax, and the rate policies of SERIES_TOPICS, which
+    count per series. dropped is {topic: messages dropped}.
+    """
+
+    def __init__(self, policies):
+        self.early = {topic: policy for topic, policy in policies.items()
+                      if policy[0] != "minmax" and topic not in SERIES_TOPICS}
+        self.late = {topic: policy for topic, policy in policies.items() if topic not in self.early}
+        self.state = {}  # topic or (topic, series) -> [messages seen, last hz slot]
+        self.dropped = {}
+
+    def _keep(self, key, policy, timestamp):
+        state = self.state.setdefault(key, [0, None])
+        if policy[0] == "every":
+            state[0] += 1
+            return (state[0] - 1) % policy[1] == 0
+        slot = timestamp // policy[1]
+        if slot == state[1]:
+            return False
+        state[1] = slot
+        return True
+
+    def keep(self, topic, timestamp):
+        policy = self.early.get(topic)
+        if policy is None or self._keep(topic, policy, timestamp):
+            return True
+        self.dropped[topic] = self.dropped.get(topic, 0) + 1
+        return False
+
+    def thin(self, buffers):
+        """Apply the late policies to decoded {topic: buffer} in place."""
+        for topic, buffer in buffers.items():
+            policy = self.late.get(topic)
+            rows = len(buffer["timestamps"])
+            if policy is None or not rows:
                 continue
-            point.field(field_name, value)
-        else:
-            point.field(field_name, str(value))
+            if policy[0] == "minmax":
+                kept = min_max_rows(buffer, policy[1], policy[2])
+            else:
+                kept = [row for row, (timestamp, tags) in enumerate(zip(buffer["timestamps"], buffer["extra_tags"]))
+                        if self._keep((topic, tuple(sorted((tags or {}).items()))), policy, timestamp)]
+            if kept is None or len(kept) == rows:
+                continue
+            self.dropped[topic] = self.dropped.get(topic, 0) + rows - len(kept)
+            buffer["timestamps"] = [buffer["timestamps"][i] for i in kept]
+            buffer["extra_tags"] = [buffer["extra_tags"][i] for i in kept]
+            buffer["columns"] = {name: [column[i] for i in kept] for name, column in buffer["columns"].items()}
+
+    def thinned(self, chunks):
+        for buffers in chunks:
+            self.thin(buffers)
+            yield buffers
+
+
+def min_max_rows(buffer, width, field):
+    """Indices of the rows holding field's min and max per window and series, or None (no such numeric field).
+
+    A window cut by a bag or shard edge is thinned on each side, so it
+    can keep up to four rows.
+    """
+    column = buffer["columns"].get(field)
+    if column is None:
+        return None
+    try:
+        values = np.array(column, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    rows = len(values)
+    windows = np.asarray(buffer["timestamps"], dtype=np.int64) // width
+    keep = np.zeros(rows, dtype=bool)
+    for _, series in series_rows(buffer["extra_tags"]):
+        index = np.arange(rows)[series]
+        group = np.concatenate(([0], np.cumsum(windows[index][1:] != windows[index][:-1])))
+        firsts = np.flatnonzero(np.diff(np.append(-1, group)))
+        lasts = np.append(firsts[1:], len(index)) - 1
+        v = values[index]
+        # Sorting by (window, value) puts each window's min first and max last; missing values sort out
+        lowest = np.lexsort((np.where(np.isnan(v), np.inf, v), group))
+        highest = np.lexsort((np.where(np.isnan(v), -np.inf, v), group))
+        keep[index[lowest[firsts]]] = True
+        keep[index[highest[lasts]]] = True
+    return np.flatnonzero(keep).tolist()
+
+
+# ====================================================================
+# Rollups (--rollups) — per-mode mean/min/max/last windows
+# ====================================================================
+# A Grafana panel over a 14-hour mission scans every raw 20 Hz point
+# unless a coarser series exists. With --rollups each Pass 2 task also
+# folds its decoded rows into fixed windows (1s, 10s and 1m by default)
+# and writes <measurement>_<window> points with the same tags and, per
+# numeric field, <field>_mean/_min/_max/_last plus the row count. Only the
+# high-rate measurements are rolled up by default (--rollup-measurements):
+# a 1s window over a sub-Hz topic like battery_state just copies its raw
+# points. Windows are cut at every segment boundary so a piece never
+# mixes modes; each piece is stamped with its start (the window start or
+# the boundary).
+#
+# A piece wholly inside the task's time range is final and written by the
+# worker. One at the edge of a bag or time shard goes back to the parent,
+# which keeps the partial stats per (bag, range) in the tracker database
+# (RollupEdges) and rewrites the merged piece whenever one of its parts
+# changes, so windows spanning bags, shards, workers and runs end up as a
+# single read would compute them (up to float summation order).
+ROLLUP_DEFAULT = "1s,10s,1m"
+ROLLUP_MEASUREMENTS_DEFAULT = "power_mgmt,ekf_euler,ahrs8"
+_rollups = None  # {"windows": [(label, width_ns)], "topics": {topic}} in Pass 2 workers when --rollups is on
+
+
+def rollup_policies(windows=ROLLUP_DEFAULT, measurements=ROLLUP_MEASUREMENTS_DEFAULT):
+    """--rollups / --rollup-measurements → the _rollups config.
+
+    measurements is a comma-separated list of measurement names, or "all".
+    Raises ValueError for bad windows or unknown measurements.
+    """
+    by_measurement = measurement_topics()
+    names = [name.strip() for name in measurements.split(",") if name.strip()]
+    if names == ["all"]:
+        names = list(by_measurement)
+    if not names:
+        raise ValueError("no measurements to roll up")
+    topics = set()
+    for name in names:
+        if name not in by_measurement:
+            raise ValueError(f"unknown measurement '{name}'")
+        topics.update(by_measurement[name])
+    return {"windows": parse_rollup_windows(windows), "topics": topics}
+
+
+def describe_rollups(rollups):
+    """'1s, 10s, 1m of ahrs8, ekf_euler, power_mgmt' for the setup header."""
+    return (", ".join(label for label, _ in rollups["windows"]) + " of "
+            + ", ".join(rollup_measurement_names(rollups)))
+
+
+def rollup_measurement_names(rollups):
+    return sorted({TOPIC_PROCESSORS[topic][0] for topic in rollups["topics"]})
+
+
+def parse_rollup_windows(spec):
+    """'1s,10s,1m' → [(label, width_ns)], smallest first.
+
+    Raises ValueError unless every window is a parse_duration() that
+    divides the largest one (re-tags rebuild whole windows of the largest
+    size).
+    """
+    windows = {}
+    for label in spec.split(","):
+        label = label.strip()
+        width = parse_duration(label)
+        if width is None:
+            raise ValueError(f"bad rollup window '{label}' (use e.g. 1s, 10s, 1m, 1h)")
+        windows[label] = width
+    largest = max(windows.values())
+    for label, width in windows.items():
+        if largest % width:
+            raise ValueError(f"rollup window {label} does not divide the largest window")
+    return sorted(windows.items(), key=lambda item: item[1])
+
+
+def rollup_measurements(rollups):
+    """Names of every rollup measurement for this _rollups config."""
+    return [f"{measurement}_{label}" for measurement in rollup_measurement_names(rollups)
+            for label, _ in rollups["windows"]]
+
+
+def numeric_columns(buffer):
+    """{field: float array} for a buffer's int/float columns (None → NaN); bools and strings are skipped."""
+    columns = {}
+    for name, column in buffer["columns"].items():
+        sample = next((value for value in column if value is not None), None)
+        if isinstance(sample, bool) or not isinstance(sample, (int, float)):
+            continue
+        try:
+            columns[name] = np.array(column, dtype=np.float64)
+        except (TypeError, ValueError):
+            continue
+    return columns
+
+
+def series_rows(extra_tags):
+    """[(tags, rows)] per extra-tag series of a buffer: tags a sorted tuple of pairs, rows an index."""
+    if not any(extra_tags):
+        return [((), slice(None))]
+    rows = {}
+    for row, tags in enumerate(extra_tags):
+        key = tuple(sorted((name, str(value)) for name, value in tags.items())) if tags else ()
+        rows.setdefault(key, []).append(row)
+    return [(tags, np.array(indices)) for tags, indices in rows.items()]
+
+
+def merge_rollup_stats(into, stats):
+    """Fold {field: [n, sum, min, max, last_ts, last]} into another such dict."""
+    for name, (n, total, low, high, last_ts, last) in stats.items():
+        current = into.get(name)
+        if current is None:
+            into[name] = [n, total, low, high, last_ts, last]
+            continue
+        current[0] += n
+        current[1] += total
+        current[2] = min(current[2], low)
+        current[3] = max(current[3], high)
+        if last_ts > current[4]:
+            current[4], current[5] = last_ts, last
+
+
+class RollupAccumulator:
+    """One Pass 2 task's rollup pieces, folded in chunk by chunk.
+
+    pieces maps (measurement, width, tags, start) → [stop, rows, stats]:
+    tags is a sorted tuple of (key, value) pairs including the mode, stats
+    is {field: [n, sum, min, max, last_ts, last]} over the finite values.
+    """
+
+    def __init__(self, rollups, mode_timeline):
+        self.windows = rollups["windows"]
+        self.topics = rollups["topics"]
+        self.mode_timeline = mode_timeline
+        boundaries = np.unique(np.concatenate([mode_timeline.start_array, mode_timeline.end_array]))
+        self.boundaries = boundaries
+        # bounds[r] and bounds[r + 1] enclose region r (between two boundaries, one mode)
+        self.bounds = np.concatenate(([np.iinfo(np.int64).min], boundaries, [np.iinfo(np.int64).max]))
+        self.pieces = {}
+
+    def add(self, topic, buffer):
+        if topic not in self.topics:
+            return
+        timestamps = np.asarray(buffer["timestamps"], dtype=np.int64)
+        columns = numeric_columns(buffer) if len(timestamps) else {}
+        if not columns:
+            return
+        measurement = TOPIC_PROCESSORS[topic][0]
+        modes = self.mode_timeline.lookup_many(timestamps)
+        regions = np.searchsorted(self.boundaries, timestamps, side="right")
+
+        for extra, rows in series_rows(buffer["extra_tags"]):
+            ts, series_modes, region = timestamps[rows], modes[rows], regions[rows]
+            fields = {name: values[rows] for name, values in columns.items()}
+            for label, width in self.windows:
+                window = ts // width
+                starts = np.concatenate(([0], np.flatnonzero((window[1:] != window[:-1])
+                                                             | (region[1:] != region[:-1])) + 1))
+                self._fold(f"{measurement}_{label}", width, extra, ts, series_modes, window, region, starts, fields)
+
+    def _fold(self, measurement, width, extra, ts, modes, window, region, starts, fields):
+        # Per-piece reductions over the runs beginning at starts, one field at a time
+        counts = np.diff(np.append(starts, len(ts))).tolist()
+        piece_starts = np.maximum(window[starts] * width, self.bounds[region[starts]]).tolist()
+        piece_stops = np.minimum((window[starts] + 1) * width, self.bounds[region[starts] + 1]).tolist()
+        positions = np.arange(len(ts))
+        reduced = []
+        for name, values in fields.items():
+            valid = np.isfinite(values)
+            clean = np.where(valid, values, np.nan)
+            last = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+            reduced.append((name, np.add.reduceat(valid.astype(np.int64), starts).tolist(),
+                            np.add.reduceat(np.where(valid, values, 0.0), starts).tolist(),
+                            np.fmin.reduceat(clean, starts).tolist(), np.fmax.reduceat(clean, starts).tolist(),
+                            ts[last].tolist(), values[last].tolist()))
+
+        mode_names = self.mode_timeline.mode_names
+        for i, start in enumerate(starts.tolist()):
+            stats = {name: [n[i], total[i], low[i], high[i], last_ts[i], last[i]]
+                     for name, n, total, low, high, last_ts, last in reduced if n[i]}
+            if not stats:
+                continue
+            tags = tuple(sorted(extra + (("mode", mode_names[modes[start]]),)))
+            key = (measurement, width, tags, piece_starts[i])
+            piece = self.pieces.get(key)
+            if piece is None:
+                self.pieces[key] = [piece_stops[i], counts[i], stats]
+            else:
+                piece[1] += counts[i]
+                merge_rollup_stats(piece[2], stats)
+
+    def finish(self, ranges):
+        """Split the pieces by the task's [(lo, hi)] time ranges.
+
+        Returns (final, edges): final is [(measurement, tags, start, stop,
+        rows, stats)] for pieces whose whole window lies in one range,
+        edges is [(lo, hi, partial pieces)] for every range — the parent
+        replaces the bag's earlier partials in that range with these.
+        """
+        final = []
+        edges = [(lo, hi, []) for lo, hi in ranges]
+        for (measurement, width, tags, start), (stop, rows, stats) in self.pieces.items():
+            window_start = start // width * width
+            piece = (measurement, tags, start, stop, rows, stats)
+            for lo, hi, partials in edges:
+                # start may precede lo: a piece runs from its window or segment start, not its first row
+                if start < hi and stop > lo:
+                    if lo <= window_start and window_start + width <= hi:
+                        final.append(piece)
+                    else:
+                        partials.append(piece)
+                    break
+        return final, edges
+
+
+def rollup_rows(pieces, mission, vessel):
+    """{measurement: [(timestamp_ns, tags, fields)]} for finished pieces."""
+    rows = {}
+    for measurement, tags, start, _, count, stats in pieces:
+        fields = {"count": count}
+        for name, (n, total, low, high, _, last) in stats.items():
+            fields[f"{name}_mean"] = total / n
+            fields[f"{name}_min"] = low
+            fields[f"{name}_max"] = high
+            fields[f"{name}_last"] = last
+        rows.setdefault(measurement, []).append(
+            (start, {"mission": mission, "vessel": vessel, **dict(tags)}, fields))
+    return rows
+
+
+def write_rollup_rows(sink, rows):
+    """Write rollup_rows() output in BATCH_SIZE chunks; returns the number of points."""
+    points = 0
+    for measurement, measurement_rows in rows.items():
+        for i in range(0, len(measurement_rows), BATCH_SIZE):
+            sink.write_rows(measurement, measurement_rows[i:i + BATCH_SIZE])
+        points += len(measurement_rows)
+    return points
+
+
+class RollupEdges:
+    """Partial rollup pieces from Pass 2 tasks, merged per piece across bags, shards and runs.
+
+    Lives in the tracker database (in memory for untracked sinks). A task
+    reports each of its time ranges; the bag's earlier partials for that
+    range are replaced, so re-reading a bag (resume, re-tag, --force)
+    never counts rows twice, and every piece whose parts changed is
+    merged again and returned for writing. Such pieces stay dirty until
+    mark_written(); a run that died or failed before the sink had them
+    leaves them for the next run's dirty().
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rollup_edges (
+        bag TEXT NOT NULL,
+        lo INTEGER NOT NULL,
+        hi INTEGER NOT NULL,
+        measurement TEXT NOT NULL,
+        tags TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        stop INTEGER NOT NULL,
+        piece TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS rollup_edges_piece ON rollup_edges (measurement, tags, start);
+    CREATE INDEX IF NOT EXISTS rollup_edges_bag ON rollup_edges (bag, lo);
+    CREATE TABLE IF NOT EXISTS rollup_dirty (
+        measurement TEXT NOT NULL,
+        tags TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        PRIMARY KEY (measurement, tags, start)
+    );
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ":memory:"
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+
+    def replace(self, bag_path, lo, hi, partials):
+        """Swap in one task range's partials; return the re-merged pieces they touch, marked dirty."""
+        conn = self._connect()
+        name = os.path.basename(bag_path)
+        overlap = "bag = ? AND lo < ? AND hi > ? AND start < ? AND stop > ?"
+        with conn:
+            keys = set(conn.execute(f"SELECT measurement, tags, start FROM rollup_edges WHERE {overlap}",
+                                    (name, hi, lo, hi, lo)))
+            conn.execute(f"DELETE FROM rollup_edges WHERE {overlap}", (name, hi, lo, hi, lo))
+            rows = [(name, lo, hi, measurement, json.dumps(tags), start, stop, json.dumps([count, stats]))
+                    for measurement, tags, start, stop, count, stats in partials]
+            conn.executemany("INSERT INTO rollup_edges VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            keys.update((measurement, tags, start) for _, _, _, measurement, tags, start, _, _ in rows)
+            conn.executemany("INSERT OR IGNORE INTO rollup_dirty VALUES (?, ?, ?)", keys)
+            return self._merge(conn, keys)
+
+    def dirty(self):
+        """Merged pieces whose last write never reached the sink."""
+        conn = self._connect()
+        with conn:
+            return self._merge(conn, conn.execute("SELECT measurement, tags, start FROM rollup_dirty").fetchall())
+
+    def mark_written(self, pieces):
+        """The sink has these pieces (from replace() or dirty())."""
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM rollup_dirty WHERE measurement = ? AND tags = ? AND start = ?",
+                             [(measurement, json.dumps(tags), start) for measurement, tags, start, *_ in pieces])
+
+    @staticmethod
+    def _merge(conn, keys):
+        merged = []
+        for measurement, tags, start in keys:
+            parts = conn.execute("SELECT stop, piece FROM rollup_edges"
+                                 " WHERE measurement = ? AND tags = ? AND start = ?",
+                                 (measurement, tags, start)).fetchall()
+            if not parts:
+                # Every part was replaced away; nothing left to write
+                conn.execute("DELETE FROM rollup_dirty WHERE measurement = ? AND tags = ? AND start = ?",
+                             (measurement, tags, start))
+                continue
+            count, stats = 0, {}
+            for _, piece in parts:
+                piece_count, piece_stats = json.loads(piece)
+                count += piece_count
+                merge_rollup_stats(stats, piece_stats)
+            merged.append((measurement, tuple(map(tuple, json.loads(tags))), start,
+                           max(stop for stop, _ in parts), count, stats))
+        return merged
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def write_rollup_edges(edges, bag_path, rollup, sink, mission, vessel):
+    """Parent side of a task's rollups: fold its partials into edges, write the merged pieces.
 
-    point.time(timestamp, WritePrecision.NS)
-    return point
+    A failed write raises with the pieces still dirty; the caller fails the bag.
+    """
+    points = 0
+    for lo, hi, partials in rollup["edges"]:
+        pieces = edges.replace(bag_path, lo, hi, partials)
+        points += write_rollup_rows(sink, rollup_rows(pieces, mission, vessel))
+        edges.mark_written(pieces)
+    return points
+
+
+def write_dirty_rollup_edges(edges, sink, mission, vessel):
+    """Rewrite the pieces an earlier run merged but never got into the sink; returns the points."""
+    pieces = edges.dirty()
+    if not pieces:
+        return 0
+    try:
+        points = write_rollup_rows(sink, rollup_rows(pieces, mission, vessel))
+    except Exception as e:
+        print(f"  WARNING: could not rewrite {len(pieces)} unwritten rollup pieces (kept for the next run): {e}")
+        return 0
+    edges.mark_written(pieces)
+    print(f"  Rewrote {len(pieces)} rollup pieces an earlier run left unwritten")
+    return points
+
+
+# ====================================================================
+# Change-only encoding (--change-only, --deadband)
+# ====================================================================
+# power_mgmt writes 16 booleans per message and ekf_euler 16 status
+# fields; they rarely change, yet were written at full rate. With
+# --change-only a measurement's boolean, integer and string fields are
+# written only when they differ from the series' last written value
+# (series = measurement + card_id), and --deadband MEASUREMENT.FIELD=BAND
+# holds an analog field until it moves more than BAND (absolute, or
+# relative with a % suffix) away from its last written value. Every field
+# is written again at a keyframe: a series' first row after a --keyframe
+# grid point (1m by default) or a mode boundary, so a query range or a
+# mode filter always finds a recent value. A row left with nothing to
+# write is not written; rollups are folded from the full rows first.
+#
+# What is written at a row depends only on the rows since the keyframe
+# epoch started, so a task whose range starts mid-epoch first replays
+# that lead-in: from its own bag (time shards, re-tag windows) or from
+# the splits before it (lead_in). The output is then the same however
+# bags are split into tasks, and re-tags are widened to whole keyframe
+# intervals. Decimated topics are not replayed (which rows every:N and
+# minmax keep depends on the task), so each task starts them with a
+# keyframe instead.
+KEYFRAME_DEFAULT = "1m"
+CHANGE_ONLY_DEFAULT = "power_mgmt,ekf_euler"
+_change_only = None  # {"keyframe": ns, "topics": {topic: (discrete, deadbands)}} in Pass 2 workers
+
+
+def change_only_policies(measurements=None, deadbands=(), keyframe=KEYFRAME_DEFAULT):
+    """--change-only / --deadband / --keyframe → the _change_only config, or None if nothing is encoded.
+
+    measurements is a comma-separated list whose discrete (bool, int,
+    string) fields become change-only; deadbands are MEASUREMENT.FIELD=BAND
+    specs, stored as {field: (band, relative)}. Raises ValueError for
+    unknown measurements or fields, bad bands or a bad keyframe.
+    """
+    width = parse_duration(keyframe)
+    if width is None:
+        raise ValueError(f"bad --keyframe '{keyframe}' (use e.g. 30s, 1m, 1h)")
+    by_measurement = measurement_topics()
+    topics = {}
+    for name in (measurements or "").split(","):
+        if not name.strip():
+            continue
+        if name.strip() not in by_measurement:
+            raise ValueError(f"unknown measurement '{name}'")
+        for topic in by_measurement[name.strip()]:
+            topics[topic] = (True, {})
+    for spec in deadbands:
+        target, sep, band = spec.partition("=")
+        measurement, dot, field = target.strip().partition(".")
+        if not sep or not dot or not field:
+            raise ValueError(f"bad --deadband '{spec}' (use MEASUREMENT.FIELD=BAND)")
+        if measurement not in by_measurement:
+            raise ValueError(f"unknown measurement '{measurement}'")
+        fields = topic_fields(by_measurement[measurement][0])
+        if field not in fields:
+            raise ValueError(f"unknown field '{field}' for {measurement} (fields: {', '.join(fields)})")
+        band = band.strip()
+        relative = band.endswith("%")
+        try:
+            value = float(band[:-1] if relative else band)
+        except ValueError:
+            value = -1.0
+        if not 0 <= value < math.inf:
+            raise ValueError(f"bad deadband '{band}' (use e.g. 0.05 or 2%)")
+        for topic in by_measurement[measurement]:
+            discrete, bands = topics.setdefault(topic, (False, {}))
+            bands[field] = (value / 100 if relative else value, relative)
+    if not topics:
+        return None
+    return {"keyframe": width, "topics": topics}
+
+
+def describe_change_only(change_only):
+    """'power_mgmt, ekf_euler (temperature ±0.5), keyframe 1m' for the setup header."""
+    parts = []
+    for topic, (discrete, bands) in change_only["topics"].items():
+        text = TOPIC_PROCESSORS[topic][0]
+        if bands:
+            text += " (" + ", ".join(f"{field} ±{band * 100:g}%" if relative else f"{field} ±{band:g}"
+                                     for field, (band, relative) in bands.items()) + ")"
+        parts.append(text if discrete else text + " deadband only")
+    return ", ".join(parts) + f", keyframe {change_only['keyframe'] / 1e9:g}s"
+
+
+def lead_in_bags(bag_path, bag_intervals, change_only):
+    """Splits before bag_path that can hold the lead-in of its first keyframe epoch, oldest first."""
+    if not change_only:
+        return None
+    bag = next((bag for bag in bag_intervals if bag["path"] == bag_path), None)
+    if bag is None:
+        return []
+    earliest = bag["start_time"] - change_only["keyframe"]
+    return [other["path"] for other in bag_intervals
+            if other["path"] != bag_path and other["start_time"] < bag["start_time"]
+            and other["end_time"] > earliest]
+
+
+def add_encoded_counts(totals, encoded):
+    """Add a task's ChangeEncoder.counts into the run's {topic: [values, written]}."""
+    for topic, (values, written) in encoded.items():
+        total = totals.setdefault(topic, [0, 0])
+        total[0] += values
+        total[1] += written
+
+
+def change_only_summary(encoded):
+    values = sum(counts[0] for counts in encoded.values())
+    written = sum(counts[1] for counts in encoded.values())
+    return (f"  Change-only: wrote {written} of {values} field values in {len(encoded)} measurements "
+            f"({(1 - written / values) * 100 if values else 0.0:.0f}% suppressed)")
+
+
+class ChangeEncoder:
+    """Change-only encoding of one Pass 2 task's topic buffers.
+
+    ranges are the task's [start, stop) time ranges (filled in lazily by
+    columnar reads); the first encode() replays each range's lead-in from
+    bag_path and the lead_in splits. counts is {topic: [field values,
+    field values written]} over the encoded topics.
+    """
+
+    def __init__(self, config, mode_timeline, bag_path, ranges, lead_in=None, decimated=()):
+        self.width = config["keyframe"]
+        self.topics = config["topics"]
+        self.bounds = np.unique(np.concatenate([mode_timeline.start_array, mode_timeline.end_array]))
+        self.bag_path = bag_path
+        self.ranges = ranges
+        self.lead_in = lead_in or []
+        self.replayed = [topic for topic in self.topics if topic not in decimated]
+        self.seeds = None     # per range: {topic: lead-in buffer}
+        self.state = {}       # (topic, series) -> [epoch, {field: last written value}]
+        self.position = {}    # topic -> index of the range its state is in
+        self.counts = {}
+
+    def epoch_start(self, timestamp):
+        """Where the keyframe epoch containing timestamp starts."""
+        start = timestamp // self.width * self.width
+        i = int(np.searchsorted(self.bounds, timestamp, side="right"))
+        return max(start, int(self.bounds[i - 1])) if i else start
+
+    def _read_seeds(self):
+        self.seeds = [{} for _ in self.ranges]
+        spans = [(i, self.epoch_start(start), start) for i, (start, _) in enumerate(self.ranges)]
+        spans = [span for span in spans if span[1] < span[2]]
+        if not spans or not self.replayed or self.bag_path is None:
+            return
+        decoders = shared_decoders()
+        for path in self.lead_in + [self.bag_path]:
+            try:
+                with BagFile(path) as bag:
+                    for i, lo, start in spans:
+                        for topic, timestamp, rawdata in bag.messages(self.replayed, lo, start):
+                            try:
+                                fields, extra_tags = decode_message(decoders, topic, rawdata, bag.msgtype(topic))
+                            except Exception:
+                                continue  # counted by the task that writes it
+                            append_to_buffer(self.seeds[i], topic, timestamp, fields, extra_tags)
+            except (OSError, sqlite3.Error):
+                continue  # a missing split only costs a keyframe
+
+    def encode(self, buffers):
+        """buffers with the change-only values that need no writing set to None (new column lists)."""
+        if self.seeds is None:
+            self._read_seeds()
+        starts = [start for start, _ in self.ranges]
+        encoded = dict(buffers)
+        for topic, buffer in buffers.items():
+            policy = self.topics.get(topic)
+            rows = len(buffer["timestamps"])
+            if policy is None or not rows:
+                continue
+            if _profile is not None:
+                start_time = time.perf_counter()
+            out = {}
+            positions = np.searchsorted(starts, buffer["timestamps"], side="right") - 1
+            cuts = np.flatnonzero(positions[1:] != positions[:-1]) + 1
+            for lo, hi in zip([0, *cuts.tolist()], [*cuts.tolist(), rows]):
+                position = int(positions[lo])
+                if self.position.get(topic) != position:
+                    # A new range: drop the state and replay the range's lead-in instead
+                    self.state = {key: value for key, value in self.state.items() if key[0] != topic}
+                    self.position[topic] = position
+                    seed = self.seeds[position].get(topic) if position >= 0 else None
+                    if seed is not None:
+                        self._encode_rows(topic, policy, seed, 0, len(seed["timestamps"]), None)
+                self._encode_rows(topic, policy, buffer, lo, hi, out)
+            encoded[topic] = {"timestamps": buffer["timestamps"], "extra_tags": buffer["extra_tags"],
+                              "columns": {name: out.get(name, column) for name, column in buffer["columns"].items()}}
+            if _profile is not None:
+                _profile.add("encode", topic, time.perf_counter() - start_time, rows)
+        return encoded
+
+    def _encode_rows(self, topic, policy, buffer, lo, hi, out):
+        """Advance the state over buffer rows lo:hi; with out ({field: column copy}), blank what isn't written."""
+        discrete, bands = policy
+        timestamps = np.asarray(buffer["timestamps"][lo:hi], dtype=np.int64)
+        grid = timestamps // self.width
+        regions = np.searchsorted(self.bounds, timestamps, side="right")
+        counts = self.counts.setdefault(topic, [0, 0]) if out is not None else None
+
+        for series, rows in series_rows(buffer["extra_tags"][lo:hi]):
+            index = np.arange(hi - lo)[rows]
+            n = len(index)
+            state = self.state.get((topic, series))
+            first = (int(grid[index[0]]), int(regions[index[0]]))
+            new = np.empty(n, dtype=bool)
+            new[0] = state is None or state[0] != first
+            new[1:] = (grid[index][1:] != grid[index][:-1]) | (regions[index][1:] != regions[index][:-1])
+            if state is None:
+                state = self.state[(topic, series)] = [first, {}]
+            last = {} if new[0] else state[1]
+            state[0] = (int(grid[index[-1]]), int(regions[index[-1]]))
+            rows_list = (index + lo).tolist()
+
+            for name, column in buffer["columns"].items():
+                values = [column[row] for row in rows_list]
+                sample = next((value for value in values if value is not None), None)
+                band = bands.get(name)
+                if band is not None and isinstance(sample, float):
+                    width, relative = band
+                    emit = []
+                    reference = last.get(name)
+                    for value, reset in zip(values, new.tolist()):
+                        if reset:
+                            reference = None
+                        keep = value is not None and (reference is None or not abs(value - reference) <= (
+                            width * abs(reference) if relative else width))
+                        if keep:
+                            reference = value
+                        emit.append(keep)
+                    last[name] = reference
+                    emit = np.array(emit, dtype=bool)
+                elif discrete and isinstance(sample, (bool, int, str)):
+                    current = np.empty(n, dtype=object)
+                    current[:] = values
+                    previous = np.empty(n, dtype=object)
+                    previous[0] = last.get(name)
+                    previous[1:] = current[:-1]
+                    emit = new | (current != previous)
+                    last[name] = values[-1]
+                else:
+                    emit = None  # always written
+                if out is None:
+                    continue
+                present = np.fromiter((value is not None for value in values), dtype=bool, count=n)
+                counts[0] += int(np.count_nonzero(present))
+                if emit is None:
+                    counts[1] += int(np.count_nonzero(present))
+                    continue
+                counts[1] += int(np.count_nonzero(emit & present))
+                blank = np.flatnonzero(~emit & present).tolist()
+                if blank:
+                    target = out.get(name)
+                    if target is None:
+                        target = out[name] = list(column)
+                    for i in blank:
+                        target[rows_list[i]] = None
+            state[1] = last
+
+
+# ====================================================================
+# Columnar decode (--columnar) — a whole topic chunk as NumPy arrays
+# ====================================================================
+# Raw payloads of one topic are joined into one buffer and viewed through
+# a structured dtype (cdr_decode.ColumnLayout); the processors below are
+# the vectorized counterparts of TOPIC_PROCESSORS and produce the same
+# values. Payloads that don't fit the layout go through decode_message.
+COLUMNAR_CHUNK = 50_000  # messages per topic per chunk (a multiple of BATCH_SIZE)
+
+# topic -> [(field_name, message path, cast)] for fields copied straight from the message
+_VECTOR3 = ("x", "y", "z")
+_QUATERNION = ("x", "y", "z", "w")
+COLUMNAR_FIELDS = {
+    "/battery_state": [
+        ("voltage", "voltage", "float"),
+        ("current", "current", "float"),
+        ("charge", "charge", "float"),
+        ("capacity", "capacity", "float"),
+        ("percentage", "percentage", "float"),
+        ("temperature", "temperature", "float"),
+        ("power_supply_status", "power_supply_status", "int"),
+        ("power_supply_health", "power_supply_health", "int"),
+        ("present", "present", "bool"),
+    ],
+    "/temperature": [("temperature_c", "temperature", "float")],
+    "/humidity": [("relative_humidity", "relative_humidity", "float")],
+    "/pressure": [("fluid_pressure", "fluid_pressure", "float")],
+    "/odometry/filtered": (
+        [(f"position_{a}", f"pose.pose.position.{a}", "float") for a in _VECTOR3]
+        + [(f"orientation_{a}", f"pose.pose.orientation.{a}", "float") for a in _QUATERNION]
+        + [(f"linear_velocity_{a}", f"twist.twist.linear.{a}", "float") for a in _VECTOR3]
+        + [(f"angular_velocity_{a}", f"twist.twist.angular.{a}", "float") for a in _VECTOR3]
+    ),
+    "/moving_base_second/navheading": (
+        [(f"orientation_{a}", f"orientation.{a}", "float") for a in _QUATERNION]
+        + [(f"angular_velocity_{a}", f"angular_velocity.{a}", "float") for a in _VECTOR3]
+    ),
+    "/gnss/fix": [
+        ("latitude", "latitude", "float"),
+        ("longitude", "longitude", "float"),
+        ("altitude", "altitude", "float"),
+        ("status", "status.status", "int"),
+        ("service", "status.service", "int"),
+    ],
+    "/vessel/mode": [("value", "value", "int")],
+    "/telemetry/state": [
+        (name, name, "float") for name in (
+            "latitude", "longitude", "heading", "vertical_speed", "depth", "altitude",
+            "course_over_ground", "speed_over_ground", "yaw_rate")
+    ],
+    "/telemetry/battery_state": [
+        ("voltage", "voltage", "float"),
+        ("charge_percentage", "charge_percentage", "float"),
+        ("is_charging", "is_charging", "bool"),
+        ("error_code", "error_code", "int"),
+    ],
+    "/pack_status": (
+        [(name, name, "bool") for name in (
+            "charge_power_status", "ready_power_status", "multipurpose_input", "bms_errors_present",
+            "charger_safety", "charge_enable", "discharge_enable")]
+        + [(name, name, "float") for name in (
+            "pack_state_of_charge", "pack_charge_current_limit", "pack_discharge_current_limit",
+            "pack_current", "pack_voltage", "pack_amphours", "pack_depth_of_discharge", "pack_health",
+            "pack_summed_voltage", "total_pack_cycles")]
+    ),
+    "/pm/feedback": (
+        [(name, name, "bool") for name in ("load_on_off", "adc_on_off", "card_limit_tripped")]
+        + [(name, name, "float") for name in (
+            "load_current", "bus_voltage", "temperature", "control_current", "averaged_time",
+            "value_tripped", "startup_current")]
+        + [(name, name, "bool") for name in (
+            "switch_on_off", "watchdog_status", "reboot", "power_mode_on_off", "power_mode_status",
+            "curr_max", "curr_max_warn", "volt_max", "volt_max_warn", "volt_min_warn", "volt_min",
+            "temp_card_max", "temp_card_max_warn")]
+    ),
+    "/leak_detect": [("status", "data", "int")],
+    "/imu/ellipse/sbg_ekf_euler": (
+        [("roll", "angle.x", "float"), ("pitch", "angle.y", "float"), ("yaw", "angle.z", "float")]
+        + [(f"accuracy_{axis}", f"accuracy.{a}", "float") for axis, a in zip(("roll", "pitch", "yaw"), _VECTOR3)]
+        + [("time_stamp", "time_stamp", "int"), ("solution_mode", "status.solution_mode", "int")]
+        + [(name, f"status.{name}", "bool") for name in (
+            "attitude_valid", "heading_valid", "velocity_valid", "position_valid", "vert_ref_used",
+            "mag_ref_used", "gps1_vel_used", "gps1_pos_used", "gps1_course_used", "gps1_hdt_used",
+            "gps2_vel_used", "gps2_pos_used", "gps2_course_used", "gps2_hdt_used", "odo_used")]
+    ),
+    "/imu/ahrs8/data": (
+        [(f"orientation_{a}", f"orientation.{a}", "float") for a in _QUATERNION]
+        + [(f"angular_velocity_{a}", f"angular_velocity.{a}", "float") for a in _VECTOR3]
+    ),
+}
+
+_COLUMN_CASTS = {"float": np.float64, "int": np.int64, "bool": np.bool_}
+
+
+def wrap_degrees(degrees):
+    """Vectorized `if heading_deg < 0: heading_deg += 360.0`."""
+    return np.where(degrees < 0, degrees + 360.0, degrees)
+
+
+def quaternion_to_heading_degrees_many(x, y, z, w):
+    """Vectorized quaternion_to_heading_degrees.
+
+    np.arctan2 can differ from math.atan2 in the last bit, so atan2 itself
+    is mapped over the (vectorized) arguments to keep values identical to
+    the per-message path.
+    """
+    sin_yaw = 2.0 * (w * z + x * y)
+    cos_yaw = 1.0 - 2.0 * (y * y + z * z)
+    yaw_rad = np.fromiter(map(math.atan2, sin_yaw.tolist(), cos_yaw.tolist()), dtype=np.float64,
+                          count=len(sin_yaw))
+    return wrap_degrees(np.degrees(yaw_rad))
+
+
+def process_columns(topic, column):
+    """Columnar counterpart of TOPIC_PROCESSORS[topic][1].
+
+    column(path) returns one message field as an array. Returns
+    ({field_name: array}, [extra_tags dict or None per row] or None).
+    """
+    fields = {
+        name: column(path).astype(_COLUMN_CASTS[cast])
+        for name, path, cast in COLUMNAR_FIELDS[topic]
+    }
+    extra_tags = None
+
+    if topic in ("/moving_base_second/navheading", "/imu/ahrs8/data"):
+        fields["heading_degrees"] = quaternion_to_heading_degrees_many(
+            fields["orientation_x"], fields["orientation_y"], fields["orientation_z"], fields["orientation_w"])
+    elif topic == "/imu/ellipse/sbg_ekf_euler":
+        fields["heading_degrees"] = wrap_degrees(np.degrees(fields["yaw"]))
+    elif topic == "/pm/feedback":
+        extra_tags = [{"card_id": frame_id} if frame_id else None
+                      for frame_id in column("header.frame_id").tolist()]
+
+    return fields, extra_tags
+
+
+def decode_topic_chunk(decoders, layouts, topic, msgtype, payloads, timestamps, topic_errors):
+    """Decode one chunk of a topic's raw payloads into a topic buffer (see new_topic_buffer).
+
+    Payloads are grouped by size and each group decoded through a
+    ColumnLayout built from its first payload (cached in `layouts`);
+    rows that fail the layout checks, or groups without a layout, are
+    decoded one message at a time. Row order is preserved.
+    """
+    lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+    if len(lengths) and (lengths == lengths[0]).all():
+        groups = [(None, payloads)]
+    else:
+        groups = []
+        for length in np.unique(lengths).tolist():
+            rows = np.flatnonzero(lengths == length)
+            groups.append((rows, [payloads[i] for i in rows.tolist()]))
+
+    pieces = []  # (row indices, {field: array}, extra_tags list or None)
+    for rows, group in groups:
+        if rows is None:
+            rows = np.arange(len(group))
+        key = (msgtype, len(group[0]))
+        if key not in layouts:
+            try:
+                layouts[key] = ColumnLayout(decoders.typestore, msgtype, group[0])
+            except UnsupportedLayout:
+                layouts[key] = None
+        layout = layouts[key]
+
+        valid = np.zeros(len(group), dtype=bool)
+        if layout is not None:
+            if _profile is not None:
+                start = time.perf_counter()
+            records, valid = layout.decode(group)
+            if _profile is not None:
+                decoded = time.perf_counter()
+            if valid.any():
+                valid_records = records[valid] if not valid.all() else records
+                fields, extra_tags = process_columns(
+                    topic, lambda path: layout.column(valid_records, path))
+                pieces.append((rows[valid], fields, extra_tags))
+            if _profile is not None:
+                _profile.add("decode", topic, decoded - start, len(group))
+                _profile.add("process", topic, time.perf_counter() - decoded, int(valid.sum()))
+
+        # Anything the layout couldn't take is decoded message by message
+        fallback_rows, fallback_fields, fallback_tags = [], {}, []
+        for i in np.flatnonzero(~valid).tolist():
+            try:
+                fields, extra_tags = decode_message(decoders, topic, group[i], msgtype)
+            except Exception:
+                topic_errors[topic] = topic_errors.get(topic, 0) + 1
+                continue
+            for name, value in fields.items():
+                fallback_fields.setdefault(name, [None] * len(fallback_rows)).append(value)
+            fallback_rows.append(i)
+            for values in fallback_fields.values():
+                if len(values) < len(fallback_rows):
+                    values.append(None)
+            fallback_tags.append(extra_tags or None)
+        if fallback_rows:
+            pieces.append((rows[fallback_rows], fallback_fields, fallback_tags))
+
+    return merge_column_pieces(pieces, timestamps)
+
+
+def merge_column_pieces(pieces, timestamps):
+    """Assemble decoded pieces into one topic buffer, in original row order."""
+    buffer = new_topic_buffer()
+    if not pieces:
+        return buffer
+
+    rows = np.concatenate([piece_rows for piece_rows, _, _ in pieces])
+    order = None
+    if len(pieces) > 1 or not (rows == np.arange(len(rows))).all():
+        order = np.argsort(rows, kind="stable")
+
+    names = []
+    for _, fields, _ in pieces:
+        names.extend(name for name in fields if name not in names)
+
+    for name in names:
+        parts = []
+        for piece_rows, fields, _ in pieces:
+            values = fields.get(name)
+            if values is None:
+                values = [None] * len(piece_rows)
+            parts.append(values)
+        if order is None:
+            column = parts[0].tolist() if isinstance(parts[0], np.ndarray) else list(parts[0])
+        else:
+            merged = np.concatenate([np.asarray(part, dtype=object) if not isinstance(part, np.ndarray)
+                                     else part.astype(object) for part in parts])
+            column = merged[order].tolist()
+        buffer["columns"][name] = column
+
+    extra_tags = []
+    for piece_rows, _, tags in pieces:
+        extra_tags.extend(tags if tags is not None else [None] * len(piece_rows))
+    timestamps = np.asarray(timestamps, dtype=np.int64)[rows]
+    if order is not None:
+        timestamps = timestamps[order]
+        extra_tags = [extra_tags[i] for i in order.tolist()]
+    buffer["timestamps"] = timestamps.tolist()
+    buffer["extra_tags"] = extra_tags
+    return buffer
 
 
 # ====================================================================
 # Worker function for parallel Pass 2
 # ====================================================================
+def bag_messages(bag, windows=None, resume=None):
+    """Messages of every TOPIC_PROCESSORS topic, or only those in sorted [start, stop) windows.
+
+    Windows are re-tagged ranges or a time shard of a large bag. resume is
+    {topic: last written timestamp} for a bag an interrupted run partly
+    wrote; those topics are read from just after it.
+    """
+    for start, stop in windows or [(None, None)]:
+        if not resume:
+            yield from bag.messages(TOPIC_PROCESSORS, start, stop)
+            continue
+        # Topic buffers are per topic, so reading the topics one after another is fine
+        yield from bag.messages([topic for topic in TOPIC_PROCESSORS if topic not in resume], start, stop)
+        for topic, last_ts in resume.items():
+            yield from bag.messages([topic], last_ts + 1 if start is None else max(start, last_ts + 1), stop)
+
+
+def task_ranges(bag, windows=None):
+    """The [start, stop) time ranges a Pass 2 task covers: its windows, else the whole bag."""
+    if windows:
+        return list(windows)
+    return [] if bag.is_empty else [(bag.start_time, bag.end_time)]
+
+
 def process_single_bag(args_tuple):
-    """Process one .db3 file — runs in a worker process."""
-    bag_path, mission, vessel, segments_data, dry_run = args_tuple
-
-    # Each worker needs its own typestore
-    worker_typestore = get_typestore(Stores.ROS2_HUMBLE)
-    worker_types = {}
-    for msgtype, msgdef in custom_msg_defs:
-        worker_types.update(get_types_from_msg(msgdef, msgtype))
-    worker_typestore.register(worker_types)
-
-    # Each worker needs its own mode timeline
-    mode_timeline = ModeTimeline(segments_data)
-
-    # Each worker needs its own InfluxDB connection
-    write_api = None
-    client = None
-    if not dry_run:
-        client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-
-    base_tags = {"mission": mission, "vessel": vessel}
-    file_points = {topic: [] for topic in TOPIC_PROCESSORS}
-    topic_counts = {}
+    """Process one .db3 file — runs in a worker process.
+
+    A topic's buffer is handed to tag_and_write_bag as soon as it holds
+    BATCH_SIZE rows, so memory per worker is bounded by the batch size
+    rather than the bag size.
+    """
+    bag_path, mission, vessel, timeline_path, dry_run, windows, resume, shard, lead_in = args_tuple
+
+    # Compiled decoders for fixed-layout messages, typestore for the rest (built once per worker)
+    worker_decoders = shared_decoders()
+
+    topic_errors = {}
+    ranges = []
+    gate = IngestGate(_decimation or {})
+    file_start = time.time()
+
+    def decoded_chunks():
+        buffers = {}
+        with BagFile(bag_path) as bag:
+            ranges.extend(task_ranges(bag, windows))
+            # Rollups and change-only encoding need every row of the task's range;
+            # already written points are dropped after folding/encoding
+            messages = bag_messages(bag, windows, None if _rollups or _change_only else resume)
+            if _profile is not None:
+                messages = profiled_messages(messages)
+            for topic, timestamp, rawdata in messages:
+                if not gate.keep(topic, timestamp):
+                    continue
+                try:
+                    fields, extra_tags = decode_message(worker_decoders, topic, rawdata, bag.msgtype(topic))
+                except Exception:
+                    topic_errors[topic] = topic_errors.get(topic, 0) + 1
+                    continue
+                append_to_buffer(buffers, topic, timestamp, fields, extra_tags)
+                if len(buffers[topic]["timestamps"]) >= BATCH_SIZE:
+                    yield {topic: buffers.pop(topic)}
+        if buffers:
+            yield buffers
+
+    topic_counts, rollup, encoded = tag_and_write_bag(decoded_chunks(), mission, vessel, timeline_path, dry_run,
+                                                      topic_errors, bag_path, shard, resume, ranges, gate, lead_in)
+
+    file_msg_count = sum(topic_counts.values())
+    file_elapsed = time.time() - file_start
+    return (os.path.basename(bag_path), file_msg_count, topic_counts, topic_errors, file_elapsed, rollup,
+            gate.dropped, encoded)
+
+
+def process_single_bag_columnar(args_tuple):
+    """Columnar variant of process_single_bag (--columnar).
+
+    Raw payloads are collected per topic and decoded COLUMNAR_CHUNK
+    messages at a time with decode_topic_chunk; each chunk is tagged and
+    written before the next is decoded, so memory per worker is bounded
+    by the chunk size rather than the bag size.
+    """
+    bag_path, mission, vessel, timeline_path, dry_run, windows, resume, shard, lead_in = args_tuple
+
+    worker_decoders = shared_decoders()
+
+    layouts = {}
     topic_errors = {}
-    file_msg_count = 0
+    ranges = []
+    gate = IngestGate(_decimation or {})
     file_start = time.time()
 
-    with Reader(bag_path) as reader:
-        for connection, timestamp, rawdata in reader.messages():
-            topic = connection.topic
-            if topic not in TOPIC_PROCESSORS:
+    def decoded_chunks():
+        pending = {}  # topic -> (payloads, timestamps)
+        with BagFile(bag_path) as bag:
+            ranges.extend(task_ranges(bag, windows))
+            messages = bag_messages(bag, windows, None if _rollups or _change_only else resume)
+            if _profile is not None:
+                messages = profiled_messages(messages)
+            for topic, timestamp, rawdata in messages:
+                if not gate.keep(topic, timestamp):
+                    continue
+                payloads, timestamps = pending.setdefault(topic, ([], []))
+                payloads.append(rawdata)
+                timestamps.append(timestamp)
+                if len(payloads) >= COLUMNAR_CHUNK:
+                    del pending[topic]
+                    yield {topic: decode_topic_chunk(worker_decoders, layouts, topic, bag.msgtype(topic),
+                                                     payloads, timestamps, topic_errors)}
+            for topic, (payloads, timestamps) in pending.items():
+                yield {topic: decode_topic_chunk(worker_decoders, layouts, topic, bag.msgtype(topic),
+                                                 payloads, timestamps, topic_errors)}
+
+    topic_counts, rollup, encoded = tag_and_write_bag(decoded_chunks(), mission, vessel, timeline_path, dry_run,
+                                                      topic_errors, bag_path, shard, resume, ranges, gate, lead_in)
+
+    file_msg_count = sum(topic_counts.values())
+    file_elapsed = time.time() - file_start
+    return (os.path.basename(bag_path), file_msg_count, topic_counts, topic_errors, file_elapsed, rollup,
+            gate.dropped, encoded)
+
+
+def tag_and_write_bag(chunks, mission, vessel, timeline_path, dry_run, topic_errors, bag_path=None, shard=None,
+                      resume=None, ranges=(), gate=None, lead_in=None):
+    """Mode-tag one bag's decoded buffers and hand them to the sink.
+
+    chunks is an iterable of {topic: buffer} dicts, produced lazily as the
+    bag is decoded or read back from its spill file. In a worker started
+    with init_write_worker the rows go to Parquet files or, as
+    line-protocol chunks, onto the shared write queue (drained by
+    WriterPool in the parent); otherwise the bag gets its own InfluxSink.
+    Rows are tagged with the timeline file at timeline_path (see
+    write_timeline_file).
+    shard is (index, count) when the bag is split into time shards.
+    Rows up to resume's {topic: last written timestamp} are not written
+    again. gate (an IngestGate) thins the buffers first with the ingest
+    policies that need decoded rows, counting what it removes. With
+    --change-only the rows are encoded after rollups have folded them;
+    lead_in lists the earlier splits the encoder may replay.
+
+    Returns (topic_counts, rollup, encoded). rollup is None without
+    --rollups, else {"points": rollup points written, "edges": [(lo, hi,
+    partial pieces)]} for the task's time ranges (see
+    RollupAccumulator.finish). encoded is ChangeEncoder.counts ({} without
+    --change-only).
+    """
+    mode_timeline = worker_timeline(timeline_path)
+    rollups = RollupAccumulator(_rollups, mode_timeline) if _rollups else None
+    encoder = None
+    if _change_only and _parquet_dir is None:
+        encoder = ChangeEncoder(_change_only, mode_timeline, bag_path, ranges, lead_in, _decimation or {})
+    topic_counts = {}
+    if gate is not None and gate.late:
+        chunks = gate.thinned(chunks)
+
+    def write_chunks(sink):
+        for buffers in chunks:
+            if rollups is not None:
+                for topic, buffer in buffers.items():
+                    if _profile is None:
+                        rollups.add(topic, buffer)
+                    else:
+                        start = time.perf_counter()
+                        rollups.add(topic, buffer)
+                        _profile.add("rollup", topic, time.perf_counter() - start, len(buffer["timestamps"]))
+            if encoder is not None:
+                buffers = encoder.encode(buffers)
+            if resume:
+                drop_written_rows(buffers, resume)
+            counts = write_topic_buffers(buffers, mission, vessel, mode_timeline, sink, topic_errors)
+            for topic, count in counts.items():
+                topic_counts[topic] = topic_counts.get(topic, 0) + count
+        encoded = encoder.counts if encoder is not None else {}
+        if rollups is None:
+            return topic_counts, None, encoded
+        final, edges = rollups.finish(ranges)
+        rows = rollup_rows(final, mission, vessel)
+        points = write_rollup_rows(sink, rows) if sink else sum(len(r) for r in rows.values())
+        return topic_counts, {"points": points, "edges": edges}, encoded
+
+    if dry_run:
+        return write_chunks(None)
+
+    if _parquet_dir is not None:
+        bag_writer = ParquetBagWriter(_parquet_dir, mission, vessel, bag_path, SENSOR_MEASUREMENTS)
+        for buffers in chunks:
+            for topic, count in write_topic_parquet(buffers, mode_timeline, bag_writer).items():
+                topic_counts[topic] = topic_counts.get(topic, 0) + count
+        bag_writer.close()
+        return topic_counts, None, {}
+
+    if _write_queue is not None:
+        sink = QueueSink(_write_queue, bag_path, shard)
+        try:
+            return write_chunks(sink)
+        finally:
+            sink.finish()
+
+    sink = InfluxSink(INFLUX_URL, INFLUX_BUCKET, INFLUX_TOKEN, INFLUX_ORG)
+    try:
+        return write_chunks(sink)
+    finally:
+        sink.close()
+
+
+# ====================================================================
+# Writer stage — decode workers enqueue, pooled writer threads drain
+# ====================================================================
+# Pass 2 workers put their chunks on the write queue through a QueueSink;
+# the parent's WriterPool threads drain it into the sink (both in sinks.py).
+_write_queue = None
+_parquet_dir = None
+
+
+def init_write_worker(write_queue=None, parquet_dir=None, rollups=None, decimation=None, change_only=None,
+                      timeline_path=None):
+    """Pool initializer: route this process's Pass 2 output to the writer stage or to Parquet.
+
+    timeline_path, when given, maps the run's timeline file up front.
+    """
+    global _write_queue, _parquet_dir, _rollups, _decimation, _change_only
+    init_registry_worker()
+    if timeline_path:
+        worker_timeline(timeline_path)
+    _write_queue = write_queue
+    _parquet_dir = parquet_dir
+    _rollups = rollups
+    _decimation = decimation
+    _change_only = change_only
+
+
+# ====================================================================
+# Parquet layout (--sink parquet)
+# ====================================================================
+# ParquetBagWriter (sinks.py) writes each bag's rows into hive partitions
+# per measurement, mode and hour. Columns are `time`, `vessel`, the
+# point's extra tags, then the fields typed as the topic processors
+# produce them.
+
+# Fields computed by the processors rather than copied from the message
+PARQUET_DERIVED_FIELDS = {
+    "/moving_base_second/navheading": [("heading_degrees", "float")],
+    "/imu/ellipse/sbg_ekf_euler": [("heading_degrees", "float")],
+    "/imu/ahrs8/data": [("heading_degrees", "float")],
+}
+PARQUET_TAG_COLUMNS = {
+    "/pm/feedback": ["card_id"],
+}
+
+
+def parquet_layout(topic):
+    """ParquetLayout (measurement, Arrow schema, tag columns) of one topic's files."""
+    arrow_types = {"float": pa.float64(), "int": pa.int64(), "bool": pa.bool_()}
+    tag_columns = PARQUET_TAG_COLUMNS.get(topic, [])
+    columns = [("time", pa.timestamp("ns", tz="UTC")), ("vessel", pa.string())]
+    columns += [(tag, pa.string()) for tag in tag_columns]
+    columns += [(name, arrow_types[cast]) for name, _, cast in COLUMNAR_FIELDS[topic]]
+    columns += [(name, arrow_types[cast]) for name, cast in PARQUET_DERIVED_FIELDS.get(topic, [])]
+    return ParquetLayout(TOPIC_PROCESSORS[topic][0], pa.schema(columns), tag_columns)
+
+
+def write_topic_parquet(buffers, mode_timeline, bag_writer):
+    """Parquet counterpart of write_topic_buffers; returns {topic: rows written}."""
+    topic_counts = {}
+    for topic, buffer in buffers.items():
+        if _profile is not None:
+            start = time.perf_counter()
+        mode_codes = mode_timeline.lookup_many(buffer["timestamps"])
+        if _profile is not None:
+            tagged = time.perf_counter()
+        topic_counts[topic] = bag_writer.write_topic(parquet_layout(topic), buffer, mode_codes,
+                                                     mode_timeline.mode_names)
+        if _profile is not None:
+            _profile.add("tag", topic, tagged - start, topic_counts[topic])
+            _profile.add("write", topic, time.perf_counter() - tagged, topic_counts[topic])
+    return topic_counts
+
+
+# ====================================================================
+# Fused single-read extraction (--fused)
+# ====================================================================
+# Pass 1, Pass 1b and the decode half of Pass 2 share one read per bag.
+# Decoded sensor data cannot be mode-tagged until the global timeline is
+# known, so each worker spills its untagged topic buffers to a temp file
+# and the write half of Pass 2 picks them up afterwards. rosbag2 has no
+# index on topic_id, so a topic-filtered read still pages in the whole
+# file: where the mission doesn't stay in the page cache between passes
+# (network storage, missions larger than RAM) this reads it once, not
+# three times. The spill directory is capped at --fused-spill-gb.
+FUSED_SPILL_GB = 20  # default --fused-spill-gb
+
+
+def spill_usage(spill_dir):
+    """Bytes in the --fused spill directory so far (all workers' files)."""
+    return sum(entry.stat().st_size for entry in os.scandir(spill_dir))
+
+
+def _scan_and_decode_bag(args_tuple):
+    """Worker function: read one bag once for bounds, feedback, battery and sensor data.
+
+    Returns (bag_path, bag_info, events, battery_readings, spill_path).
+    spill_path is None unless decode was requested and the bag's rows fit
+    in spill_budget bytes of spill directory; the bag is then read again
+    in Pass 2. Sensor messages an every/hz ingest policy drops are not
+    decoded.
+
+    The spill file is a stream of pickles: {"ranges"}, then BATCH_SIZE-row
+    {topic: buffer} chunks, then {"topic_errors", "dropped", "decode_elapsed"}
+    (see spilled_chunks).
+    """
+    bag_path, decode, spill_dir, spill_budget, decimation = args_tuple
+
+    worker_typestore = shared_typestore()
+    # Compiled decoders for fixed-layout messages, typestore for the rest
+    worker_decoders = shared_decoders()
+
+    bag_info = None
+    events = []
+    readings = []
+    buffers = {}
+    topic_errors = {}
+    gate = IngestGate(decimation or {})
+    decode_start = time.time()
+    spill_path = os.path.join(spill_dir, os.path.basename(bag_path) + ".pkl") if decode else None
+    spill = None
+
+    def spill_chunk(record):
+        nonlocal decode, spill, spill_path
+        pickle.dump(record, spill, protocol=pickle.HIGHEST_PROTOCOL)
+        if spill_usage(spill_dir) > spill_budget:
+            # Over budget: drop this bag's spill, Pass 2 reads it again
+            spill.close()
+            os.remove(spill_path)
+            decode, spill, spill_path = False, None, None
+            buffers.clear()
+
+    # Sensor topics are only read for bags that still need Pass 2
+    topics = ["/control_mode/feedback", "/battery_state"]
+    if decode:
+        topics += [topic for topic in TOPIC_PROCESSORS if topic not in topics]
+
+    try:
+        with BagFile(bag_path) as bag:
+            if not bag.is_empty:
+                bag_info = {
+                    "start_time": bag.start_time,
+                    "end_time": bag.end_time,
+                    "path": bag_path,
+                }
+            if decode:
+                spill = open(spill_path, "wb")
+                spill_chunk({"ranges": task_ranges(bag)})
+
+            profile = _profile
+            messages = bag.messages(topics)
+            if profile is not None:
+                messages = profiled_messages(messages)
+            for topic, timestamp, rawdata in messages:
+                # /battery_state is still needed for Pass 1b when its sensor points are dropped
+                keep = decode and gate.keep(topic, timestamp)
+                if not keep and topic != "/battery_state" and topic != "/control_mode/feedback":
+                    continue
+                if profile is not None:
+                    start = time.perf_counter()
+                if topic == "/control_mode/feedback":
+                    msg = worker_typestore.deserialize_cdr(rawdata, bag.msgtype(topic))
+                    events.append((timestamp, msg.current_mode_name or "UNKNOWN"))
+                    if profile is not None:
+                        profile.add("decode", topic, time.perf_counter() - start)
+                    continue
+
+                try:
+                    msg = worker_decoders.deserialize(rawdata, bag.msgtype(topic))
+                    if profile is not None:
+                        decoded = time.perf_counter()
+                    if topic == "/battery_state":
+                        pct = float(msg.percentage)
+                        if not (math.isnan(pct) or math.isinf(pct)):
+                            readings.append((timestamp, pct))
+                    if keep:
+                        fields, extra_tags = TOPIC_PROCESSORS[topic][1](msg)
+                    if profile is not None:
+                        profile.add("decode", topic, decoded - start)
+                        if keep:
+                            profile.add("process", topic, time.perf_counter() - decoded)
+                except Exception:
+                    topic_errors[topic] = topic_errors.get(topic, 0) + 1
+                    continue
+                if keep:
+                    append_to_buffer(buffers, topic, timestamp, fields, extra_tags)
+                    if len(buffers[topic]["timestamps"]) >= BATCH_SIZE:
+                        spill_chunk({topic: buffers.pop(topic)})
+            if decode and buffers:
+                spill_chunk(buffers)
+            if decode:
+                spill_chunk({"topic_errors": topic_errors, "dropped": gate.dropped,
+                             "decode_elapsed": time.time() - decode_start})
+    except Exception as e:
+        print(f"    WARNING: Could not read {os.path.basename(bag_path)}: {e}")
+        if spill is not None:
+            spill.close()
+            os.remove(spill_path)
+        return bag_path, None, None, None, None
+    if spill is not None:
+        spill.close()
+
+    return bag_path, bag_info, events, readings, spill_path
+
+
+def fused_scan(all_bag_files, decode_files, spill_dir, spill_budget, num_workers=16, scan_cache=None, profile=None,
+               decimation=None):
+    """Fused Pass 1: one read per bag, decoding sensor data for decode_files.
+
+    Bags that need no decoding and are fully covered by scan_cache are not
+    read at all. Returns (mode_timeline, battery_readings, spill_paths)
+    where battery_readings maps bag path → its readings, in bag order, and
+    spill_paths maps each decoded bag that was read → its spill file for
+    Pass 2, or None if it didn't fit in spill_budget bytes.
+    decimation is the {topic: policy} of --decimate.
+    """
+    print("=== Pass 1 (fused): Building mode timeline + decoding sensor data ===")
+
+    decode_files = set(decode_files)
+    bag_intervals = []
+    mode_events = []
+    battery_readings = {}
+    spill_paths = {}
+
+    worker_args = []
+    for path in all_bag_files:
+        if scan_cache and path not in decode_files:
+            cached_scan = scan_cache.get_scan(path)
+            cached_battery = scan_cache.get_battery(path)
+            if cached_scan is not None and cached_battery is not None:
+                add_scanned_bag(bag_intervals, mode_events, *cached_scan)
+                battery_readings[path] = cached_battery
                 continue
+        worker_args.append((path, path in decode_files, spill_dir, spill_budget, decimation))
 
-            measurement_name, processor_fn = TOPIC_PROCESSORS[topic]
+    print(f"  Reading {len(worker_args)} bag files once ({len(decode_files)} decoded for Pass 2, "
+          f"{len(all_bag_files) - len(worker_args)} from scan cache)...")
 
-            try:
-                msg = worker_typestore.deserialize_cdr(rawdata, connection.msgtype)
-                fields, extra_tags = processor_fn(msg)
+    workers = min(num_workers, len(worker_args))
+    completed = 0
+    if worker_args:
+        with Pool(processes=workers, initializer=init_registry_worker) as pool:
+            scans = profiled_imap(profile, "pass1", pool.imap_unordered, _scan_and_decode_bag, worker_args)
+            for bag_path, bag_info, events, readings, spill_path in scans:
+                completed += 1
+                if completed % 100 == 0 or completed == len(worker_args):
+                    print(f"    Read {completed}/{len(worker_args)} files...")
+
+                if events is None:
+                    continue  # read failed
+                if scan_cache:
+                    scan_cache.put_scan(bag_path, bag_info, events)
+                    scan_cache.put_battery(bag_path, readings)
+                add_scanned_bag(bag_intervals, mode_events, bag_info, events)
+                battery_readings[bag_path] = readings
+                if bag_path in decode_files:
+                    spill_paths[bag_path] = spill_path
+        if scan_cache:
+            scan_cache.commit()
+
+    unspilled = sum(1 for spill_path in spill_paths.values() if spill_path is None)
+    if unspilled:
+        print(f"  {unspilled} decoded bags did not fit in the {spill_budget / 1e9:g} GB spill budget; "
+              "Pass 2 reads them again")
+
+    mode_events.sort(key=lambda x: x[0])
+    bag_intervals.sort(key=lambda x: x["start_time"])
 
-                mode = mode_timeline.lookup(timestamp)
-                tags = {**base_tags, "mode": mode}
+    mode_timeline = assemble_mode_timeline(bag_intervals, mode_events)
+    battery_readings = {path: battery_readings[path] for path in all_bag_files if path in battery_readings}
+    return mode_timeline, battery_readings, spill_paths
 
-                point = create_point(measurement_name, timestamp, fields, tags, extra_tags)
-                file_points[topic].append(point)
-                topic_counts[topic] = topic_counts.get(topic, 0) + 1
-                file_msg_count += 1
 
-                if write_api and len(file_points[topic]) >= BATCH_SIZE:
-                    write_api.write(bucket=INFLUX_BUCKET, record=file_points[topic], write_precision=WritePrecision.NS)
-                    file_points[topic] = []
+def spilled_chunks(spill_path, topic_errors, dropped, elapsed):
+    """Yield the {topic: buffer} chunks of a spill file, deleting it when done.
 
-            except Exception as e:
-                topic_errors[topic] = topic_errors.get(topic, 0) + 1
+    The trailing record's counts are added to topic_errors and dropped, and
+    its decode time to elapsed (a one-item list).
+    """
+    with open(spill_path, "rb") as f:
+        pickle.load(f)  # {"ranges"}, read by write_spilled_bag
+        while True:
+            record = pickle.load(f)
+            if "decode_elapsed" in record:
+                break
+            yield record
+    os.remove(spill_path)
+    for topic, count in record["topic_errors"].items():
+        topic_errors[topic] = topic_errors.get(topic, 0) + count
+    for topic, count in record["dropped"].items():
+        dropped[topic] = dropped.get(topic, 0) + count
+    elapsed[0] += record["decode_elapsed"]
+
+
+def write_spilled_bag(args_tuple):
+    """Worker function for fused Pass 2: mode-tag and write one spilled bag, chunk by chunk."""
+    spill_path, bag_path, mission, vessel, timeline_path, dry_run, resume, lead_in = args_tuple
+    write_start = time.time()
+
+    with open(spill_path, "rb") as f:
+        ranges = pickle.load(f)["ranges"]
+
+    # The fused read decoded the whole bag; resume skips what an interrupted run already wrote
+    topic_errors = {}
+    gate = IngestGate(_decimation or {})
+    elapsed = [0.0]
+    # gate.dropped also gets the scan's timestamp-only decisions, from the spill's trailer
+    chunks = spilled_chunks(spill_path, topic_errors, gate.dropped, elapsed)
+    topic_counts, rollup, encoded = tag_and_write_bag(chunks, mission, vessel, timeline_path, dry_run,
+                                                      topic_errors, bag_path, resume=resume, ranges=ranges,
+                                                      gate=gate, lead_in=lead_in)
 
-    # Write remaining points
-    for topic, points in file_points.items():
-        if points and write_api:
-            write_api.write(bucket=INFLUX_BUCKET, record=points, write_precision=WritePrecision.NS)
+    file_msg_count = sum(topic_counts.values())
+    file_elapsed = elapsed[0] + (time.time() - write_start)
+    return (os.path.basename(bag_path), file_msg_count, topic_counts, topic_errors, file_elapsed, rollup, gate.dropped,
+            encoded)
 
-    if client:
-        client.close()
 
-    file_elapsed = time.time() - file_start
-    return (os.path.basename(bag_path), file_msg_count, topic_counts, topic_errors, file_elapsed)
+# ====================================================================
+# Pass 2 scheduling: largest bags first, big bags split into time shards
+# ====================================================================
+# Bags handed out in name order leave the largest ones (the first split
+# of a session is ~1.5x the others) and any oversized bag running alone
+# at the end. Tasks are ordered by cost, largest first, and a bag above
+# the shard size is split into equal time ranges that different workers
+# read through the timestamp index. Shards write under their bag's name
+# and WriterPool / ShardedResults put each bag back together, so the
+# tracker and the progress output still see whole bags.
+SHARD_MIN_MB = 32  # automatic shard size never goes below this
+
+
+def bag_costs(bag_files):
+    """{bag_path: cost}: message count from metadata.yaml when every bag has one, else file size."""
+    counts = {}
+    for path in bag_files:
+        metadata = load_bag_metadata(os.path.dirname(path))
+        count = metadata["files"].get(os.path.basename(path)) if metadata else None
+        if count is None:
+            return {path: os.path.getsize(path) for path in bag_files}
+        counts[path] = count
+    return counts
+
+
+def schedule_bags(bag_files, bag_intervals, num_workers, shard_mb=None):
+    """Order Pass 2 bags largest first, splitting big ones into time shards.
+
+    Returns [(bag_path, windows, shard)]: windows is None for a whole bag
+    or [(start, stop)] for one shard, shard None or (index, count).
+    shard_mb None sizes shards automatically (total size / 4 tasks per
+    worker, at least SHARD_MIN_MB); 0 never shards.
+    """
+    sizes = {path: os.path.getsize(path) for path in bag_files}
+    if num_workers < 2 or shard_mb == 0:
+        shard_bytes = None
+    elif shard_mb is None:
+        shard_bytes = max(sum(sizes.values()) / (4 * num_workers), SHARD_MIN_MB * 1024 * 1024)
+    else:
+        shard_bytes = shard_mb * 1024 * 1024
+
+    intervals = {bag["path"]: bag for bag in bag_intervals}
+    costs = bag_costs(bag_files)
+    tasks = []
+    for path in bag_files:
+        bag = intervals.get(path)
+        shards = 1
+        if shard_bytes and bag:
+            shards = min(math.ceil(sizes[path] / shard_bytes), num_workers, bag["end_time"] - bag["start_time"])
+        if shards <= 1:
+            tasks.append((costs[path], path, None, None))
+            continue
+        start, end = bag["start_time"], bag["end_time"]
+        bounds = [start + (end - start) * i // shards for i in range(shards + 1)]
+        for i in range(shards):
+            tasks.append((costs[path] / shards, path, [(bounds[i], bounds[i + 1])], (i, shards)))
+    tasks.sort(key=lambda task: -task[0])  # stable: equal costs keep name order
+    return [(path, windows, shard) for _, path, windows, shard in tasks]
+
+
+class ShardedResults:
+    """Merges the worker results of a sharded bag into one result per bag."""
+
+    def __init__(self, tasks):
+        self.remaining = {os.path.basename(path): shard[1] for path, _, shard in tasks if shard}
+        self.partial = {}
+
+    def add(self, result):
+        """Return the bag's merged worker result once all its shards are in, else None."""
+        filename, msg_count, counts, errors, file_elapsed, rollup, dropped, encoded = result
+        if filename not in self.remaining:
+            return result
+        merged = self.partial.setdefault(filename, [filename, 0, {}, {}, 0.0, None, {}, {}])
+        merged[1] += msg_count
+        for topic, cnt in counts.items():
+            merged[2][topic] = merged[2].get(topic, 0) + cnt
+        for topic, cnt in errors.items():
+            merged[3][topic] = merged[3].get(topic, 0) + cnt
+        merged[4] += file_elapsed  # worker time, summed over shards
+        if rollup is not None:
+            merged[5] = merged[5] or {"points": 0, "edges": []}
+            merged[5]["points"] += rollup["points"]
+            merged[5]["edges"] += rollup["edges"]
+        for topic, cnt in dropped.items():
+            merged[6][topic] = merged[6].get(topic, 0) + cnt
+        add_encoded_counts(merged[7], encoded)
+        self.remaining[filename] -= 1
+        if self.remaining[filename]:
+            return None  # more shards of this bag to come
+        del self.remaining[filename]
+        return tuple(self.partial.pop(filename))
+
+
+def describe_schedule(tasks):
+    """One line for the Pass 2 header: task count and how many bags were sharded."""
+    sharded = {path for path, _, shard in tasks if shard}
+    line = f"  Schedule: {len(tasks)} tasks, largest first"
+    if sharded:
+        line += (f"; {len(sharded)} bags split into "
+                 f"{sum(1 for path, _, shard in tasks if shard)} time shards")
+    return line
 
 
 # ====================================================================
-# Tracking: skip already-processed files
+# Tracking: skip already-processed files, resume partly written ones
 # ====================================================================
+# tracking/<mission>.db is an SQLite journal in WAL mode. Each bag has a
+# row with its fingerprint and status — "writing" while Pass 2 runs,
+# "failed" if a chunk could not be written, "done" once all were — plus
+# one row per topic with the points written so far and the timestamp of
+# the last one. The writer stage updates the topic rows as chunks are
+# acknowledged (one small transaction each, instead of rewriting a JSON
+# file per bag), so a bag an interrupted run left half written is read
+# again only after each topic's last written timestamp. A legacy
+# tracking/<mission>.json is imported the first time the mission is opened.
 TRACKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracking")
 
+TRACKER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS bags (
+    name TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bags_fingerprint ON bags (fingerprint, status);
+CREATE TABLE IF NOT EXISTS topics (
+    name TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    last_ts INTEGER,
+    PRIMARY KEY (name, topic)
+);
+"""
+
 
 def file_fingerprint(path):
     """Generate a fingerprint from filename + size + mtime (fast, no hashing)."""
@@ -879,161 +3199,1052 @@ def file_fingerprint(path):
     return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
 
 
-def load_tracker(mission):
-    os.makedirs(TRACKER_DIR, exist_ok=True)
-    tracker_path = os.path.join(TRACKER_DIR, f"{mission}.json")
-    if os.path.exists(tracker_path):
-        with open(tracker_path, "r") as f:
-            return json.load(f)
-    return {"mission": mission, "processed_files": {}}
+class Tracker:
+    """Per-mission extraction journal (see above).
 
+    Shared by the main thread and the writer threads, so every statement
+    runs under one lock. The database is only created by the first write,
+    so dry runs and untracked sinks leave nothing behind.
+    """
 
-def save_tracker(mission, tracker):
-    tracker_path = os.path.join(TRACKER_DIR, f"{mission}.json")
-    with open(tracker_path, "w") as f:
-        json.dump(tracker, f, indent=2)
+    def __init__(self, mission):
+        self.mission = mission
+        self.path = os.path.join(TRACKER_DIR, f"{mission}.db")
+        self.lock = threading.Lock()
+        self.writing = set()  # names of bags whose acknowledged chunks are journaled
+        self.conn = None
+        json_path = os.path.join(TRACKER_DIR, f"{mission}.json")
+        if os.path.exists(self.path) or os.path.exists(json_path):
+            self._connect()
+        if os.path.exists(json_path) and self._meta("migrated_from") is None:
+            self._migrate(json_path)
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(TRACKER_DIR, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(TRACKER_SCHEMA)
+        return self.conn
+
+    def _migrate(self, json_path):
+        with open(json_path, "r") as f:
+            legacy = json.load(f)
+        processed = legacy.get("processed_files", {})
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO bags (name, fingerprint, status, updated) VALUES (?, ?, 'done', ?)",
+                [(name, fingerprint, now) for name, fingerprint in processed.items()])
+            if "segments" in legacy:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('segments', ?)",
+                                  (json.dumps(legacy["segments"]),))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from', ?)",
+                              (os.path.basename(json_path),))
+        print(f"  Tracker: imported {len(processed)} bags from {os.path.basename(json_path)} "
+              f"into {os.path.basename(self.path)} (the JSON file is no longer updated)")
+
+    def _meta(self, key):
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def is_done(self, bag_path):
+        """True if this exact file (same name, size and mtime) was completely written."""
+        if self.conn is None:
+            return False
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM bags WHERE fingerprint = ? AND status = 'done'",
+                                    (file_fingerprint(bag_path),)).fetchone()
+        return row is not None
+
+    def written_names(self):
+        """Names of bags with points in the sink: done, or partly written."""
+        if self.conn is None:
+            return set()
+        with self.lock:
+            return {name for name, in self.conn.execute("SELECT name FROM bags")}
+
+    def resume_point(self, bag_path):
+        """{topic: last written timestamp} for a partly written, unchanged bag, or None."""
+        if self.conn is None:
+            return None
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT topic, last_ts FROM topics JOIN bags USING (name)"
+                " WHERE name = ? AND fingerprint = ? AND status != 'done' AND last_ts IS NOT NULL",
+                (os.path.basename(bag_path), file_fingerprint(bag_path))).fetchall()
+        return dict(rows) or None
+
+    def begin(self, bag_paths, resume=()):
+        """Start journaling Pass 2 chunks for bag_paths; bags not in resume start from zero."""
+        conn = self._connect()
+        now = time.time()
+        with self.lock, conn:
+            for bag_path in bag_paths:
+                name = os.path.basename(bag_path)
+                if bag_path not in resume:
+                    conn.execute("DELETE FROM topics WHERE name = ?", (name,))
+                conn.execute(
+                    "INSERT INTO bags (name, fingerprint, status, updated) VALUES (?, ?, 'writing', ?)"
+                    " ON CONFLICT (name) DO UPDATE SET fingerprint = excluded.fingerprint,"
+                    " status = 'writing', updated = excluded.updated",
+                    (name, file_fingerprint(bag_path), now))
+                self.writing.add(name)
+
+    def record_progress(self, bag_path, acks):
+        """Journal written chunks [(topic, points, last_ts)] of a bag, in chunk order."""
+        name = os.path.basename(bag_path)
+        with self.lock:
+            if name not in self.writing:
+                return  # re-tags of finished bags aren't journaled
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO topics (name, topic, points, last_ts) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (name, topic) DO UPDATE SET points = points + excluded.points,"
+                    " last_ts = excluded.last_ts",
+                    [(name, topic, points, last_ts) for topic, points, last_ts in acks])
+                self.conn.execute("UPDATE bags SET updated = ? WHERE name = ?", (time.time(), name))
+
+    def mark_done(self, bag_path, topic_counts=None):
+        """Record a completely written bag; topic_counts replaces the journaled counts (Parquet)."""
+        name = os.path.basename(bag_path)
+        conn = self._connect()
+        with self.lock, conn:
+            conn.execute(
+                "INSERT INTO bags (name, fingerprint, status, updated) VALUES (?, ?, 'done', ?)"
+                " ON CONFLICT (name) DO UPDATE SET fingerprint = excluded.fingerprint,"
+                " status = 'done', updated = excluded.updated",
+                (name, file_fingerprint(bag_path), time.time()))
+            if topic_counts is not None:
+                conn.execute("DELETE FROM topics WHERE name = ?", (name,))
+                conn.executemany("INSERT INTO topics (name, topic, points) VALUES (?, ?, ?)",
+                                 [(name, topic, count) for topic, count in topic_counts.items() if count])
+            self.writing.discard(name)
+
+    def mark_failed(self, bag_path):
+        """A chunk failed: keep what was journaled as the bag's resume point."""
+        name = os.path.basename(bag_path)
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE bags SET status = 'failed', updated = ? WHERE name = ?", (time.time(), name))
+            self.writing.discard(name)
+
+    def segments(self):
+        """Segments recorded by the last run that wrote them, or None (no record yet)."""
+        value = self._meta("segments")
+        if value is None:
+            return None
+        return [{"start_time": start, "end_time": end, "mode": mode, "segment_number": number}
+                for start, end, mode, number in json.loads(value)]
+
+    def store_segments(self, segments):
+        value = json.dumps([[seg["start_time"], seg["end_time"], seg["mode"], seg["segment_number"]]
+                            for seg in segments])
+        conn = self._connect()
+        with self.lock, conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('segments', ?)", (value,))
 
 
 def filter_new_files(bag_files, tracker):
-    processed = tracker.get("processed_files", {})
     new_files = []
     skipped = 0
     for path in bag_files:
-        fp = file_fingerprint(path)
-        if os.path.basename(path) in processed and processed[os.path.basename(path)] == fp:
+        if tracker.is_done(path):
             skipped += 1
         else:
             new_files.append(path)
     return new_files, skipped
 
 
+def resume_points(tracker, bag_files, ranges, bag_intervals):
+    """{bag_path: {topic: last written timestamp}} for the partly written bags in bag_files.
+
+    A bag whose time range changed mode since it was partly written starts
+    over: apply_timeline_change deleted its points with the stale tag.
+    """
+    resume = {}
+    for bag_path in bag_files:
+        point = tracker.resume_point(bag_path)
+        if point:
+            resume[bag_path] = point
+    stale = retag_windows(ranges, bag_intervals, set(resume))
+    return {bag_path: point for bag_path, point in resume.items() if bag_path not in stale}
+
+
+# ====================================================================
+# Timeline updates: rewrite changed segments, re-tag written points
+# ====================================================================
+# The tracker records the segments a run wrote. The next run (or the next
+# --watch batch) writes only the mission_segments points that changed,
+# deletes the ones whose (start, mode) key disappeared, and for every
+# range whose mode changed deletes the sensor points already written with
+# the old mode tag and re-extracts that range of those bags with the new
+# one. Sinks that can't delete (line-protocol file) keep the old points;
+# Parquet rewrites the summary tables and re-exports re-tagged bags whole.
+SENSOR_MEASUREMENTS = sorted({measurement for measurement, *_ in TOPIC_PROCESSORS.values()})
+
+
+def segment_rows(segments, mission, vessel):
+    """mission_segments rows [(timestamp_ns, tags, fields)] for the sink."""
+    return [
+        (seg["start_time"], {"mission": mission, "vessel": vessel, "mode": seg["mode"]},
+         {"segment_number": seg["segment_number"], "duration_s": seg["duration_s"],
+          "start_time_ns": seg["start_time"], "end_time_ns": seg["end_time"]})
+        for seg in segments
+    ]
+
+
+def retag_windows(ranges, bag_intervals, written_paths):
+    """{bag_path: [(start, stop, old_mode)]}: pieces of written bags whose mode changed.
+
+    bag_intervals are sorted by start time and don't overlap (rosbag2
+    splits), so each range only looks at the bags from the one containing
+    its start.
+    """
+    starts = [bag["start_time"] for bag in bag_intervals]
+    windows = {}
+    for start, end, old_mode, _ in ranges:
+        for bag in bag_intervals[max(bisect.bisect_right(starts, start) - 1, 0):]:
+            if bag["start_time"] >= end:
+                break
+            if bag["end_time"] > start and bag["path"] in written_paths:
+                windows.setdefault(bag["path"], []).append(
+                    (max(start, bag["start_time"]), min(end, bag["end_time"]), old_mode))
+    return windows
+
+
+def apply_timeline_change(change, segments, sink, mission, vessel, bag_intervals, written_paths, timeline_path,
+                          skip_paths=(), parquet=False, dry_run=False, rollups=None, change_only=None):
+    """Write changed mission_segments, delete stale points; return Pass 2 re-tag tasks.
+
+    change is (written, removed, ranges) from diff_timelines or
+    IncrementalTimeline.update. Bags in skip_paths are being extracted
+    anyway, so their stale points are deleted but not re-extracted.
+    With rollups (the _rollups config) the re-tag covers every whole
+    largest window touching a changed range, whose rollup points are
+    deleted first and rebuilt from all of its rows. --change-only
+    measurements are widened the same way to whole keyframe intervals
+    (the mode boundaries in them decide which values are written).
+    """
+    written, removed, ranges = change
+    tags = {"mission": mission, "vessel": vessel}
+    windows = retag_windows(ranges, bag_intervals, written_paths)
+    extract = windows
+    grid = []
+    widths = ([rollups["windows"][-1][1]] if rollups else []) + ([change_only["keyframe"]] if change_only else [])
+    grid_measurements = rollup_measurements(rollups) if rollups else []
+    if change_only:
+        grid_measurements += sorted({TOPIC_PROCESSORS[topic][0] for topic in change_only["topics"]})
+    if widths and ranges:
+        width = math.lcm(*widths)
+        for start, end in sorted((start // width * width, -(-end // width) * width) for start, end, _, _ in ranges):
+            if grid and start <= grid[-1][1]:
+                grid[-1][1] = max(grid[-1][1], end)
+            else:
+                grid.append([start, end])
+        extract = retag_windows([(start, end, None, None) for start, end in grid], bag_intervals, written_paths)
+
+    rows = segment_rows(written if sink is None or sink.incremental else segments, mission, vessel)
+    if rows:
+        print(f"  Writing {len(rows)} points to 'mission_segments'"
+              + (f" ({len(segments) - len(written)} unchanged)" if len(rows) < len(segments) else "") + "...")
+    if sink and rows:
+        sink.write_rows("mission_segments", rows)
+    if sink and sink.incremental:
+        for seg in removed:
+            sink.delete("mission_segments", seg["start_time"], seg["start_time"] + 1, {**tags, "mode": seg["mode"]})
+        for pieces in windows.values():
+            for start, stop, old_mode in pieces:
+                for measurement in SENSOR_MEASUREMENTS:
+                    sink.delete(measurement, start, stop, {**tags, "mode": old_mode})
+        for start, stop in grid:
+            for measurement in grid_measurements:
+                sink.delete(measurement, start, stop, tags)
+    if removed or extract:
+        retagged_s = sum(stop - start for pieces in extract.values() for start, stop, _ in pieces) / 1e9
+        print(f"  Timeline changed under written data: {len(removed)} segments removed, "
+              f"{len(extract)} bags to re-tag ({retagged_s:.0f}s of data)")
+
+    # Parquet replaces a bag's files on export, so those bags are re-exported whole
+    return [
+        (bag_path, mission, vessel, timeline_path, dry_run,
+         None if parquet else [(start, stop) for start, stop, _ in pieces], None, None,
+         lead_in_bags(bag_path, bag_intervals, change_only))
+        for bag_path, pieces in extract.items() if bag_path not in skip_paths
+    ]
+
+
+# ====================================================================
+# Scan cache: per-bag Pass 1 / Pass 1b results, keyed by file fingerprint
+# ====================================================================
+SCAN_CACHE_PATH = os.path.join(TRACKER_DIR, "scan-cache.db")
+
+
+class ScanCache:
+    """On-disk cache of bag bounds, feedback events and battery readings.
+
+    Keyed by file_fingerprint, so a bag that is rewritten (new size/mtime)
+    is rescanned. Scan results and battery readings are stored separately
+    because Pass 1 and Pass 1b fill them at different times. Battery
+    readings are packed as int64 timestamps + float64 percentages.
+    """
+
+    def __init__(self, path=SCAN_CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bag_scans ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " scanned INTEGER NOT NULL DEFAULT 0,"
+            " start_time INTEGER,"
+            " end_time INTEGER,"
+            " events TEXT,"
+            " battery_ts BLOB,"
+            " battery_pct BLOB)"
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def _ensure_row(self, fingerprint):
+        self.conn.execute("INSERT OR IGNORE INTO bag_scans (fingerprint) VALUES (?)", (fingerprint,))
+
+    def get_scan(self, bag_path):
+        """Return cached (bag_info, events) for a bag, or None on a cache miss."""
+        row = self.conn.execute(
+            "SELECT start_time, end_time, events FROM bag_scans WHERE fingerprint = ? AND scanned = 1",
+            (file_fingerprint(bag_path),),
+        ).fetchone()
+        if row is None:
+            return None
+
+        start, end, events_json = row
+        if start is None:
+            return None, []  # empty bag
+        bag_info = {"start_time": start, "end_time": end, "path": bag_path}
+        return bag_info, [tuple(event) for event in json.loads(events_json)]
+
+    def put_scan(self, bag_path, bag_info, events):
+        fingerprint = file_fingerprint(bag_path)
+        self._ensure_row(fingerprint)
+        self.conn.execute(
+            "UPDATE bag_scans SET scanned = 1, start_time = ?, end_time = ?, events = ? WHERE fingerprint = ?",
+            (
+                bag_info["start_time"] if bag_info else None,
+                bag_info["end_time"] if bag_info else None,
+                json.dumps(events),
+                fingerprint,
+            ),
+        )
+
+    def get_battery(self, bag_path):
+        """Return cached [(timestamp, percentage), ...] for a bag, or None on a cache miss."""
+        row = self.conn.execute(
+            "SELECT battery_ts, battery_pct FROM bag_scans WHERE fingerprint = ?",
+            (file_fingerprint(bag_path),),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        timestamps = array("q")
+        timestamps.frombytes(row[0])
+        percentages = array("d")
+        percentages.frombytes(row[1])
+        return list(zip(timestamps, percentages))
+
+    def put_battery(self, bag_path, readings):
+        fingerprint = file_fingerprint(bag_path)
+        self._ensure_row(fingerprint)
+        self.conn.execute(
+            "UPDATE bag_scans SET battery_ts = ?, battery_pct = ? WHERE fingerprint = ?",
+            (
+                array("q", [ts for ts, _ in readings]).tobytes(),
+                array("d", [pct for _, pct in readings]).tobytes(),
+                fingerprint,
+            ),
+        )
+
+
+# ====================================================================
+# Watch mode (--watch): extract splits as the recorder closes them
+# ====================================================================
+# rosbag2 records <name>_<N>.db3 and starts <name>_<N+1>.db3 when it
+# splits. BagFile opens bags as immutable, so a split is only read once it
+# is finished: no -journal/-wal file next to it, and then either a
+# close-after-write / moved-in event for it (inotify), a later split or
+# metadata.yaml in the directory plus --watch-settle seconds since its last
+# write, or --watch-idle seconds without a write (recorder killed). Without
+# inotify (not Linux, or a network filesystem: --no-inotify) the directory
+# is polled every --watch-poll seconds with the same rules.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len — then len bytes of name
+
+
+class Inotify:
+    """Minimal inotify(7) binding (ctypes): events for one directory as (mask, name)."""
+
+    def __init__(self, path, mask):
+        if not sys.platform.startswith("linux"):
+            raise OSError(f"inotify is not available on {sys.platform}")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+
+    def read(self, timeout):
+        """Wait up to timeout seconds; return the pending events (possibly none)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        while ready:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                events.append((mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+                offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class BagWatcher:
+    """Reports the .db3 splits in a directory that the recorder has finished."""
+
+    def __init__(self, bag_dir, settle_s=2.0, idle_s=300.0, poll_s=1.0, use_inotify=True):
+        self.bag_dir = bag_dir
+        self.settle_s = settle_s
+        self.idle_s = idle_s
+        self.poll_s = poll_s
+        self.closed = set()    # file names with a close/move event not yet reported
+        self.reported = {}     # path -> fingerprint when last reported
+        self.inotify = None
+        self.method = f"polling every {poll_s:g}s"
+        if use_inotify:
+            try:
+                self.inotify = Inotify(bag_dir, IN_CLOSE_WRITE | IN_MOVED_TO)
+                self.method = "inotify"
+            except (OSError, AttributeError) as e:
+                self.method += f" (inotify unavailable: {e})"
+
+    def poll(self):
+        """Wait up to poll_s for events, then return newly finished splits in recording order.
+
+        A split is reported again if its size or mtime change after it was
+        reported (so its fingerprint no longer matches the tracker).
+        """
+        if self.inotify:
+            for mask, name in self.inotify.read(self.poll_s):
+                if name.endswith(".db3") and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.closed.add(name)
+        else:
+            time.sleep(self.poll_s)
+
+        paths = sorted(glob.glob(os.path.join(self.bag_dir, "*.db3")), key=natural_sort_key)
+        metadata_path = os.path.join(self.bag_dir, "metadata.yaml")
+        stopped = os.path.getmtime(metadata_path) if os.path.exists(metadata_path) else None
+        now = time.time()
+
+        finished = []
+        for i, path in enumerate(paths):
+            name = os.path.basename(path)
+            if os.path.exists(path + "-journal") or os.path.exists(path + "-wal"):
+                continue  # write transaction still open
+            try:
+                fingerprint = file_fingerprint(path)
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if self.reported.get(path) == fingerprint:
+                continue
+
+            idle = now - mtime
+            superseded = i < len(paths) - 1 or (stopped is not None and stopped >= mtime)
+            if name in self.closed or idle >= self.idle_s or (superseded and idle >= self.settle_s):
+                self.closed.discard(name)
+                self.reported[path] = fingerprint
+                finished.append(path)
+        return finished
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+
+
+def init_watch_worker(write_queue=None, parquet_dir=None, rollups=None, decimation=None, change_only=None):
+    """Pool initializer for --watch: Ctrl-C is handled by the parent, which drains before exiting."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    init_write_worker(write_queue, parquet_dir, rollups, decimation, change_only)
+
+
+def _scan_bag_for_watch(bag_path):
+    """Worker function: Pass 1 and Pass 1b scans of one new split, as one task."""
+    return _scan_single_bag(bag_path), _scan_battery(bag_path)
+
+
+def watch_bag_dir(args, sink, tracker, parquet, rollups=None, decimation=None, change_only=None):
+    """--watch: extract splits from args.bag_dir as they are finished, until Ctrl-C / SIGTERM.
+
+    One warm worker pool and writer stage serve the whole session. Each
+    batch of finished splits is scanned once; its bounds, feedback events
+    and battery readings are added to the in-memory scan results (other
+    bags are never rescanned), the timeline is reassembled from those, and
+    mission_segments / battery_rates are rewritten when it changed. Then
+    the batch's untracked splits go through Pass 2.
+    """
+    watcher = BagWatcher(args.bag_dir, settle_s=args.watch_settle, idle_s=args.watch_idle,
+                         poll_s=args.watch_poll, use_inotify=not args.no_inotify)
+    print(f"=== Watching {args.bag_dir} ({watcher.method}) ===")
+    print(f"  A split is extracted once closed, or {args.watch_settle:g}s after the next split starts "
+          f"({args.watch_idle:g}s if nothing follows). Ctrl-C to stop.")
+
+    scan_cache = None if args.no_scan_cache else ScanCache()
+    writer = None
+    if sink and sink.line_protocol:
+        writer = WriterPool(sink, num_writers=max(args.writers, 1), queue_size=max(args.write_queue, 1),
+                            tracker=tracker if sink.tracked else None)
+    worker_fn = process_single_bag_columnar if args.columnar else process_single_bag
+    pool = Pool(processes=max(args.workers, 1), initializer=init_watch_worker,
+                initargs=(writer.queue if writer else None, args.parquet_dir if parquet else None, rollups,
+                          decimation, change_only))
+    rollup_edges = RollupEdges(tracker.path if sink.tracked else None) if rollups and sink else None
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print("\n  Stopping after the current batch (Ctrl-C again to abort)...", flush=True)
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    timeline = IncrementalTimeline()
+    previous_segments = tracker.segments() if sink and sink.tracked else None
+    battery = {}        # bag_path -> [(timestamp_ns, percentage)]
+    written_paths = {os.path.join(args.bag_dir, name) for name in tracker.written_names()}
+    topic_counts = {topic: 0 for topic in TOPIC_PROCESSORS}
+    topic_errors = {topic: 0 for topic in TOPIC_PROCESSORS}
+    topic_dropped = {topic: 0 for topic in TOPIC_PROCESSORS}
+    topic_encoded = {}
+    finished_at = {}    # bag_path -> mtime when the split was reported finished
+    latencies = []      # seconds from a split's last write to all of its points written
+    failed_bags = []
+    extracted = 0
+    rollup_points = write_dirty_rollup_edges(rollup_edges, sink, args.mission, args.vessel) if rollup_edges else 0
+    timeline_path = None  # this batch's timeline file (write_timeline_file), replaced every batch
+
+    def mark_written(bag_path, counts=None):
+        if sink and sink.tracked and os.path.exists(bag_path):
+            tracker.mark_done(bag_path, counts)
+        if bag_path in finished_at:  # not for re-tags
+            latency = time.time() - finished_at.pop(bag_path)
+            latencies.append(latency)
+            print(f"  ✓ {os.path.basename(bag_path)} written, {latency:.1f}s after its last write", flush=True)
+
+    def fail_bag(bag_path):
+        if os.path.basename(bag_path) not in failed_bags:
+            failed_bags.append(os.path.basename(bag_path))
+        finished_at.pop(bag_path, None)
+        if sink.tracked:
+            tracker.mark_failed(bag_path)
+
+    recorded = set()  # splits whose worker result, with its rollup edges, is in
+    written = []      # (bag_path, failed_chunks) of splits the writers finished, waiting for that result
+
+    def record_written_bags():
+        if writer is None:
+            return
+        written.extend(writer.pop_finished())
+        waiting = []
+        for bag_path, failed_chunks in written:
+            if os.path.basename(bag_path) not in recorded:
+                waiting.append((bag_path, failed_chunks))
+            elif failed_chunks or os.path.basename(bag_path) in failed_bags:
+                fail_bag(bag_path)
+            else:
+                mark_written(bag_path)
+        written[:] = waiting
+
+    try:
+        while not stop.is_set():
+            record_written_bags()
+            new_bags = watcher.poll()
+            if not new_bags:
+                continue
+            for bag_path in new_bags:
+                finished_at[bag_path] = os.path.getmtime(bag_path)
+            print(f"\n[{time.strftime('%H:%M:%S')}] {len(new_bags)} finished: "
+                  + ", ".join(os.path.basename(p) for p in new_bags[:5])
+                  + (f", ... (+{len(new_bags) - 5})" if len(new_bags) > 5 else ""))
+
+            # Pass 1 / 1b for the new splits only (scan cache first). A split that
+            # changed after it was reported is re-extracted, but its first scan
+            # stays in the timeline.
+            new_scans = {}
+            to_scan = []
+            for bag_path in new_bags:
+                if bag_path in battery:
+                    continue
+                cached_scan = scan_cache.get_scan(bag_path) if scan_cache else None
+                cached_battery = scan_cache.get_battery(bag_path) if scan_cache else None
+                if cached_scan is None or cached_battery is None:
+                    to_scan.append(bag_path)
+                else:
+                    new_scans[bag_path], battery[bag_path] = cached_scan, cached_battery
+            for bag_path, ((bag_info, events), (readings, complete)) in zip(
+                    to_scan, pool.map(_scan_bag_for_watch, to_scan)):
+                new_scans[bag_path] = (bag_info, events)
+                battery[bag_path] = readings
+                if scan_cache:
+                    if events is not None:
+                        scan_cache.put_scan(bag_path, bag_info, events)
+                    if complete:
+                        scan_cache.put_battery(bag_path, readings)
+            if scan_cache:
+                scan_cache.commit()
+
+            # Timeline: fold in the new splits, rewrite only what changed
+            bag_intervals, mode_events = [], []
+            for bag_path in sorted(new_scans, key=natural_sort_key):
+                add_scanned_bag(bag_intervals, mode_events, *new_scans[bag_path])
+            first_batch = not timeline.bag_intervals
+            change = timeline.update(bag_intervals, mode_events)
+            segments = timeline.segments
+            if first_batch and previous_segments is not None:
+                # Compare with what the last run wrote
+                change = diff_timelines(previous_segments, segments)
+            elif first_batch and written_paths:
+                change = (segments, [], [])  # written before segments were recorded: rewrite, no re-tag
+            print(f"  Timeline: {len(timeline.bag_intervals)} bags, {len(timeline.sessions)} sessions "
+                  f"→ {len(segments)} segments ({len(change[0])} changed)")
+
+            if args.force or not (sink and sink.tracked):
+                to_extract = new_bags
+            else:
+                to_extract, _ = filter_new_files(new_bags, tracker)
+            for bag_path in new_bags:
+                if bag_path not in to_extract:
+                    finished_at.pop(bag_path, None)
+            # The previous batch's tasks have all returned: its timeline file can go
+            if timeline_path:
+                os.remove(timeline_path)
+            mode_timeline = ModeTimeline(segments)
+            timeline_path = write_timeline_file(mode_timeline)
+            retag_args = apply_timeline_change(change, segments, sink, args.mission, args.vessel,
+                                               timeline.bag_intervals, written_paths, timeline_path,
+                                               skip_paths=set(to_extract), parquet=parquet, dry_run=args.dry_run,
+                                               rollups=rollups, change_only=change_only)
+            if sink and sink.tracked and not retag_args:
+                tracker.store_segments(segments)
+            summarize_battery_rates(battery, mode_timeline, args.mission, args.vessel, sink,
+                                    replace=bool(change[0] or change[1]))
+
+            # Pass 2 for splits not already in the tracker (resuming partly written ones),
+            # then re-tags of earlier ones
+            resume = {}
+            if writer and sink.tracked:
+                if not args.force:
+                    resume = resume_points(tracker, to_extract, change[2], timeline.bag_intervals)
+                tracker.begin(to_extract, resume)
+            if resume:
+                print(f"  Resuming {len(resume)} partly written splits after their last written points")
+            # A lone large split is sharded across the idle workers
+            tasks = schedule_bags(to_extract, timeline.bag_intervals, args.workers,
+                                  shard_mb=0 if parquet else args.shard_mb)
+            worker_args = [(bag_path, args.mission, args.vessel, timeline_path, args.dry_run, windows,
+                            resume.get(bag_path), shard,
+                            lead_in_bags(bag_path, timeline.bag_intervals, change_only))
+                           for bag_path, windows, shard in tasks]
+            shard_results = ShardedResults(tasks)
+            retag_names = {os.path.basename(task[0]) for task in retag_args}
+            failed_before = len(failed_bags)
+            for result in pool.imap_unordered(worker_fn, worker_args + retag_args):
+                result = shard_results.add(result)
+                if result is None:
+                    continue  # more shards of this split to come
+                filename, msg_count, counts, errors, file_elapsed, rollup, dropped, encoded = result
+                if rollup is not None:
+                    rollup_points += rollup["points"]
+                    if rollup_edges is not None:
+                        try:
+                            rollup_points += write_rollup_edges(rollup_edges, filename, rollup, sink,
+                                                                args.mission, args.vessel)
+                        except Exception as e:
+                            print(f"  WARNING: rollup edges of {filename} not written: {e}", flush=True)
+                            fail_bag(os.path.join(args.bag_dir, filename))
+                recorded.add(filename)
+                if filename in retag_names:
+                    print(f"  {filename}: {msg_count} points re-tagged ({file_elapsed:.1f}s)", flush=True)
+                else:
+                    extracted += 1
+                    for topic, cnt in counts.items():
+                        topic_counts[topic] = topic_counts.get(topic, 0) + cnt
+                    for topic, cnt in errors.items():
+                        topic_errors[topic] = topic_errors.get(topic, 0) + cnt
+                    for topic, cnt in dropped.items():
+                        topic_dropped[topic] = topic_dropped.get(topic, 0) + cnt
+                    add_encoded_counts(topic_encoded, encoded)
+                    print(f"  {filename}: {msg_count} points ({file_elapsed:.1f}s)", flush=True)
+                if writer is None and filename not in retag_names and filename not in failed_bags:
+                    # Dry run / Parquet: done once the worker returns
+                    mark_written(os.path.join(args.bag_dir, filename), counts)
+                record_written_bags()
+            written_paths.update(to_extract)
+            if sink and sink.tracked and len(failed_bags) == failed_before:
+                tracker.store_segments(segments)
+    finally:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        watcher.close()
+        pool.close()
+        pool.join()
+        if writer:
+            print("  Waiting for writers to drain...")
+            writer.close()
+            record_written_bags()
+        if scan_cache:
+            scan_cache.close()
+        if rollup_edges is not None:
+            rollup_edges.close()
+        if timeline_path:
+            os.remove(timeline_path)
+
+    print(f"\n=== Watch summary ===")
+    print(f"  Bag files extracted: {extracted}")
+    if latencies:
+        latencies.sort()
+        print(f"  Freshness (last write → points written): median {latencies[len(latencies) // 2]:.1f}s, "
+              f"max {latencies[-1]:.1f}s")
+    if sink:
+        for line in sink.report():
+            print(f"  {line}")
+    if failed_bags:
+        print(f"  Write failures in {len(failed_bags)} files (not marked processed): {', '.join(failed_bags)}")
+    print(f"  Total points: {sum(topic_counts.values())}")
+    for topic in TOPIC_PROCESSORS:
+        if topic_counts.get(topic, 0) > 0:
+            err_str = f" ({topic_errors[topic]} errors)" if topic_errors.get(topic, 0) > 0 else ""
+            err_str += dropped_note(topic, topic_dropped, decimation)
+            print(f"    {TOPIC_PROCESSORS[topic][0]}: {topic_counts[topic]}{err_str}")
+    if decimation:
+        print(decimation_summary(topic_counts, topic_dropped, decimation))
+    if change_only:
+        print(change_only_summary(topic_encoded))
+    if rollups:
+        print(f"  Rollup points: {rollup_points} ({', '.join(label for label, _ in rollups['windows'])} windows)")
+
+
 # ====================================================================
 # Main
 # ====================================================================
 def _scan_battery(bag_path):
     """Worker function: scan one bag for battery_state readings."""
-    worker_typestore = get_typestore(Stores.ROS2_HUMBLE)
-    worker_types = {}
-    for msgtype, msgdef in custom_msg_defs:
-        worker_types.update(get_types_from_msg(msgdef, msgtype))
-    worker_typestore.register(worker_types)
+    # Compiled decoders for fixed-layout messages, typestore for the rest
+    worker_decoders = shared_decoders()
 
     readings = []
+    if not may_contain(bag_path, ["/battery_state"]):
+        return readings, True
     try:
-        with Reader(bag_path) as reader:
-            if "/battery_state" not in reader.topics:
-                return readings
-            for connection, timestamp, rawdata in reader.messages():
-                if connection.topic == "/battery_state":
-                    msg = worker_typestore.deserialize_cdr(rawdata, connection.msgtype)
-                    pct = float(msg.percentage)
-                    if not (math.isnan(pct) or math.isinf(pct)):
-                        readings.append((timestamp, pct))
+        with BagFile(bag_path) as bag:
+            messages = bag.messages(["/battery_state"])
+            if _profile is not None:
+                messages = profiled_messages(messages)
+            for topic, timestamp, rawdata in messages:
+                if _profile is None:
+                    msg = worker_decoders.deserialize(rawdata, bag.msgtype(topic))
+                else:
+                    start = time.perf_counter()
+                    msg = worker_decoders.deserialize(rawdata, bag.msgtype(topic))
+                    _profile.add("decode", topic, time.perf_counter() - start)
+                pct = float(msg.percentage)
+                if not (math.isnan(pct) or math.isinf(pct)):
+                    readings.append((timestamp, pct))
     except Exception as e:
         print(f"    WARNING: Could not read battery from {os.path.basename(bag_path)}: {e}")
-    return readings
+        return readings, False
+    return readings, True
+
+
+BATTERY_RATES_SPAN = 3600 * 1_000_000_000  # battery_rates timestamps: 1s, 2s, ... after the epoch, one per mode
+
+# Pass 1b is a map-reduce. The map step turns one bag's readings into a
+# "rate partial": per-mode [drop, nanoseconds, pairs] for the consecutive
+# pairs inside the bag, plus its first and last reading. The reduce step
+# stitches the pairs across bag boundaries in time order, so the parent
+# holds O(bags) partials instead of every reading. Drops are summed as
+# exact integers (units of 2**-1074, the smallest float64 step) and
+# durations as integer nanoseconds, so partials add up to the same totals
+# in any order and for any worker split. The engine only sees
+# (timestamp, value) readings: pack_status.pack_state_of_charge or
+# battery_telemetry.charge_percentage rates go through the same functions.
+EXACT_SHIFT = 1074
+
+
+def exact_units(value):
+    """A float as an exact integer count of 2**-1074 steps."""
+    numerator, denominator = value.as_integer_ratio()
+    return numerator << (EXACT_SHIFT + 1 - denominator.bit_length())
+
+
+def real_mode_mask(mode_timeline):
+    """Bool array over mode codes: False for UNKNOWN / NO_BAG_RECORD / NO_DATA (pairs there never count)."""
+    return np.array([mode not in ("UNKNOWN", "NO_BAG_RECORD", "NO_DATA") for mode in mode_timeline.mode_names])
+
+
+def battery_rate_partial(readings, mode_timeline):
+    """Map step: per-mode sums for the consecutive pairs of one bag's (timestamp, value) readings.
+
+    Returns {"first", "last", "count", "modes": {mode: [drop_units, ns, pairs]}},
+    or None without readings. A pair counts when both readings fall in the
+    same real mode and time moves forward between them.
+    """
+    if not readings:
+        return None
+    readings = sorted(readings, key=lambda r: r[0])
+    modes = {}
+    if len(readings) > 1:
+        timestamps = np.array([ts for ts, _ in readings], dtype=np.int64)
+        mode_codes = mode_timeline.lookup_many(timestamps)
+        counted = ((mode_codes[:-1] == mode_codes[1:]) & real_mode_mask(mode_timeline)[mode_codes[:-1]]
+                   & (np.diff(timestamps) > 0))
+        for i in np.flatnonzero(counted).tolist():
+            prev_ts, prev_value = readings[i]
+            curr_ts, curr_value = readings[i + 1]
+            stats = modes.setdefault(mode_timeline.mode_names[mode_codes[i]], [0, 0, 0])
+            stats[0] += exact_units(prev_value) - exact_units(curr_value)  # positive = discharging
+            stats[1] += curr_ts - prev_ts
+            stats[2] += 1
+    return {"first": readings[0], "last": readings[-1], "count": len(readings), "modes": modes}
+
+
+def merge_rate_stats(into, modes):
+    """Add one partial's per-mode [drop_units, ns, pairs] into a running total."""
+    for mode, (drop, ns, pairs) in modes.items():
+        stats = into.setdefault(mode, [0, 0, 0])
+        stats[0] += drop
+        stats[1] += ns
+        stats[2] += pairs
+
+
+def reduce_battery_rates(partials, mode_timeline, load_readings):
+    """Reduce step: per-mode totals from [(bag_path, partial)] in bag order.
+
+    Bags are walked by first reading. Between consecutive bags only the pair
+    (last reading, next first reading) is missing, and it is evaluated here.
+    Bags whose readings overlap in time (rare: the sorted readings would
+    interleave) are re-read with load_readings(bag_path) and summed as one
+    run, so the result is the same as sorting every reading of the mission.
+    """
+    order = sorted(range(len(partials)), key=lambda i: (partials[i][1]["first"][0], i))
+    runs = []  # [[partial indices], last timestamp]
+    for i in order:
+        partial = partials[i][1]
+        if runs and partial["first"][0] <= runs[-1][1]:
+            runs[-1][0].append(i)
+            runs[-1][1] = max(runs[-1][1], partial["last"][0])
+        else:
+            runs.append([[i], partial["last"][0]])
+
+    mode_stats = {}
+    previous = None
+    for indices, _ in runs:
+        if len(indices) == 1:
+            partial = partials[indices[0]][1]
+        else:
+            readings = [reading for i in sorted(indices) for reading in load_readings(partials[i][0])]
+            partial = battery_rate_partial(readings, mode_timeline)
+        if previous is not None:
+            merge_rate_stats(mode_stats, battery_rate_partial([previous["last"], partial["first"]],
+                                                              mode_timeline)["modes"])
+        merge_rate_stats(mode_stats, partial["modes"])
+        previous = partial
+    return mode_stats
 
 
-def compute_battery_rates(all_bag_files, mode_timeline, mission, vessel, write_api):
+def init_battery_worker(timeline_path):
+    """Pool initializer for Pass 1b: map the timeline file once per worker."""
+    init_registry_worker()
+    worker_timeline(timeline_path)
+
+
+def _battery_partial(args_tuple):
+    """Worker function: scan one bag and reduce its battery readings to a rate partial.
+
+    Returns (partial, readings, complete); readings only when the parent
+    caches them (keep_readings), else None.
+    """
+    bag_path, timeline_path, keep_readings = args_tuple
+    readings, complete = _scan_battery(bag_path)
+    return (battery_rate_partial(readings, worker_timeline(timeline_path)), readings if keep_readings else None,
+            complete)
+
+
+def compute_battery_rates(all_bag_files, mode_timeline, timeline_path, mission, vessel, sink, scan_cache=None,
+                          profile=None, replace=False):
     """Pre-compute battery consumption rates per mode — matches mission_time_analysis exactly.
 
     Algorithm: iterate ALL battery readings chronologically, check mode at BOTH timestamps
     in each consecutive pair. Only count pairs where both readings are in the same mode.
     This avoids cross-mode-boundary contamination that Flux grouping can't handle.
+    Workers reduce each bag to a rate partial; bags from the scan cache are
+    reduced here, one at a time. Workers tag with the timeline file at
+    timeline_path (mode_timeline written by write_timeline_file).
 
-    Writes to InfluxDB as 'battery_rates' measurement (one point per mode).
+    Writes a 'battery_rates' measurement (one point per mode) to the sink.
     """
     print("=== Pass 1b: Computing battery rates per mode ===")
 
-    # Collect all battery_state readings from bags
-    battery_readings = []  # [(timestamp_ns, percentage), ...]
+    partials = {}  # bag_path -> rate partial
+    to_scan = []
+    for bag_path in all_bag_files:
+        cached = scan_cache.get_battery(bag_path) if scan_cache else None
+        if cached is None:
+            to_scan.append(bag_path)
+        else:
+            partials[bag_path] = battery_rate_partial(cached, mode_timeline)
+    if scan_cache:
+        print(f"    {len(all_bag_files) - len(to_scan)} files from scan cache, {len(to_scan)} to scan")
 
-    # Parallel scan for battery readings
-    workers = min(16, len(all_bag_files))
+    # Parallel scan + map step; each worker maps the timeline file once
+    workers = min(16, len(to_scan))
     completed = 0
-    with Pool(processes=workers) as pool:
-        for readings in pool.imap_unordered(_scan_battery, all_bag_files):
-            completed += 1
-            if completed % 100 == 0 or completed == len(all_bag_files):
-                print(f"    Scanned {completed}/{len(all_bag_files)} files for battery...")
-            battery_readings.extend(readings)
+    if to_scan:
+        with Pool(processes=workers, initializer=init_battery_worker, initargs=(timeline_path,)) as pool:
+            scans = profiled_imap(profile, "pass1b", pool.imap, _battery_partial,
+                                  [(bag_path, timeline_path, scan_cache is not None) for bag_path in to_scan])
+            for bag_path, (partial, readings, complete) in zip(to_scan, scans):
+                completed += 1
+                if completed % 100 == 0 or completed == len(to_scan):
+                    print(f"    Scanned {completed}/{len(to_scan)} files for battery...")
+                if scan_cache and complete:
+                    scan_cache.put_battery(bag_path, readings)
+                partials[bag_path] = partial
+        if scan_cache:
+            scan_cache.commit()
 
-    battery_readings.sort(key=lambda r: r[0])
-    print(f"  Found {len(battery_readings)} battery readings")
+    def load_readings(bag_path):
+        cached = scan_cache.get_battery(bag_path) if scan_cache else None
+        return cached if cached is not None else _scan_battery(bag_path)[0]
 
-    if len(battery_readings) < 2:
-        print("  Not enough battery readings to compute rates")
-        return
+    partials = [(bag_path, partials[bag_path]) for bag_path in all_bag_files if partials.get(bag_path)]
+    return write_battery_rates(partials, mode_timeline, mission, vessel, sink, load_readings, replace=replace)
 
-    # Iterate chronologically, check mode at BOTH timestamps (same as mission_time_analysis)
-    mode_stats = {}  # {mode: {"total_drop": float, "total_seconds": float, "pairs": int}}
 
-    for i in range(len(battery_readings) - 1):
-        prev_ts, prev_pct = battery_readings[i]
-        curr_ts, curr_pct = battery_readings[i + 1]
+def summarize_battery_rates(readings_by_bag, mode_timeline, mission, vessel, sink, replace=False):
+    """Compute and write battery_rates from already-collected {bag_path: [(timestamp, percentage)]}.
 
-        dt_s = (curr_ts - prev_ts) / 1e9
-        if dt_s <= 0:
-            continue
+    Used by --fused and --watch, which hold the readings anyway; each bag
+    goes through the same map and reduce steps as compute_battery_rates.
+    Returns the number of battery_rates points (one per mode).
+    """
+    partials = [(bag_path, battery_rate_partial(readings, mode_timeline))
+                for bag_path, readings in readings_by_bag.items() if readings]
+    return write_battery_rates(partials, mode_timeline, mission, vessel, sink, readings_by_bag.__getitem__,
+                               replace=replace)
 
-        # Find mode at BOTH timestamps
-        mode_start = mode_timeline.lookup(prev_ts)
-        mode_end = mode_timeline.lookup(curr_ts)
 
-        # Only count if BOTH are in the same real mode
-        if mode_start is None or mode_end is None:
-            continue
-        if mode_start != mode_end:
-            continue
-        if mode_start in ("UNKNOWN", "NO_BAG_RECORD", "NO_DATA"):
-            continue
+def write_battery_rates(partials, mode_timeline, mission, vessel, sink, load_readings, replace=False):
+    """Reduce [(bag_path, partial)] and write one battery_rates point per mode.
 
-        mode = mode_start
-        delta_pct = prev_pct - curr_pct  # positive = discharging
+    Points are spaced 1s apart in mode order, so a new mode shifts the
+    later ones: replace=True (the timeline changed since they were
+    written) deletes the mission's previous points first.
+    Returns the number of battery_rates points (one per mode).
+    """
+    reading_count = sum(partial["count"] for _, partial in partials)
+    print(f"  Found {reading_count} battery readings")
 
-        if mode not in mode_stats:
-            mode_stats[mode] = {"total_drop": 0.0, "total_seconds": 0.0, "pairs": 0}
+    if reading_count < 2:
+        print("  Not enough battery readings to compute rates")
+        return 0
 
-        mode_stats[mode]["total_drop"] += delta_pct
-        mode_stats[mode]["total_seconds"] += dt_s
-        mode_stats[mode]["pairs"] += 1
+    mode_stats = reduce_battery_rates(partials, mode_timeline, load_readings)
 
-    # Compute rates and write to InfluxDB
-    rate_points = []
+    # Compute rates and write them to the sink
+    rate_rows = []
     # Use a fixed timestamp for summary data (epoch + 1 day per mode to avoid collisions)
     base_ts = 1_000_000_000  # 1 second after epoch in ns
 
     print("  Battery rates per mode:")
-    for mode, stats in sorted(mode_stats.items()):
-        hours = stats["total_seconds"] / 3600.0
-        rate = (stats["total_drop"] * 100.0) / hours if hours > 0 else 0.0
-        total_drop_pct = stats["total_drop"] * 100.0
+    for mode, (drop_units, ns, pairs) in sorted(mode_stats.items()):
+        total_drop = drop_units / (1 << EXACT_SHIFT)  # int / int: correctly rounded
+        total_seconds = ns / 1_000_000_000
+        hours = total_seconds / 3600.0
+        rate = (total_drop * 100.0) / hours if hours > 0 else 0.0
+        total_drop_pct = total_drop * 100.0
 
-        print(f"    {mode}: drop={total_drop_pct:.2f}%, hours={hours:.2f}h, rate={rate:.2f}%/hr, pairs={stats['pairs']}")
+        print(f"    {mode}: drop={total_drop_pct:.2f}%, hours={hours:.2f}h, rate={rate:.2f}%/hr, pairs={pairs}")
 
         tags = {"mission": mission, "vessel": vessel, "mode": mode}
         fields = {
             "rate_pct_per_hour": rate,
             "total_drop_pct": total_drop_pct,
             "total_hours": hours,
-            "total_seconds": stats["total_seconds"],
-            "pairs": stats["pairs"],
+            "total_seconds": total_seconds,
+            "pairs": pairs,
         }
-        point = create_point("battery_rates", base_ts, fields, tags, {})
-        rate_points.append(point)
+        rate_rows.append((base_ts, tags, fields))
         base_ts += 1_000_000_000  # offset each mode by 1s
 
-    if write_api and rate_points:
-        write_api.write(bucket=INFLUX_BUCKET, record=rate_points, write_precision=WritePrecision.NS)
-        print(f"  Wrote {len(rate_points)} battery_rates points to InfluxDB")
-    elif not write_api:
-        print(f"  Dry run — would write {len(rate_points)} battery_rates points")
-
-
-def natural_sort_key(path):
-    """Sort file paths naturally: _0, _1, _2, ... _10, _11 (not _0, _1, _10, _11, _2)"""
-    name = os.path.basename(path)
-    return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', name)]
+    if sink and replace and sink.incremental:
+        sink.delete("battery_rates", 0, BATTERY_RATES_SPAN, {"mission": mission, "vessel": vessel})
+    if sink and rate_rows:
+        sink.write_rows("battery_rates", rate_rows)
+        print(f"  Wrote {len(rate_rows)} battery_rates points to {sink.label}")
+    elif not sink:
+        print(f"  Dry run — would write {len(rate_rows)} battery_rates points")
+    return len(rate_rows)
+
+
+def write_run_stats(path, stats):
+    """Write per-pass timings and counts as JSON (--stats-json), for benchmark runners."""
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+        f.write("\n")
+
+
+def report_profile(run_profile, run_stats, args, sink, timestamp):
+    """Print the stage profile and write it as JSON and/or extraction_metrics points, as requested."""
+    print("\n=== Stage profile ===")
+    print_profile(run_profile)
+    if args.profile_json:
+        with open(args.profile_json, "w") as f:
+            json.dump({"mission": args.mission, "passes": run_stats["passes"],
+                       "stages": profile_records(run_profile)}, f, indent=2)
+            f.write("\n")
+        print(f"\n  Profile: {args.profile_json}")
+    if args.profile_metrics and sink:
+        rows = profile_metric_rows(run_profile, run_stats, args.mission, args.vessel, timestamp)
+        sink.write_rows("extraction_metrics", rows)
+        print(f"  Wrote {len(rows)} extraction_metrics points to {sink.label}")
 
 
 def main():
@@ -1046,22 +4257,117 @@ def main():
     parser.add_argument("--dry-run", action="store_true", help="Process without writing to InfluxDB")
     parser.add_argument("--force", action="store_true", help="Re-process all files, ignore tracking")
     parser.add_argument("--workers", type=int, default=1, help="Number of parallel workers for Pass 2 (default: 1)")
+    parser.add_argument("--shard-mb", type=float, default=None,
+                        help="Split bags larger than this into time shards for different workers "
+                             f"(default: total size / (4 × workers), at least {SHARD_MIN_MB} MB; 0 = never)")
+    parser.add_argument("--writers", type=int, default=4,
+                        help="Concurrent sink writes (InfluxDB requests) in Pass 2, independent of --workers (default: 4)")
+    parser.add_argument("--write-queue", type=int, default=32,
+                        help="Max serialized chunks waiting for a writer before decoders block (default: 32)")
+    parser.add_argument("--fused", action="store_true",
+                        help="Read each bag once: timeline, battery and sensor decode in a single pass, "
+                             "spilling the decoded rows to a temp directory (for bags on network storage, "
+                             "or missions larger than the page cache)")
+    parser.add_argument("--fused-spill-gb", type=float, default=FUSED_SPILL_GB,
+                        help="Max size of the --fused spill directory; bags that don't fit are read again "
+                             f"in Pass 2 (default: {FUSED_SPILL_GB:g})")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Decode each topic in NumPy chunks instead of message by message (Pass 2)")
+    parser.add_argument("--no-scan-cache", action="store_true",
+                        help="Rescan every bag in Pass 1/1b instead of reusing tracking/scan-cache.db")
+    parser.add_argument("--sink", choices=list(SINKS), default="influx",
+                        help="Where to write points: influx (default), parquet, lp-file (line-protocol file), "
+                             "null (discard) or count (discard, count lines per measurement)")
+    parser.add_argument("--influx-url", default=INFLUX_URL,
+                        help=f"InfluxDB URL for --sink influx (default: {INFLUX_URL})")
+    parser.add_argument("--parquet-dir", default=PARQUET_DIR,
+                        help="Output directory for --sink parquet (default: ./parquet)")
+    parser.add_argument("--lp-file", help="Output file for --sink lp-file (default: <mission>.lp)")
+    parser.add_argument("--rollups", nargs="?", const=ROLLUP_DEFAULT, metavar="WINDOWS",
+                        help="Also write per-mode mean/min/max/last rollups as <measurement>_<window> "
+                             f"(default windows: {ROLLUP_DEFAULT}; each must divide the largest)")
+    parser.add_argument("--rollup-measurements", default=ROLLUP_MEASUREMENTS_DEFAULT, metavar="MEASUREMENTS",
+                        help="Comma-separated measurements --rollups covers, or 'all' "
+                             f"(default: {ROLLUP_MEASUREMENTS_DEFAULT})")
+    parser.add_argument("--decimate", action="append", default=[], metavar="MEASUREMENT=POLICY",
+                        help="Ingest policy for one measurement (repeatable): every:N, hz:N, "
+                             "minmax:WINDOW:FIELD or all, e.g. power_mgmt=hz:5")
+    parser.add_argument("--decimate-config", metavar="FILE",
+                        help='JSON file of measurement → policy, e.g. {"power_mgmt": "hz:5"} '
+                             "(--decimate overrides it)")
+    parser.add_argument("--change-only", nargs="?", const=CHANGE_ONLY_DEFAULT, metavar="MEASUREMENTS",
+                        help="Write boolean/integer/string fields of these measurements only when they change "
+                             f"(default: {CHANGE_ONLY_DEFAULT})")
+    parser.add_argument("--deadband", action="append", default=[], metavar="MEASUREMENT.FIELD=BAND",
+                        help="Write an analog field only when it moves more than BAND (absolute, or e.g. 2%%) "
+                             "from its last written value (repeatable)")
+    parser.add_argument("--keyframe", default=KEYFRAME_DEFAULT, metavar="DURATION",
+                        help=f"With --change-only/--deadband, write every field again after each grid point "
+                             f"of this interval and at mode changes (default: {KEYFRAME_DEFAULT})")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running: extract each split in --bag-dir as soon as the recorder finishes it")
+    parser.add_argument("--watch-settle", type=float, default=2.0,
+                        help="Seconds since a split's last write before it counts as finished once the next "
+                             "split or metadata.yaml exists (default: 2)")
+    parser.add_argument("--watch-idle", type=float, default=300.0,
+                        help="Seconds without a write after which the newest split counts as finished "
+                             "(default: 300)")
+    parser.add_argument("--watch-poll", type=float, default=1.0,
+                        help="Seconds between directory checks in --watch mode (default: 1)")
+    parser.add_argument("--no-inotify", action="store_true",
+                        help="Poll instead of using inotify in --watch mode (e.g. bags on a network share)")
+    parser.add_argument("--stats-json", help="Write per-pass timings, file/point counts and MB read to this file")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time each stage (read, decode, process, tag, serialize, write) per topic and print a table")
+    parser.add_argument("--profile-json", help="Also write the stage profile to this JSON file (implies --profile)")
+    parser.add_argument("--profile-metrics", action="store_true",
+                        help="Also write the stage profile to the sink as 'extraction_metrics' (implies --profile)")
     args = parser.parse_args()
 
+    parquet = args.sink == "parquet" and not args.dry_run
+    if parquet and pa is None:
+        print("ERROR: --sink parquet needs pyarrow (pip3 install pyarrow)")
+        sys.exit(1)
+    sink_class = SINKS[args.sink]
+    if args.watch and not args.bag_dir:
+        print("ERROR: --watch needs --bag-dir")
+        sys.exit(1)
+    rollups = None
+    if args.rollups:
+        try:
+            rollups = rollup_policies(args.rollups, args.rollup_measurements)
+        except ValueError as e:
+            print(f"ERROR: --rollups: {e}")
+            sys.exit(1)
+    if parquet:
+        rollups = None  # rollups spare InfluxDB queries; Parquet readers aggregate as they scan
+    try:
+        decimation = ingest_policies(args.decimate_config, args.decimate)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: --decimate: {e}")
+        sys.exit(1)
+    try:
+        change_only = change_only_policies(args.change_only, args.deadband, args.keyframe)
+    except ValueError as e:
+        print(f"ERROR: --change-only: {e}")
+        sys.exit(1)
+    if parquet:
+        change_only = None  # Parquet stores every row; its columns compress runs of equal values anyway
+
     start_time = time.time()
 
     # Resolve bag file list
     if args.bag_dir:
         all_bag_files = sorted(glob.glob(os.path.join(args.bag_dir, "*.db3")), key=natural_sort_key)
-        if not all_bag_files:
+        if not all_bag_files and not args.watch:
             print(f"ERROR: No .db3 files found in {args.bag_dir}")
             sys.exit(1)
     else:
         all_bag_files = [args.bag]
 
-    # Filter already-processed files
-    tracker = load_tracker(args.mission)
-    if args.force:
+    # Filter already-processed files (Parquet exports are tracked separately from InfluxDB)
+    tracker = Tracker(f"{args.mission}.parquet" if parquet else args.mission)
+    if args.force or not sink_class.tracked:
         bag_files = all_bag_files
         skipped = 0
     else:
@@ -1088,147 +4394,373 @@ def main():
         print(f"    File: {bag_files[0]}")
     print(f"  Vessel:   {args.vessel}")
     print(f"  Dry run:  {args.dry_run}")
-    print(f"  InfluxDB: {INFLUX_URL} → {INFLUX_BUCKET}")
-    print()
-
-    # Connect to InfluxDB
-    write_api = None
-    client = None
-    if not args.dry_run:
-        client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-        print("  Connected to InfluxDB")
+    print(f"  Fused:    {args.fused}" + (" (ignored with --watch)" if args.fused and args.watch
+                                             else f" (spill up to {args.fused_spill_gb:g} GB)" if args.fused else ""))
+    print(f"  Columnar: {args.columnar}"
+          + (" (bags over the spill budget only)" if args.columnar and args.fused and not args.watch else ""))
+    if args.watch:
+        print(f"  Watch:    yes ({args.workers} warm workers)")
+    if args.rollups:
+        print("  Rollups:  " + (describe_rollups(rollups) if rollups else "ignored with --sink parquet"))
+    if decimation:
+        print("  Decimate: " + ", ".join(f"{TOPIC_PROCESSORS[topic][0]} {describe_policy(policy)}"
+                                         for topic, policy in decimation.items()))
+    if args.change_only or args.deadband:
+        print("  Changes:  " + (describe_change_only(change_only) if change_only else "ignored with --sink parquet"))
+    if parquet:
+        print(f"  Parquet:  {os.path.abspath(args.parquet_dir)}")
+    elif args.sink == "influx":
+        print(f"  InfluxDB: {args.influx_url} → {INFLUX_BUCKET}")
     else:
-        print("  Dry run — skipping InfluxDB connection")
+        print(f"  Sink:     {sink_class.label}")
     print()
 
-    base_tags = {"mission": args.mission, "vessel": args.vessel}
-
-    # --- Pass 1: Build mode timeline across ALL bag files (including already processed) ---
-    mode_timeline = build_mode_timeline(all_bag_files)
-    segments = mode_timeline.segments
-
-    # Write mission segments
-    if segments:
-        segment_points = []
-        for seg in segments:
-            tags = {**base_tags, "mode": seg["mode"]}
-            fields = {
-                "segment_number": seg["segment_number"],
-                "duration_s": seg["duration_s"],
-                "start_time_ns": seg["start_time"],
-                "end_time_ns": seg["end_time"],
-            }
-            segment_points.append(
-                create_point("mission_segments", seg["start_time"], fields, tags, {})
-            )
-
-        print(f"\n  Writing {len(segment_points)} points to 'mission_segments'...")
-        if write_api:
-            write_api.write(bucket=INFLUX_BUCKET, record=segment_points, write_precision=WritePrecision.NS)
-        print("  Done.")
+    # Open the sink
+    sink = None
+    if args.dry_run:
+        print("  Dry run — skipping InfluxDB connection")
+    elif parquet:
+        sink = ParquetSink(args.parquet_dir, args.mission, args.vessel)
+        print("  Writing to Parquet — no InfluxDB connection")
+    elif args.sink == "influx":
+        sink = InfluxSink(args.influx_url, INFLUX_BUCKET, INFLUX_TOKEN, INFLUX_ORG)
+        print(f"  Writing to InfluxDB at {args.influx_url}")
+    elif args.sink == "lp-file":
+        sink = LineProtocolFileSink(args.lp_file or f"{args.mission}.lp")
+        print(f"  Writing line protocol to {sink.path} — no InfluxDB connection")
+    else:
+        sink = sink_class()
+        print(f"  Sink: {sink.label} — no InfluxDB connection, tracker not updated")
     print()
 
-    # --- Pass 1b: Pre-compute battery rates per mode ---
-    # (matches mission_time_analysis: iterate chronologically, check mode at BOTH timestamps)
-    compute_battery_rates(all_bag_files, mode_timeline, args.mission, args.vessel, write_api)
-
-    # --- Pass 2: Process all sensor topics ---
-    if not bag_files:
-        print("=== Pass 2: Skipped (all files already processed) ===")
-        elapsed = time.time() - start_time
-        print(f"\n=== Summary ===")
-        print(f"  Pass 1 + 1b only (no new sensor data to process)")
-        print(f"  Elapsed: {elapsed:.1f}s ({elapsed/60:.1f} min)")
-        if client:
-            client.close()
+    if args.watch:
+        if args.profile or args.profile_json or args.profile_metrics or args.stats_json:
+            print("  (--profile / --stats-json are ignored with --watch)\n")
+        watch_bag_dir(args, sink, tracker, parquet, rollups, decimation, change_only)
+        if sink:
+            sink.close()
+        tracker.close()
         print("Done!")
         return
 
-    num_workers = min(args.workers, len(bag_files))
-    print(f"=== Pass 2: Processing sensor topics ({num_workers} workers) ===")
-
-    # Prepare worker arguments — segments as plain dicts (picklable)
-    worker_args = [
-        (bag_path, args.mission, args.vessel, segments, args.dry_run)
-        for bag_path in bag_files
-    ]
-
-    topic_counts = {topic: 0 for topic in TOPIC_PROCESSORS}
-    topic_errors = {topic: 0 for topic in TOPIC_PROCESSORS}
-    total_written = len(segments) if segments else 0
-    completed = 0
+    all_size_mb = sum(os.path.getsize(f) for f in all_bag_files) / (1024 * 1024)
+    # Stage timings per pass, merged from every worker task (--profile)
+    run_profile = {} if args.profile or args.profile_json or args.profile_metrics else None
+    run_stats = {
+        "mission": args.mission,
+        "sink": "dry-run" if args.dry_run else args.sink,
+        "workers": args.workers,
+        "fused": args.fused,
+        "columnar": args.columnar,
+        "scan_cache": not args.no_scan_cache,
+        "passes": {},
+    }
 
-    if num_workers > 1:
-        # Parallel processing
-        with Pool(processes=num_workers) as pool:
-            for result in pool.imap_unordered(process_single_bag, worker_args):
-                filename, msg_count, counts, errors, file_elapsed = result
-                completed += 1
-                total_written += msg_count
-
-                for topic, cnt in counts.items():
-                    topic_counts[topic] = topic_counts.get(topic, 0) + cnt
-                for topic, cnt in errors.items():
-                    topic_errors[topic] = topic_errors.get(topic, 0) + cnt
-
-                # Mark file as processed
-                if not args.dry_run:
-                    full_path = os.path.join(args.bag_dir or os.path.dirname(args.bag), filename)
-                    if os.path.exists(full_path):
-                        tracker["processed_files"][filename] = file_fingerprint(full_path)
-                        save_tracker(args.mission, tracker)
-
-                pct = completed / len(bag_files) * 100
-                elapsed_total = time.time() - start_time
-                print(f"  [{completed}/{len(bag_files)}] {filename}: "
-                      f"{msg_count} points ({file_elapsed:.1f}s) — "
-                      f"{pct:.0f}% done, elapsed {elapsed_total:.0f}s")
-    else:
-        # Sequential processing (workers=1)
-        for worker_arg in worker_args:
-            result = process_single_bag(worker_arg)
-            filename, msg_count, counts, errors, file_elapsed = result
+    # Temp files shared by the passes: decoded bags spilled by --fused, the workers' timeline file
+    spill_dir = None
+    timeline_path = None
+    try:
+        # --- Pass 1: Build mode timeline across ALL bag files (including already processed) ---
+        # Already-scanned bags come from the scan cache; only new/changed files are read
+        pass_start = time.time()
+        scan_cache = None if args.no_scan_cache else ScanCache()
+        if args.fused:
+            # Same read also collects battery readings and decodes the new bags
+            spill_dir = tempfile.mkdtemp(prefix=f"extract-{args.mission}-")
+            mode_timeline, battery_readings, spill_paths = fused_scan(
+                all_bag_files, bag_files, spill_dir, args.fused_spill_gb * 1e9, scan_cache=scan_cache,
+                profile=run_profile, decimation=decimation)
+        else:
+            mode_timeline = build_mode_timeline(all_bag_files, scan_cache=scan_cache, profile=run_profile)
+        segments = mode_timeline.segments
+        # Pass 1b/2 workers map this file instead of unpickling the segments with every task
+        timeline_path = write_timeline_file(mode_timeline)
+
+        # Write mission segments — with a record of the last run's, only what changed,
+        # plus re-tag tasks for written bags whose points now fall in a different mode
+        previous_segments = tracker.segments() if sink and sink.tracked else None
+        print()
+        if previous_segments is None:
+            change = (segments, [], [])
+        else:
+            change = diff_timelines(previous_segments, segments)
+        written_names = tracker.written_names()
+        written_paths = {path for path in all_bag_files if os.path.basename(path) in written_names}
+        retag_args = apply_timeline_change(change, segments, sink, args.mission, args.vessel,
+                                           mode_timeline.bag_intervals, written_paths, timeline_path,
+                                           skip_paths=set(bag_files),
+                                           parquet=parquet, dry_run=args.dry_run, rollups=rollups,
+                                           change_only=change_only)
+        if sink and sink.tracked and not retag_args:
+            # Pass 2 tags with this timeline: record it first, so an interrupted run is resumed against it
+            tracker.store_segments(segments)
+        print("  Done.")
+        print()
+        replace_rates = previous_segments is not None and bool(change[0] or change[1])
+        run_stats["passes"]["pass1"] = {"seconds": time.time() - pass_start, "files": len(all_bag_files),
+                                        "mb": all_size_mb, "points": len(segments)}
+
+        # --- Pass 1b: Pre-compute battery rates per mode ---
+        # (matches mission_time_analysis: iterate chronologically, check mode at BOTH timestamps)
+        pass_start = time.time()
+        if args.fused:
+            print("=== Pass 1b: Computing battery rates per mode (from fused read) ===")
+            rate_points = summarize_battery_rates(battery_readings, mode_timeline, args.mission, args.vessel, sink,
+                                                  replace=replace_rates)
+        else:
+            rate_points = compute_battery_rates(all_bag_files, mode_timeline, timeline_path, args.mission, args.vessel,
+                                                sink, scan_cache=scan_cache, profile=run_profile, replace=replace_rates)
+        if scan_cache:
+            scan_cache.close()
+        run_stats["passes"]["pass1b"] = {"seconds": time.time() - pass_start, "files": len(all_bag_files),
+                                         "mb": all_size_mb, "points": rate_points}
+
+        # --- Pass 2: Process all sensor topics ---
+        if not bag_files and not retag_args:
+            print("=== Pass 2: Skipped (all files already processed) ===")
+            if rollups and sink and sink.tracked:
+                rollup_edges = RollupEdges(tracker.path)
+                write_dirty_rollup_edges(rollup_edges, sink, args.mission, args.vessel)
+                rollup_edges.close()
+            elapsed = time.time() - start_time
+            print(f"\n=== Summary ===")
+            print(f"  Pass 1 + 1b only (no new sensor data to process)")
+            print(f"  Elapsed: {elapsed:.1f}s ({elapsed/60:.1f} min)")
+            if run_profile is not None:
+                report_profile(run_profile, run_stats, args, sink, int(start_time * 1e9))
+            if sink and sink.tracked:
+                tracker.store_segments(segments)
+            tracker.close()
+            if sink:
+                sink.close()
+            if args.stats_json:
+                run_stats["total_seconds"] = elapsed
+                write_run_stats(args.stats_json, run_stats)
+            print("Done!")
+            return
+
+        # Bags an interrupted run partly wrote continue after each topic's last written point
+        resume = {}
+        if sink and sink.tracked and sink.line_protocol and not args.force:
+            resume = resume_points(tracker, bag_files, change[2], mode_timeline.bag_intervals)
+
+        # Prepare worker arguments — the timeline goes by file path, largest bags first.
+        # Spilled bags are already decoded and Parquet writes one file set per bag: neither is sharded.
+        read_fn = process_single_bag_columnar if args.columnar else process_single_bag
+        spilled_tasks = []
+        if args.fused:
+            # Bags that failed to read in the fused pass have nothing to write;
+            # those over the spill budget are read again like without --fused
+            bag_files = [bag_path for bag_path in bag_files if bag_path in spill_paths]
+            spilled_tasks = schedule_bags([bag_path for bag_path in bag_files if spill_paths[bag_path]], [],
+                                          args.workers, shard_mb=0)
+            read_files = [bag_path for bag_path in bag_files if not spill_paths[bag_path]]
+        else:
+            read_files = bag_files
+        read_tasks = schedule_bags(read_files, mode_timeline.bag_intervals, args.workers,
+                                   shard_mb=0 if parquet else args.shard_mb)
+        tasks = spilled_tasks + read_tasks
+        spilled_args = [
+            (spill_paths[bag_path], bag_path, args.mission, args.vessel, timeline_path, args.dry_run,
+             resume.get(bag_path), lead_in_bags(bag_path, mode_timeline.bag_intervals, change_only))
+            for bag_path, _, _ in spilled_tasks
+        ]
+        read_args = [
+            (bag_path, args.mission, args.vessel, timeline_path, args.dry_run, windows, resume.get(bag_path),
+             shard, lead_in_bags(bag_path, mode_timeline.bag_intervals, change_only))
+            for bag_path, windows, shard in read_tasks
+        ]
+        # Re-tagging reads only the changed ranges, so it never uses fused spill files
+        jobs = [(write_spilled_bag, spilled_args), (read_fn, read_args + retag_args)]
+        shard_results = ShardedResults(tasks)
+        total_tasks = len(bag_files) + len(retag_args)  # bags, however many shards they were split into
+
+        num_workers = min(args.workers, max(len(spilled_args) + len(read_args) + len(retag_args), 1))
+        print(f"=== Pass 2: Processing sensor topics ({num_workers} workers) ===")
+        print(describe_schedule(tasks))
+        pass_start = time.time()
+
+        # Writer stage: decoders enqueue line-protocol chunks, writer threads hand them to the sink
+        writer = None
+        if sink and sink.line_protocol:
+            if sink.tracked:
+                tracker.begin(bag_files, resume)
+            writer = WriterPool(sink, num_writers=max(args.writers, 1), queue_size=max(args.write_queue, 1),
+                                tracker=tracker if sink.tracked else None)
+            print(f"  Writers: {len(writer.threads)} (queue: {args.write_queue} chunks)")
+        if resume:
+            print(f"  Resuming {len(resume)} partly written bags after their last written points")
+
+        topic_counts = {topic: 0 for topic in TOPIC_PROCESSORS}
+        topic_errors = {topic: 0 for topic in TOPIC_PROCESSORS}
+        topic_dropped = {topic: 0 for topic in TOPIC_PROCESSORS}
+        topic_encoded = {}
+        total_written = len(segments) if segments else 0
+        completed = 0
+        failed_bags = []
+
+        def fail_bag(bag_path):
+            if os.path.basename(bag_path) not in failed_bags:
+                failed_bags.append(os.path.basename(bag_path))
+            if sink.tracked:
+                tracker.mark_failed(bag_path)
+
+        recorded = set()  # bags whose worker result, with its rollup edges, is in
+        written = []      # (bag_path, failed_chunks) of bags the writers finished, waiting for that result
+
+        def record_written_bags():
+            # Mark a file as processed only once all of its chunks and rollup edges reached the sink
+            if writer is None:
+                return
+            written.extend(writer.pop_finished())
+            waiting = []
+            for bag_path, failed_chunks in written:
+                if os.path.basename(bag_path) not in recorded:
+                    waiting.append((bag_path, failed_chunks))
+                elif failed_chunks or os.path.basename(bag_path) in failed_bags:
+                    fail_bag(bag_path)
+                elif sink.tracked and os.path.exists(bag_path):
+                    tracker.mark_done(bag_path)
+            written[:] = waiting
+
+        retag_names = {os.path.basename(task[0]) for task in retag_args}
+        # Partial rollup windows at bag and shard edges, kept next to the tracker journal
+        rollup_edges = RollupEdges(tracker.path if sink.tracked else None) if rollups and sink else None
+        rollup_points = write_dirty_rollup_edges(rollup_edges, sink, args.mission, args.vessel) if rollup_edges else 0
+
+        def record_result(result):
+            nonlocal completed, total_written, rollup_points
+            result = shard_results.add(result)
+            if result is None:
+                return  # more shards of this bag to come
+            filename, msg_count, counts, errors, file_elapsed, rollup, dropped, encoded = result
+            bag_path = os.path.join(args.bag_dir or os.path.dirname(args.bag), filename)
             completed += 1
             total_written += msg_count
+            if rollup is not None:
+                rollup_points += rollup["points"]
+                if rollup_edges is not None:
+                    try:
+                        rollup_points += write_rollup_edges(rollup_edges, filename, rollup, sink,
+                                                            args.mission, args.vessel)
+                    except Exception as e:
+                        print(f"  WARNING: rollup edges of {filename} not written: {e}")
+                        fail_bag(bag_path)
+            recorded.add(filename)
 
             for topic, cnt in counts.items():
                 topic_counts[topic] = topic_counts.get(topic, 0) + cnt
             for topic, cnt in errors.items():
                 topic_errors[topic] = topic_errors.get(topic, 0) + cnt
+            for topic, cnt in dropped.items():
+                topic_dropped[topic] = topic_dropped.get(topic, 0) + cnt
+            add_encoded_counts(topic_encoded, encoded)
 
-            # Mark file as processed
-            if not args.dry_run:
-                full_path = os.path.join(args.bag_dir or os.path.dirname(args.bag), filename)
-                if os.path.exists(full_path):
-                    tracker["processed_files"][filename] = file_fingerprint(full_path)
-                    save_tracker(args.mission, tracker)
+            record_written_bags()
+            if parquet:
+                # Parquet files are complete once the worker returns
+                if os.path.exists(bag_path) and filename not in retag_names and filename not in failed_bags:
+                    tracker.mark_done(bag_path, counts)
 
-            pct = completed / len(bag_files) * 100
+            pct = completed / total_tasks * 100
             elapsed_total = time.time() - start_time
-            print(f"  [{completed}/{len(bag_files)}] {filename}: "
-                  f"{msg_count} points ({file_elapsed:.1f}s) — "
+            print(f"  [{completed}/{total_tasks}] {filename}: "
+                  f"{msg_count} points{' re-tagged' if filename in retag_names else ''} ({file_elapsed:.1f}s) — "
                   f"{pct:.0f}% done, elapsed {elapsed_total:.0f}s")
 
-    # --- Summary ---
-    elapsed = time.time() - start_time
-    print(f"\n=== Summary ===")
-    print(f"  Bag files processed: {len(bag_files)}")
-    print(f"  Workers: {num_workers}")
-    print(f"  Total points: {total_written}")
-    if segments:
-        print(f"    mission_segments: {len(segments)}")
-    for topic in TOPIC_PROCESSORS:
-        if topic_counts.get(topic, 0) > 0:
-            measurement_name = TOPIC_PROCESSORS[topic][0]
-            err_str = f" ({topic_errors.get(topic, 0)} errors)" if topic_errors.get(topic, 0) > 0 else ""
-            print(f"    {measurement_name}: {topic_counts[topic]}{err_str}")
-    print(f"  Elapsed: {elapsed:.1f}s ({elapsed/60:.1f} min)")
+        write_queue = writer.queue if writer else None
+        parquet_dir = args.parquet_dir if parquet else None
+        if num_workers > 1:
+            # Parallel processing
+            with Pool(processes=num_workers, initializer=init_write_worker,
+                      initargs=(write_queue, parquet_dir, rollups, decimation, change_only, timeline_path)) as pool:
+                for fn, fn_args in jobs:
+                    for result in profiled_imap(run_profile, "pass2", pool.imap_unordered, fn, fn_args):
+                        record_result(result)
+                # Let workers exit cleanly so their queue feeder threads flush
+                pool.close()
+                pool.join()
+        else:
+            # Sequential processing (workers=1)
+            init_write_worker(write_queue, parquet_dir, rollups, decimation, change_only)
+            for fn, fn_args in jobs:
+                for result in profiled_imap(run_profile, "pass2", map, fn, fn_args):
+                    record_result(result)
+            init_write_worker()
+
+        if writer:
+            print("  Waiting for writers to drain...")
+            writer.close()
+            record_written_bags()
+            if run_profile is not None:
+                run_profile.setdefault("pass2", StageProfile()).add(
+                    "sink", "(writer threads)", writer.sink_seconds, writer.chunks_written)
+        run_stats["passes"]["pass2"] = {"seconds": time.time() - pass_start, "files": len(bag_files),
+                                        "mb": sum(os.path.getsize(f) for f in bag_files) / (1024 * 1024),
+                                        "points": sum(topic_counts.values())}
+
+        # Record the written timeline unless a re-tag failed (the next run redoes the diff)
+        if sink and sink.tracked and not (retag_names & set(failed_bags)):
+            tracker.store_segments(segments)
+        tracker.close()
+        if rollup_edges is not None:
+            rollup_edges.close()
+
+        # --- Summary ---
+        elapsed = time.time() - start_time
+        print(f"\n=== Summary ===")
+        print(f"  Bag files processed: {len(bag_files)}")
+        if retag_args:
+            print(f"  Bag files re-tagged: {len(retag_args)}")
+        print(f"  Workers: {num_workers}")
+        if writer:
+            print(f"  Writers: {len(writer.threads)} ({writer.bytes_written / (1024 * 1024):.0f} MB line protocol)")
+        if sink:
+            for line in sink.report():
+                print(f"  {line}")
+        if failed_bags:
+            print(f"  Write failures in {len(failed_bags)} files (not marked processed): {', '.join(failed_bags)}")
+        print(f"  Total points: {total_written}")
+        if segments:
+            print(f"    mission_segments: {len(segments)}")
+        for topic in TOPIC_PROCESSORS:
+            if topic_counts.get(topic, 0) > 0:
+                measurement_name = TOPIC_PROCESSORS[topic][0]
+                err_str = f" ({topic_errors.get(topic, 0)} errors)" if topic_errors.get(topic, 0) > 0 else ""
+                err_str += dropped_note(topic, topic_dropped, decimation)
+                print(f"    {measurement_name}: {topic_counts[topic]}{err_str}")
+        if decimation:
+            print(decimation_summary(topic_counts, topic_dropped, decimation))
+        if change_only:
+            print(change_only_summary(topic_encoded))
+        if rollups:
+            print(f"  Rollup points: {rollup_points} ({', '.join(label for label, _ in rollups['windows'])} windows)")
+        print(f"  Elapsed: {elapsed:.1f}s ({elapsed/60:.1f} min)")
 
-    if client:
-        client.close()
+        if run_profile is not None:
+            report_profile(run_profile, run_stats, args, sink, int(start_time * 1e9))
+        if sink:
+            sink.close()
+        if args.stats_json:
+            run_stats["total_seconds"] = elapsed
+            run_stats["measurements"] = {TOPIC_PROCESSORS[topic][0]: count
+                                         for topic, count in topic_counts.items() if count}
+            if rollups:
+                run_stats["rollup_points"] = rollup_points
+            if decimation:
+                run_stats["dropped"] = {TOPIC_PROCESSORS[topic][0]: count
+                                        for topic, count in topic_dropped.items() if count}
+            if change_only:
+                run_stats["change_only"] = {TOPIC_PROCESSORS[topic][0]: {"values": values, "written": written}
+                                            for topic, (values, written) in topic_encoded.items()}
+            write_run_stats(args.stats_json, run_stats)
 
-    print("Done!")
+        print("Done!")
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        if timeline_path:
+            os.remove(timeline_path)
 
 
 if __name__ == "__main__":
@@ -1,136 +1,45 @@
-from rosbags.rosbag2 import Reader
-from rosbags.typesys import Stores, get_typestore
-from rosbags.typesys.msg import get_types_from_msg
-
-typestore = get_typestore(Stores.ROS2_HUMBLE)
-
-bag_path = "/home/alam/post-mission-analysis/20260223_050019_0.db3"
-
-# Register custom message types from .msg definitions
-# get_types_from_msg parses the .msg text into the format typestore.register expects
-custom_msg_defs = [
-    ("rkse_common_interfaces/msg/KeyValue", "string key\nstring value"),
-
-    ("rkse_common_interfaces/msg/VesselMode",
-     "uint8 VESSEL_MODE_STAGING=0\n"
-     "uint8 VESSEL_MODE_ACTIVE=1\n"
-     "std_msgs/Header header\n"
-     "uint8 value"),
-
-    ("rkse_common_interfaces/msg/ControlModeStatus",
-     "std_msgs/Header header\n"
-     "rkse_common_interfaces/KeyValue[] data"),
-
-    ("rkse_common_interfaces/msg/LeakStatus",
-     "std_msgs/Header header\n"
-     "uint8 data"),
-
-    ("rkse_telemetry_interfaces/msg/BatteryStateTelemetry",
-     "uint8 NO_ERROR=0\n"
-     "uint8 LOW_BATTERY=1\n"
-     "uint8 ERROR=2\n"
-     "builtin_interfaces/Time stamp\n"
-     "float32 voltage\n"
-     "float32 charge_percentage\n"
-     "bool is_charging\n"
-     "uint8 error_code\n"
-     "string message"),
-
-    ("rkse_telemetry_interfaces/msg/StateTelemetry",
-     "builtin_interfaces/Time stamp\n"
-     "float64 latitude\n"
-     "float64 longitude\n"
-     "float32 heading\n"
-     "float32 vertical_speed\n"
-     "float32 depth\n"
-     "float32 altitude\n"
-     "float32 course_over_ground\n"
-     "float32 speed_over_ground\n"
-     "float32 yaw_rate"),
-
-    ("rkse_orion_interfaces/msg/PackStatus",
-     "builtin_interfaces/Time stamp\n"
-     "bool charge_power_status\n"
-     "bool ready_power_status\n"
-     "bool multipurpose_input\n"
-     "bool bms_errors_present\n"
-     "bool charger_safety\n"
-     "bool charge_enable\n"
-     "bool discharge_enable\n"
-     "float32 pack_state_of_charge\n"
-     "float32 pack_charge_current_limit\n"
-     "float32 pack_discharge_current_limit\n"
-     "float32 pack_current\n"
-     "float32 pack_voltage\n"
-     "float32 pack_amphours\n"
-     "float32 pack_depth_of_discharge\n"
-     "float32 pack_health\n"
-     "float32 pack_summed_voltage\n"
-     "float32 total_pack_cycles"),
-
-    ("rkse_driver_interfaces/msg/PowerManagementFeedback",
-     "std_msgs/Header header\n"
-     "bool load_on_off\n"
-     "bool adc_on_off\n"
-     "bool card_limit_tripped\n"
-     "float32 load_current\n"
-     "float32 bus_voltage\n"
-     "float32 temperature\n"
-     "float32 control_current\n"
-     "float32 averaged_time\n"
-     "float32 value_tripped\n"
-     "float32 startup_current\n"
-     "bool switch_on_off\n"
-     "bool watchdog_status\n"
-     "bool reboot\n"
-     "bool power_mode_on_off\n"
-     "bool power_mode_status\n"
-     "bool curr_max\n"
-     "bool curr_max_warn\n"
-     "bool volt_max\n"
-     "bool volt_max_warn\n"
-     "bool volt_min_warn\n"
-     "bool volt_min\n"
-     "bool temp_card_max\n"
-     "bool temp_card_max_warn"),
-
-    ("sbg_driver/msg/SbgEkfStatus",
-     "uint8 solution_mode\n"
-     "bool attitude_valid\n"
-     "bool heading_valid\n"
-     "bool velocity_valid\n"
-     "bool position_valid\n"
-     "bool vert_ref_used\n"
-     "bool mag_ref_used\n"
-     "bool gps1_vel_used\n"
-     "bool gps1_pos_used\n"
-     "bool gps1_course_used\n"
-     "bool gps1_hdt_used\n"
-     "bool gps2_vel_used\n"
-     "bool gps2_pos_used\n"
-     "bool gps2_course_used\n"
-     "bool gps2_hdt_used\n"
-     "bool odo_used"),
-
-    ("sbg_driver/msg/SbgEkfEuler",
-     "std_msgs/Header header\n"
-     "uint32 time_stamp\n"
-     "geometry_msgs/Vector3 angle\n"
-     "geometry_msgs/Vector3 accuracy\n"
-     "sbg_driver/SbgEkfStatus status"),
-]
+"""Inspect rosbag2 .db3 files: topics, rates, timing, payload sizes and decoded samples.
+
+Each bag is read once for its statistics: a scan of the requested topics'
+timestamps and payload sizes that never loads a payload (see
+BagFile.message_sizes). The decoded samples come from a second read limited
+to the time window holding each topic's first messages, which stops as soon
+as every topic has its samples. Directories are inspected across a worker pool.
+
+--summary lists topics, types, per-topic counts and start/end without
+decoding anything. The counts come from metadata.yaml when it covers just
+that file; a split recording's metadata.yaml only has totals for the whole
+directory, so each split is counted with one COUNT(*) ... GROUP BY over its
+messages table, which reads the table's pages but no overflow payloads.
+--topics-file writes rosbag-topics.txt for a whole mission from the same
+summary.
 
-# Parse and register all custom types
-all_types = {}
-for msgtype, msgdef in custom_msg_defs:
-    all_types.update(get_types_from_msg(msgdef, msgtype))
+Usage:
+    python3 inspect-bag.py /home/alam/post-mission-analysis/20260223_050019_0.db3
+    python3 inspect-bag.py /path/to/bags --workers 8 --topics /battery_state /gnss/fix
+    python3 inspect-bag.py /path/to/bag.db3 --all-topics --samples 3
+    python3 inspect-bag.py /path/to/bags --summary
+    python3 inspect-bag.py /path/to/bags --topics-file rosbag-topics.txt
+"""
+import argparse
+import glob
+import heapq
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from multiprocessing import Pool, cpu_count
 
-typestore.register(all_types)
+import numpy as np
+
+from msg_registry import init_registry_worker, shared_typestore
+from rosbag_db import BagFile, metadata_topic_counts, natural_sort_key
 
 # ====================================================================
-# Key topics to inspect
+# Key topics to inspect (default for --topics)
 # ====================================================================
-key_topics = [
+KEY_TOPICS = [
     # Standard ROS2 types
     "/battery_state",
     "/temperature",
@@ -150,48 +59,295 @@ key_topics = [
     "/imu/ellipse/sbg_ekf_euler",
 ]
 
-def print_fields(msg, prefix="", depth=0):
-    """Recursively print all fields of a ROS message"""
-    if depth > 3:
-        print(f"    {prefix}: (nested too deep, skipping)")
-        return
+GAP_FACTOR = 5          # an interval longer than GAP_FACTOR x the topic's median interval is a gap
+MAX_FIELD_DEPTH = 3
+MAX_VALUE_CHARS = 80
+
+
+def bag_paths(paths):
+    """Expand directories to their .db3 files (natural order); files are kept as given."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "*.db3")), key=natural_sort_key))
+        else:
+            found.append(path)
+    return found
+
+
+def ts_to_str(ns):
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
 
+def format_fields(msg, prefix="", depth=0):
+    """Lines for all fields of a ROS message, nested messages indented below their parent."""
+    if depth > MAX_FIELD_DEPTH:
+        return [f"    {prefix}: (nested too deep, skipping)"]
+
+    lines = []
     for field_name in msg.__dataclass_fields__:
         value = getattr(msg, field_name)
         full_name = f"{prefix}{field_name}" if not prefix else f"{prefix}.{field_name}"
 
         if hasattr(value, '__dataclass_fields__'):
-            print(f"    {full_name}: (nested)")
-            print_fields(value, prefix=f"    {full_name}", depth=depth+1)
+            lines.append(f"    {full_name}: (nested)")
+            lines.extend(format_fields(value, prefix=f"    {full_name}", depth=depth + 1))
         else:
             val_str = str(value)
-            if len(val_str) > 80:
-                val_str = val_str[:80] + "..."
-            print(f"    {full_name}: {val_str}")
+            if len(val_str) > MAX_VALUE_CHARS:
+                val_str = val_str[:MAX_VALUE_CHARS] + "..."
+            lines.append(f"    {full_name}: {val_str}")
+    return lines
 
-with Reader(bag_path) as reader:
-    print("=== Inspecting Key Topics — First Message Fields ===\n")
 
-    for topic_name in key_topics:
-        if topic_name not in reader.topics:
-            print(f"TOPIC: {topic_name}")
-            print(f"  NOT FOUND in this bag\n")
-            continue
+# ====================================================================
+# Per-bag inspection (runs in the worker pool)
+# ====================================================================
+def topic_stats(timestamps, sizes):
+    """Rate, inter-arrival timing, gaps and payload size distribution of one topic."""
+    ts = np.sort(np.asarray(timestamps, dtype=np.int64))
+    sizes = np.asarray(sizes, dtype=np.int64)
+    stats = {
+        "first": int(ts[0]),
+        "last": int(ts[-1]),
+        "span_s": (int(ts[-1]) - int(ts[0])) / 1e9,
+        "bytes": int(sizes.sum()),
+        "size_min": int(sizes.min()),
+        "size_median": float(np.median(sizes)),
+        "size_p99": float(np.percentile(sizes, 99)),
+        "size_max": int(sizes.max()),
+    }
+    if len(ts) < 2:
+        return stats
+
+    intervals = np.diff(ts) / 1e6  # ms
+    median = float(np.median(intervals))
+    stats.update(
+        rate_hz=(len(ts) - 1) / stats["span_s"] if stats["span_s"] > 0 else None,
+        interval_median=median,
+        interval_std=float(intervals.std()),
+        interval_p99=float(np.percentile(intervals, 99)),
+        interval_max=float(intervals.max()),
+    )
+    if median > 0:
+        gap_idx = np.flatnonzero(intervals > GAP_FACTOR * median)
+        stats["gaps"] = len(gap_idx)
+        if len(gap_idx):
+            longest = gap_idx[np.argmax(intervals[gap_idx])]
+            stats["longest_gap"] = (float(intervals[longest]), int(ts[longest]))
+    return stats
+
+
+def decode_sample(typestore, rawdata, msgtype):
+    if msgtype not in typestore.types:
+        return [f"    (type not registered, {len(rawdata)} bytes)"]
+    try:
+        return format_fields(typestore.deserialize_cdr(rawdata, msgtype))
+    except Exception as e:
+        return [f"    *** ERROR: {e} ***"]
+
+
+def inspect_bag(args_tuple):
+    """Report for one bag: {"path", "size", "start", "end", "topics": {topic: info}, "missing"}.
+
+    topics None means every topic in the bag. With summary, info is just
+    msgtype and count (plus "counts_from": where the counts came from);
+    otherwise it adds topic_stats() and up to `samples` decoded messages as
+    (timestamp, lines).
+    """
+    bag_path, topics, samples, summary = args_tuple
+    report = {"path": bag_path, "size": os.path.getsize(bag_path), "topics": {}, "missing": []}
+    with BagFile(bag_path) as bag:
+        report["start"], report["end"] = bag.start_time, bag.end_time
+        if summary:
+            counts = metadata_topic_counts(bag_path)
+            report["counts_from"] = "metadata.yaml"
+            if counts is None:
+                counts = bag.message_counts()
+                report["counts_from"] = "a scan of the messages table"
+            report["topics"] = {topic: {"msgtype": bag.msgtype(topic), "count": counts.get(topic, 0)}
+                                for topic in bag.topics}
+            return report
+
+        wanted = list(bag.topics) if topics is None else [t for t in topics if t in bag.topics]
+        report["missing"] = [] if topics is None else [t for t in topics if t not in bag.topics]
+
+        timestamps = {topic: [] for topic in wanted}
+        sizes = {topic: [] for topic in wanted}
+        for topic, timestamp, size in bag.message_sizes(wanted):
+            timestamps[topic].append(timestamp)
+            sizes[topic].append(size)
 
-        info = reader.topics[topic_name]
-        print(f"TOPIC: {topic_name}")
-        print(f"  Type: {info.msgtype}")
-        print(f"  Count: {info.msgcount}")
-
-        for connection, timestamp, rawdata in reader.messages():
-            if connection.topic == topic_name:
-                try:
-                    msg = typestore.deserialize_cdr(rawdata, connection.msgtype)
-                    print(f"  Fields (from first message):")
-                    print_fields(msg, prefix="")
-                    print(f"  Timestamp: {timestamp} ns")
-                except Exception as e:
-                    print(f"  *** ERROR: {e} ***")
-                break
+        for topic in wanted:
+            info = {"msgtype": bag.msgtype(topic), "count": len(timestamps[topic]), "samples": []}
+            if timestamps[topic]:
+                info.update(topic_stats(timestamps[topic], sizes[topic]))
+            report["topics"][topic] = info
 
+        # Samples: read only the window up to the last topic's samples-th message, stop once all are in
+        firsts = {topic: heapq.nsmallest(samples, ts) for topic, ts in timestamps.items() if ts}
+        if samples and firsts:
+            typestore = shared_typestore()
+            remaining = {topic: samples for topic in firsts}
+            start = min(ts[0] for ts in firsts.values())
+            stop = max(ts[-1] for ts in firsts.values()) + 1
+            for topic, timestamp, rawdata in bag.messages(list(firsts), start=start, stop=stop):
+                if not remaining.get(topic):
+                    continue
+                info = report["topics"][topic]
+                info["samples"].append((timestamp, decode_sample(typestore, rawdata, info["msgtype"])))
+                remaining[topic] -= 1
+                if not remaining[topic]:
+                    del remaining[topic]
+                    if not remaining:
+                        break
+    return report
+
+
+# ====================================================================
+# Output
+# ====================================================================
+def bag_header(report):
+    name = os.path.basename(report["path"])
+    if report["start"] is None:
+        return f"=== {name} ({format_bytes(report['size'])}, no messages) ==="
+    duration = (report["end"] - report["start"]) / 1e9
+    return (f"=== {name} ({format_bytes(report['size'])}, {duration:.1f} s, "
+            f"{ts_to_str(report['start'])} → {ts_to_str(report['end'])} UTC) ===")
+
+
+def print_report(report, topics):
+    print(bag_header(report))
+    print()
+    order = list(report["topics"]) if topics is None else topics
+    for topic in order:
+        print(f"TOPIC: {topic}")
+        if topic in report["missing"]:
+            print("  NOT FOUND in this bag\n")
+            continue
+
+        info = report["topics"][topic]
+        print(f"  Type: {info['msgtype']}")
+        if not info["count"]:
+            print("  Count: 0\n")
+            continue
+        rate = f"{info['rate_hz']:.2f} Hz over " if info.get("rate_hz") else ""
+        print(f"  Count: {info['count']} ({rate}{info['span_s']:.1f} s)")
+        if "interval_median" in info:
+            print(f"  Interval: median {info['interval_median']:.1f} ms, jitter (std) {info['interval_std']:.1f} ms, "
+                  f"p99 {info['interval_p99']:.1f} ms, max {info['interval_max']:.1f} ms")
+        if "gaps" in info:
+            longest = ""
+            if info["gaps"]:
+                gap_ms, gap_start = info["longest_gap"]
+                longest = f", longest {gap_ms:.1f} ms after {ts_to_str(gap_start)}"
+            print(f"  Gaps (> {GAP_FACTOR}x median interval): {info['gaps']}{longest}")
+        print(f"  Payload: min {format_bytes(info['size_min'])}, median {format_bytes(info['size_median'])}, "
+              f"p99 {format_bytes(info['size_p99'])}, max {format_bytes(info['size_max'])}, "
+              f"total {format_bytes(info['bytes'])}")
+        for number, (timestamp, lines) in enumerate(info["samples"], 1):
+            print(f"  Sample {number} ({ts_to_str(timestamp)} UTC, {timestamp} ns):")
+            for line in lines:
+                print(line)
         print()
+
+
+def print_summary(report):
+    print(bag_header(report))
+    topics = report["topics"]
+    width = max((len(topic) for topic in topics), default=0)
+    for topic, info in topics.items():
+        print(f"  {topic:<{width}}  {info['msgtype']:<52}  {info['count']}")
+    print(f"  {len(topics)} topics, {sum(info['count'] for info in topics.values())} messages "
+          f"(counts from {report['counts_from']})\n")
+
+
+def mission_topics(reports):
+    """[(topic, msgtype, per-bag count, total, bags)] in first-seen order.
+
+    The per-bag count is the median over the bags that recorded the topic,
+    so rosbag-topics.txt keeps meaning "messages per split bag".
+    """
+    msgtypes, counts = {}, {}
+    for report in reports:
+        for topic, info in report["topics"].items():
+            msgtypes.setdefault(topic, info["msgtype"])
+            counts.setdefault(topic, [])
+            if info["count"]:
+                counts[topic].append(info["count"])
+    return [(topic, msgtypes[topic], round(statistics.median(counts[topic])) if counts[topic] else 0,
+             sum(counts[topic]), len(counts[topic])) for topic in msgtypes]
+
+
+def write_topics_file(path, rows):
+    with open(path, "w") as f:
+        for topic, msgtype, per_bag, _, _ in rows:
+            f.write(f"{topic:<48} | {msgtype:<52} | {per_bag}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect ROS2 .db3 bags: topic rates, timing, payload sizes, samples")
+    parser.add_argument("paths", nargs="+", help=".db3 files and/or directories of .db3 files")
+    parser.add_argument("--topics", nargs="+", metavar="TOPIC",
+                        help="Topics to inspect (default: the key topics extract-bag.py reads)")
+    parser.add_argument("--all-topics", action="store_true", help="Inspect every topic in the bag")
+    parser.add_argument("--samples", type=int, default=1, help="Decoded messages shown per topic (default: 1)")
+    parser.add_argument("--summary", action="store_true",
+                        help="Only topics, types, counts and time range, nothing decoded; counts come from "
+                             "metadata.yaml when it covers a single file, else from scanning its messages table")
+    parser.add_argument("--topics-file", metavar="PATH",
+                        help="Write a rosbag-topics.txt (topic | msgtype | messages per bag) for all given bags")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parallel workers for several bags (default: one per CPU)")
+    args = parser.parse_args()
+
+    paths = bag_paths(args.paths)
+    if not paths:
+        sys.exit("No .db3 files found")
+
+    summary = args.summary or bool(args.topics_file)
+    topics = None if args.all_topics else (args.topics or KEY_TOPICS)
+    tasks = [(path, topics, args.samples, summary) for path in paths]
+    workers = min(args.workers or cpu_count(), len(paths))
+
+    start = time.time()
+    reports = []
+    pool = Pool(processes=workers, initializer=None if summary else init_registry_worker) if workers > 1 else None
+    try:
+        for report in (pool.imap(inspect_bag, tasks) if pool else map(inspect_bag, tasks)):
+            reports.append(report)
+            if args.topics_file:
+                continue
+            if summary:
+                print_summary(report)
+            else:
+                print_report(report, topics)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if args.topics_file:
+        rows = mission_topics(reports)
+        write_topics_file(args.topics_file, rows)
+        print(f"Wrote {len(rows)} topics from {len(reports)} bag(s) to {args.topics_file}")
+    elif summary and len(reports) > 1:
+        rows = mission_topics(reports)
+        width = max((len(row[0]) for row in rows), default=0)
+        print(f"=== Mission: {len(reports)} bags ===")
+        print(f"  {'topic':<{width}}  {'msgtype':<52}  {'per bag':>8}  {'total':>10}  bags")
+        for topic, msgtype, per_bag, total, bags in rows:
+            print(f"  {topic:<{width}}  {msgtype:<52}  {per_bag:>8}  {total:>10}  {bags}")
+    print(f"\nInspected {len(reports)} bag(s) in {time.time() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Custom ROS2 message definitions and the process-wide typestore.
+
+The one copy of our .msg definitions, shared by extract-bag.py,
+inspect-bag.py and preview-extract.py. Parsing them with
+get_types_from_msg is cached on disk (tracking/msg-types-<hash>.pkl),
+keyed by a hash of the definitions and the rosbags version, so editing a
+definition or upgrading rosbags reparses and nothing else does.
+
+The typestore and its CdrDecoders are built once per process and reused
+by every task that process runs. Worker pools pass init_registry_worker
+as (or call it from) their initializer; in a forked worker whose parent
+already built them it does nothing.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from importlib.metadata import version
+
+from rosbags.typesys import Stores, get_typestore
+from rosbags.typesys.msg import get_types_from_msg
+
+from cdr_decode import CdrDecoders
+
+TYPES_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracking")
+
+CUSTOM_MSG_DEFS = [
+    ("rkse_common_interfaces/msg/KeyValue", "string key\nstring value"),
+
+    ("rkse_common_interfaces/msg/VesselMode",
+     "uint8 VESSEL_MODE_STAGING=0\n"
+     "uint8 VESSEL_MODE_ACTIVE=1\n"
+     "std_msgs/Header header\n"
+     "uint8 value"),
+
+    ("rkse_common_interfaces/msg/ControlModeStatus",
+     "std_msgs/Header header\n"
+     "rkse_common_interfaces/KeyValue[] data"),
+
+    ("rkse_common_interfaces/msg/ControlModeFeedback",
+     "std_msgs/Header header\n"
+     "string manual_preset_name\n"
+     "string stationary_preset_name\n"
+     "string current_mode_name\n"
+     "uint8 current_mode\n"
+     "builtin_interfaces/Duration duration"),
+
+    ("rkse_common_interfaces/msg/LeakStatus",
+     "std_msgs/Header header\n"
+     "uint8 data"),
+
+    ("rkse_telemetry_interfaces/msg/BatteryStateTelemetry",
+     "uint8 NO_ERROR=0\n"
+     "uint8 LOW_BATTERY=1\n"
+     "uint8 ERROR=2\n"
+     "builtin_interfaces/Time stamp\n"
+     "float32 voltage\n"
+     "float32 charge_percentage\n"
+     "bool is_charging\n"
+     "uint8 error_code\n"
+     "string message"),
+
+    ("rkse_telemetry_interfaces/msg/StateTelemetry",
+     "builtin_interfaces/Time stamp\n"
+     "float64 latitude\n"
+     "float64 longitude\n"
+     "float32 heading\n"
+     "float32 vertical_speed\n"
+     "float32 depth\n"
+     "float32 altitude\n"
+     "float32 course_over_ground\n"
+     "float32 speed_over_ground\n"
+     "float32 yaw_rate"),
+
+    ("rkse_orion_interfaces/msg/PackStatus",
+     "builtin_interfaces/Time stamp\n"
+     "bool charge_power_status\n"
+     "bool ready_power_status\n"
+     "bool multipurpose_input\n"
+     "bool bms_errors_present\n"
+     "bool charger_safety\n"
+     "bool charge_enable\n"
+     "bool discharge_enable\n"
+     "float32 pack_state_of_charge\n"
+     "float32 pack_charge_current_limit\n"
+     "float32 pack_discharge_current_limit\n"
+     "float32 pack_current\n"
+     "float32 pack_voltage\n"
+     "float32 pack_amphours\n"
+     "float32 pack_depth_of_discharge\n"
+     "float32 pack_health\n"
+     "float32 pack_summed_voltage\n"
+     "float32 total_pack_cycles"),
+
+    ("rkse_driver_interfaces/msg/PowerManagementFeedback",
+     "std_msgs/Header header\n"
+     "bool load_on_off\n"
+     "bool adc_on_off\n"
+     "bool card_limit_tripped\n"
+     "float32 load_current\n"
+     "float32 bus_voltage\n"
+     "float32 temperature\n"
+     "float32 control_current\n"
+     "float32 averaged_time\n"
+     "float32 value_tripped\n"
+     "float32 startup_current\n"
+     "bool switch_on_off\n"
+     "bool watchdog_status\n"
+     "bool reboot\n"
+     "bool power_mode_on_off\n"
+     "bool power_mode_status\n"
+     "bool curr_max\n"
+     "bool curr_max_warn\n"
+     "bool volt_max\n"
+     "bool volt_max_warn\n"
+     "bool volt_min_warn\n"
+     "bool volt_min\n"
+     "bool temp_card_max\n"
+     "bool temp_card_max_warn"),
+
+    ("sbg_driver/msg/SbgEkfStatus",
+     "uint8 solution_mode\n"
+     "bool attitude_valid\n"
+     "bool heading_valid\n"
+     "bool velocity_valid\n"
+     "bool position_valid\n"
+     "bool vert_ref_used\n"
+     "bool mag_ref_used\n"
+     "bool gps1_vel_used\n"
+     "bool gps1_pos_used\n"
+     "bool gps1_course_used\n"
+     "bool gps1_hdt_used\n"
+     "bool gps2_vel_used\n"
+     "bool gps2_pos_used\n"
+     "bool gps2_course_used\n"
+     "bool gps2_hdt_used\n"
+     "bool odo_used"),
+
+    ("sbg_driver/msg/SbgEkfEuler",
+     "std_msgs/Header header\n"
+     "uint32 time_stamp\n"
+     "geometry_msgs/Vector3 angle\n"
+     "geometry_msgs/Vector3 accuracy\n"
+     "sbg_driver/SbgEkfStatus status"),
+]
+
+
+DEFS_HASH = hashlib.sha256(json.dumps([version("rosbags"), CUSTOM_MSG_DEFS]).encode()).hexdigest()
+
+_typestore = None
+_decoders = None
+
+
+def parse_definitions(cache_dir=TYPES_CACHE_DIR):
+    """get_types_from_msg over CUSTOM_MSG_DEFS, from the on-disk cache when its hash matches.
+
+    A missing or unreadable cache file is rebuilt; failing to write it
+    (read-only checkout) only costs the parse on the next start.
+    """
+    path = os.path.join(cache_dir, f"msg-types-{DEFS_HASH[:16]}.pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError, AttributeError):
+        pass
+
+    types = {}
+    for msgtype, msgdef in CUSTOM_MSG_DEFS:
+        types.update(get_types_from_msg(msgdef, msgtype))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(types, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # atomic: concurrent starts never read a partial file
+    except OSError:
+        pass
+    return types
+
+
+def shared_typestore():
+    """ROS2 Humble typestore with our custom types registered, built once per process."""
+    global _typestore
+    if _typestore is None:
+        typestore = get_typestore(Stores.ROS2_HUMBLE)
+        typestore.register(parse_definitions())
+        _typestore = typestore
+    return _typestore
+
+
+def shared_decoders():
+    """CdrDecoders over shared_typestore(); compiled decoders are kept for the life of the process."""
+    global _decoders
+    if _decoders is None:
+        _decoders = CdrDecoders(shared_typestore())
+    return _decoders
+
+
+def init_registry_worker():
+    """Pool initializer: have the typestore and decoders ready before the first task."""
+    shared_decoders()
@@ -1,194 +1,189 @@
+"""Preview what extract-bag.py will write: the first messages of each topic, as points.
+
+Every topic in TOPIC_PROCESSORS is run through its processor, so the preview
+shows exactly the measurement, fields and extra tags that go to InfluxDB,
+plus the mode tag from the real mode timeline (Pass 1 over the bags'
+directories, from the scan cache where possible).
+
+Each bag is read with one topic-filtered query that stops as soon as every
+topic in it has --samples messages. Where metadata.yaml gives the file's
+per-topic counts, a topic with fewer is done once all of them are read and
+a topic never recorded is not queried, so neither holds the query open to
+the end of the bag. Several bags, or a whole mission directory, are
+previewed in parallel.
+
+Usage:
+    python3 preview-extract.py /home/alam/post-mission-analysis/20260223_050019_0.db3
+    python3 preview-extract.py /path/to/bags --samples 3 --workers 8 --output extracted-preview.txt
+    python3 preview-extract.py /path/to/bag.db3 --topics /battery_state /gnss/fix
+"""
+import argparse
+import contextlib
+import glob
+import importlib.util
+import os
 import sys
-from datetime import datetime
-from rosbags.rosbag2 import Reader
-from rosbags.typesys import Stores, get_typestore
-from rosbags.typesys.msg import get_types_from_msg
-
-typestore = get_typestore(Stores.ROS2_HUMBLE)
-
-custom_msg_defs = [
-    ("rkse_common_interfaces/msg/KeyValue", "string key\nstring value"),
-    ("rkse_common_interfaces/msg/VesselMode",
-     "uint8 VESSEL_MODE_STAGING=0\nuint8 VESSEL_MODE_ACTIVE=1\nstd_msgs/Header header\nuint8 value"),
-    ("rkse_common_interfaces/msg/ControlModeStatus",
-     "std_msgs/Header header\nrkse_common_interfaces/KeyValue[] data"),
-    ("rkse_common_interfaces/msg/LeakStatus",
-     "std_msgs/Header header\nuint8 data"),
-    ("rkse_telemetry_interfaces/msg/BatteryStateTelemetry",
-     "uint8 NO_ERROR=0\nuint8 LOW_BATTERY=1\nuint8 ERROR=2\nbuiltin_interfaces/Time stamp\n"
-     "float32 voltage\nfloat32 charge_percentage\nbool is_charging\nuint8 error_code\nstring message"),
-    ("rkse_telemetry_interfaces/msg/StateTelemetry",
-     "builtin_interfaces/Time stamp\nfloat64 latitude\nfloat64 longitude\nfloat32 heading\n"
-     "float32 vertical_speed\nfloat32 depth\nfloat32 altitude\nfloat32 course_over_ground\n"
-     "float32 speed_over_ground\nfloat32 yaw_rate"),
-    ("rkse_orion_interfaces/msg/PackStatus",
-     "builtin_interfaces/Time stamp\nbool charge_power_status\nbool ready_power_status\n"
-     "bool multipurpose_input\nbool bms_errors_present\nbool charger_safety\nbool charge_enable\n"
-     "bool discharge_enable\nfloat32 pack_state_of_charge\nfloat32 pack_charge_current_limit\n"
-     "float32 pack_discharge_current_limit\nfloat32 pack_current\nfloat32 pack_voltage\n"
-     "float32 pack_amphours\nfloat32 pack_depth_of_discharge\nfloat32 pack_health\n"
-     "float32 pack_summed_voltage\nfloat32 total_pack_cycles"),
-    ("rkse_driver_interfaces/msg/PowerManagementFeedback",
-     "std_msgs/Header header\nbool load_on_off\nbool adc_on_off\nbool card_limit_tripped\n"
-     "float32 load_current\nfloat32 bus_voltage\nfloat32 temperature\nfloat32 control_current\n"
-     "float32 averaged_time\nfloat32 value_tripped\nfloat32 startup_current\nbool switch_on_off\n"
-     "bool watchdog_status\nbool reboot\nbool power_mode_on_off\nbool power_mode_status\n"
-     "bool curr_max\nbool curr_max_warn\nbool volt_max\nbool volt_max_warn\nbool volt_min_warn\n"
-     "bool volt_min\nbool temp_card_max\nbool temp_card_max_warn"),
-    ("sbg_driver/msg/SbgEkfStatus",
-     "uint8 solution_mode\nbool attitude_valid\nbool heading_valid\nbool velocity_valid\n"
-     "bool position_valid\nbool vert_ref_used\nbool mag_ref_used\nbool gps1_vel_used\n"
-     "bool gps1_pos_used\nbool gps1_course_used\nbool gps1_hdt_used\nbool gps2_vel_used\n"
-     "bool gps2_pos_used\nbool gps2_course_used\nbool gps2_hdt_used\nbool odo_used"),
-    ("sbg_driver/msg/SbgEkfEuler",
-     "std_msgs/Header header\nuint32 time_stamp\ngeometry_msgs/Vector3 angle\n"
-     "geometry_msgs/Vector3 accuracy\nsbg_driver/SbgEkfStatus status"),
-]
-
-all_types = {}
-for msgtype, msgdef in custom_msg_defs:
-    all_types.update(get_types_from_msg(msgdef, msgtype))
-typestore.register(all_types)
-
-bag_path = "/home/alam/post-mission-analysis/20260223_050019_0.db3"
+import time
+from datetime import datetime, timezone
+from multiprocessing import Pool, cpu_count
+
+from msg_registry import init_registry_worker, shared_typestore
+from rosbag_db import BagFile, may_contain, metadata_topic_counts, natural_sort_key
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_spec = importlib.util.spec_from_file_location("extract_bag", os.path.join(REPO_DIR, "extract-bag.py"))
+extract_bag = importlib.util.module_from_spec(_spec)
+sys.modules["extract_bag"] = extract_bag  # its Pass 1 Pool workers are looked up by module name
+_spec.loader.exec_module(extract_bag)
+
+TOPIC_PROCESSORS = extract_bag.TOPIC_PROCESSORS
+
+
+def bag_paths(paths):
+    """Expand directories to their .db3 files (natural order); files are kept as given."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "*.db3")), key=natural_sort_key))
+        else:
+            found.append(path)
+    return found
+
 
 def ts_to_str(ns):
-    return datetime.utcfromtimestamp(ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-
-output = []
-
-with Reader(bag_path) as reader:
-
-    # ---- MODE TIMELINE ----
-    output.append("=" * 70)
-    output.append("MODE TIMELINE (/control_mode/status) — first 3 messages")
-    output.append("=" * 70)
-    count = 0
-    for conn, ts, raw in reader.messages():
-        if conn.topic == "/control_mode/status" and count < 3:
-            msg = typestore.deserialize_cdr(raw, conn.msgtype)
-            output.append(f"\n  Timestamp: {ts_to_str(ts)}")
-            output.append(f"  KeyValue pairs:")
-            for kv in msg.data:
-                marker = " <<<< ACTIVE" if kv.value.lower() == "true" else ""
-                output.append(f"    {kv.key} = {kv.value}{marker}")
-            count += 1
-
-    # ---- FIRST MESSAGE FROM EACH SENSOR TOPIC ----
-    topics_to_preview = [
-        "/battery_state", "/temperature", "/humidity", "/pressure",
-        "/telemetry/state", "/telemetry/battery_state", "/pack_status",
-        "/pm/feedback", "/leak_detect", "/gnss/fix", "/odometry/filtered",
-        "/moving_base_second/navheading", "/vessel/mode",
-        "/imu/ellipse/sbg_ekf_euler",
-    ]
-
-    seen = set()
-    for conn, ts, raw in reader.messages():
-        topic = conn.topic
-        if topic in seen or topic not in topics_to_preview:
-            continue
-        seen.add(topic)
-
-        output.append(f"\n{'=' * 70}")
-        output.append(f"{topic} — first message")
-        output.append(f"{'=' * 70}")
-        output.append(f"  Timestamp: {ts_to_str(ts)}")
-        output.append(f"  Mode tag:  Idle (all 597 mode messages show Idle)")
-
-        msg = typestore.deserialize_cdr(raw, conn.msgtype)
-
-        if topic == "/battery_state":
-            output.append(f"  voltage:       {msg.voltage}")
-            output.append(f"  current:       {msg.current}")
-            output.append(f"  charge:        {msg.charge}")
-            output.append(f"  capacity:      {msg.capacity}")
-            output.append(f"  percentage:    {msg.percentage}")
-            output.append(f"  temperature:   {msg.temperature}")
-            output.append(f"  present:       {msg.present}")
-
-        elif topic == "/temperature":
-            output.append(f"  temperature_c: {msg.temperature}")
-
-        elif topic == "/humidity":
-            output.append(f"  relative_humidity: {msg.relative_humidity}")
-
-        elif topic == "/pressure":
-            output.append(f"  fluid_pressure: {msg.fluid_pressure}")
-
-        elif topic == "/telemetry/state":
-            output.append(f"  latitude:           {msg.latitude}")
-            output.append(f"  longitude:          {msg.longitude}")
-            output.append(f"  heading:            {msg.heading}")
-            output.append(f"  depth:              {msg.depth}")
-            output.append(f"  altitude:           {msg.altitude}")
-            output.append(f"  vertical_speed:     {msg.vertical_speed}")
-            output.append(f"  speed_over_ground:  {msg.speed_over_ground}")
-            output.append(f"  course_over_ground: {msg.course_over_ground}")
-            output.append(f"  yaw_rate:           {msg.yaw_rate}")
-
-        elif topic == "/telemetry/battery_state":
-            output.append(f"  voltage:           {msg.voltage}")
-            output.append(f"  charge_percentage: {msg.charge_percentage}")
-            output.append(f"  is_charging:       {msg.is_charging}")
-            output.append(f"  error_code:        {msg.error_code}")
-
-        elif topic == "/pack_status":
-            output.append(f"  pack_state_of_charge: {msg.pack_state_of_charge}")
-            output.append(f"  pack_voltage:         {msg.pack_voltage}")
-            output.append(f"  pack_current:         {msg.pack_current}")
-            output.append(f"  pack_health:          {msg.pack_health}")
-            output.append(f"  pack_amphours:        {msg.pack_amphours}")
-            output.append(f"  pack_depth_of_discharge: {msg.pack_depth_of_discharge}")
-            output.append(f"  discharge_enable:     {msg.discharge_enable}")
-            output.append(f"  charge_enable:        {msg.charge_enable}")
-            output.append(f"  pack_summed_voltage:  {msg.pack_summed_voltage}")
-            output.append(f"  total_pack_cycles:    {msg.total_pack_cycles}")
-
-        elif topic == "/pm/feedback":
-            output.append(f"  load_current:  {msg.load_current}")
-            output.append(f"  bus_voltage:   {msg.bus_voltage}")
-            output.append(f"  temperature:   {msg.temperature}")
-            output.append(f"  load_on_off:   {msg.load_on_off}")
-            output.append(f"  adc_on_off:    {msg.adc_on_off}")
-            if hasattr(msg, 'header') and hasattr(msg.header, 'frame_id'):
-                output.append(f"  card_id (tag): {msg.header.frame_id}")
-
-        elif topic == "/leak_detect":
-            output.append(f"  status: {msg.data}")
-
-        elif topic == "/gnss/fix":
-            output.append(f"  latitude:  {msg.latitude}")
-            output.append(f"  longitude: {msg.longitude}")
-            output.append(f"  altitude:  {msg.altitude}")
-            output.append(f"  status:    {msg.status.status}")
-            output.append(f"  service:   {msg.status.service}")
-
-        elif topic == "/odometry/filtered":
-            output.append(f"  position:    ({msg.pose.pose.position.x:.6f}, {msg.pose.pose.position.y:.6f}, {msg.pose.pose.position.z:.6f})")
-            output.append(f"  orientation: ({msg.pose.pose.orientation.x:.6f}, {msg.pose.pose.orientation.y:.6f}, {msg.pose.pose.orientation.z:.6f}, {msg.pose.pose.orientation.w:.6f})")
-            output.append(f"  linear_vel:  ({msg.twist.twist.linear.x:.6f}, {msg.twist.twist.linear.y:.6f}, {msg.twist.twist.linear.z:.6f})")
-            output.append(f"  angular_vel: ({msg.twist.twist.angular.x:.6f}, {msg.twist.twist.angular.y:.6f}, {msg.twist.twist.angular.z:.6f})")
-
-        elif topic == "/moving_base_second/navheading":
-            output.append(f"  orientation:   ({msg.orientation.x:.6f}, {msg.orientation.y:.6f}, {msg.orientation.z:.6f}, {msg.orientation.w:.6f})")
-            output.append(f"  angular_vel:   ({msg.angular_velocity.x:.6f}, {msg.angular_velocity.y:.6f}, {msg.angular_velocity.z:.6f})")
-
-        elif topic == "/vessel/mode":
-            output.append(f"  value: {msg.value} (0=STAGING, 1=ACTIVE)")
-
-        elif topic == "/imu/ellipse/sbg_ekf_euler":
-            output.append(f"  roll:           {msg.angle.x}")
-            output.append(f"  pitch:          {msg.angle.y}")
-            output.append(f"  yaw:            {msg.angle.z}")
-            output.append(f"  accuracy_roll:  {msg.accuracy.x}")
-            output.append(f"  accuracy_pitch: {msg.accuracy.y}")
-            output.append(f"  accuracy_yaw:   {msg.accuracy.z}")
-            output.append(f"  solution_mode:  {msg.status.solution_mode}")
-            output.append(f"  heading_valid:  {msg.status.heading_valid}")
-            output.append(f"  position_valid: {msg.status.position_valid}")
-
-with open("/home/alam/influxWithGraphana/extracted-preview.txt", "w") as f:
-    f.write("\n".join(output) + "\n")
-
-print(f"Written to /home/alam/influxWithGraphana/extracted-preview.txt")
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def build_timeline(bag_dirs, use_scan_cache=True):
+    """ModeTimeline of every bag in bag_dirs, the same one extract-bag.py would tag with."""
+    all_bag_files = sorted({path for bag_dir in bag_dirs for path in glob.glob(os.path.join(bag_dir, "*.db3"))},
+                           key=natural_sort_key)
+    scan_cache = extract_bag.ScanCache() if use_scan_cache else None
+    try:
+        bag_intervals, mode_events = extract_bag.collect_bag_intervals_and_mode_events(
+            all_bag_files, scan_cache=scan_cache)
+    finally:
+        if scan_cache:
+            scan_cache.close()
+    return extract_bag.assemble_mode_timeline(bag_intervals, mode_events, verbose=False)
+
+
+def preview_bag(args_tuple):
+    """Worker: the first `samples` points of each topic in one bag.
+
+    Returns (bag_path, (start, end), {topic: [(timestamp, mode, fields, extra_tags)]}, {topic: error}).
+    """
+    bag_path, topics, samples, timeline_path = args_tuple
+    typestore = shared_typestore()
+    mode_timeline = extract_bag.worker_timeline(timeline_path)
+    points = {}
+    errors = {}
+
+    with BagFile(bag_path) as bag:
+        bounds = (bag.start_time, bag.end_time)
+        # Topics metadata.yaml shows were never recorded aren't queried. Where it also gives
+        # this file's counts, a topic with fewer than `samples` is done once all of them are
+        # read, so it doesn't hold the query open to the end of the bag. Counting them here
+        # (BagFile.message_counts) would scan the whole table, which on full-rate bags costs
+        # more than the read it could cut short.
+        wanted = [topic for topic in topics if topic in bag.topics and may_contain(bag_path, [topic])]
+        counts = metadata_topic_counts(bag_path)
+        unread = {} if counts is None else {topic: counts.get(topic, 0) for topic in wanted}
+        remaining = {topic: samples for topic in wanted if unread.get(topic, samples)}
+        if not remaining:
+            return bag_path, bounds, points, errors
+
+        for topic, timestamp, rawdata in bag.messages(list(remaining)):
+            if topic not in remaining:
+                continue
+            if topic in unread:
+                unread[topic] -= 1
+            try:
+                msg = typestore.deserialize_cdr(rawdata, bag.msgtype(topic))
+                fields, extra_tags = TOPIC_PROCESSORS[topic][1](msg)
+            except Exception as e:
+                errors.setdefault(topic, str(e))
+            else:
+                points.setdefault(topic, []).append((timestamp, mode_timeline.lookup(timestamp), fields, extra_tags))
+                remaining[topic] -= 1
+            if not remaining[topic] or unread.get(topic) == 0:
+                del remaining[topic]
+                if not remaining:
+                    break
+    return bag_path, bounds, points, errors
+
+
+def format_preview(bag_path, bounds, points, errors, topics, mode_timeline):
+    output = ["=" * 70, os.path.basename(bag_path), "=" * 70]
+    start, end = bounds
+    if start is None:
+        return output + ["  (no messages)", ""]
+
+    output.append("  Modes:")
+    for segment in mode_timeline.segments:
+        if segment["start_time"] < end and segment["end_time"] > start:
+            output.append(f"    {ts_to_str(max(segment['start_time'], start))} → "
+                          f"{ts_to_str(min(segment['end_time'], end))}  {segment['mode']}")
+
+    for topic in topics:
+        measurement = TOPIC_PROCESSORS[topic][0]
+        if topic in errors:
+            output.append(f"\n  {topic} → {measurement}: *** ERROR: {errors[topic]} ***")
+        for number, (timestamp, mode, fields, extra_tags) in enumerate(points.get(topic, []), 1):
+            tags = " ".join(f"{name}={value}" for name, value in {"mode": mode, **extra_tags}.items())
+            output.append(f"\n  {topic} → {measurement} #{number}")
+            output.append(f"    Timestamp: {ts_to_str(timestamp)} ({timestamp} ns)")
+            output.append(f"    Tags:      {tags}")
+            width = max((len(name) for name in fields), default=0)
+            for name, value in fields.items():
+                output.append(f"      {name:<{width}} = {value!r}")
+
+    missing = [topic for topic in topics if topic not in points and topic not in errors]
+    if missing:
+        output.append(f"\n  Not in this bag: {', '.join(missing)}")
+    output.append("")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview the points extract-bag.py writes for a few messages per topic")
+    parser.add_argument("paths", nargs="+", help=".db3 files and/or directories of .db3 files")
+    parser.add_argument("--samples", type=int, default=1, help="Points shown per topic and bag (default: 1)")
+    parser.add_argument("--topics", nargs="+", metavar="TOPIC", choices=list(TOPIC_PROCESSORS),
+                        help="Topics to preview (default: every topic in TOPIC_PROCESSORS)")
+    parser.add_argument("--bag-dir", action="append",
+                        help="Directory whose bags build the mode timeline (default: the previewed bags' directories)")
+    parser.add_argument("--no-scan-cache", action="store_true", help="Rescan bags for the timeline instead of using the scan cache")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel workers (default: one per CPU)")
+    parser.add_argument("--output", help="Write the preview to this file instead of stdout")
+    args = parser.parse_args()
+
+    paths = bag_paths(args.paths)
+    if not paths:
+        sys.exit("No .db3 files found")
+    topics = args.topics or list(TOPIC_PROCESSORS)
+
+    start = time.time()
+    bag_dirs = args.bag_dir or sorted({os.path.dirname(os.path.abspath(path)) for path in paths})
+    with contextlib.redirect_stdout(sys.stderr):  # Pass 1 progress stays out of the preview
+        mode_timeline = build_timeline(bag_dirs, use_scan_cache=not args.no_scan_cache)
+    timeline_path = extract_bag.write_timeline_file(mode_timeline)
+
+    tasks = [(path, topics, args.samples, timeline_path) for path in paths]
+    workers = min(args.workers or cpu_count(), len(paths))
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        with Pool(processes=workers, initializer=init_registry_worker) as pool:
+            for preview in pool.imap(preview_bag, tasks):
+                out.write("\n".join(format_preview(*preview, topics, mode_timeline)) + "\n")
+    finally:
+        os.remove(timeline_path)
+        if args.output:
+            out.close()
+
+    print(f"Previewed {len(paths)} bag(s) in {time.time() - start:.2f}s"
+          + (f", written to {args.output}" if args.output else ""), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Direct read-only access to rosbag2 .db3 (SQLite) files.
+
+rosbags' Reader counts every message of every topic when a file is opened
+and its messages() call walks the whole `messages` table. Our scans only
+need a handful of topics, so this layer queries the `messages` table by
+`topic_id` (and optionally by time range via the timestamp index) and never
+touches the rows or BLOBs of topics we don't ask for.
+
+Files are opened read-only and immutable with mmap enabled, and the split
+bag's metadata.yaml (when present) lets callers skip files for topics that
+were never recorded.
+"""
+import os
+import re
+import sqlite3
+from collections import namedtuple
+from urllib.parse import quote
+
+# mmap window per connection — covers a whole ~100 MB split file
+MMAP_SIZE = 256 * 1024 * 1024
+
+TopicInfo = namedtuple("TopicInfo", ["id", "msgtype"])
+
+
+class BagFile:
+    """Read-only handle on one rosbag2 .db3 file."""
+
+    def __init__(self, path):
+        self.path = path
+        uri = f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+
+        self.topics = {}
+        self.topic_names = {}
+        for topic_id, name, msgtype in self.conn.execute("SELECT id, name, type FROM topics"):
+            self.topics[name] = TopicInfo(topic_id, msgtype)
+            self.topic_names[topic_id] = name
+
+        self._bounds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _load_bounds(self):
+        # Separate MIN/MAX queries so SQLite can answer each from timestamp_idx
+        (start,) = self.conn.execute("SELECT MIN(timestamp) FROM messages").fetchone()
+        (end,) = self.conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()
+        # end_time is exclusive (last message + 1), same as rosbags' Reader
+        self._bounds = (start, end + 1 if end is not None else None)
+
+    @property
+    def start_time(self):
+        if self._bounds is None:
+            self._load_bounds()
+        return self._bounds[0]
+
+    @property
+    def end_time(self):
+        if self._bounds is None:
+            self._load_bounds()
+        return self._bounds[1]
+
+    @property
+    def is_empty(self):
+        return self.start_time is None
+
+    def msgtype(self, topic):
+        return self.topics[topic].msgtype
+
+    def messages(self, topics, start=None, stop=None, ordered=True):
+        """Yield (topic, timestamp, rawdata) for the given topics only.
+
+        start/stop restrict to start <= timestamp < stop. Topics missing from
+        this file are ignored; if none are present nothing is queried.
+        """
+        ids = [self.topics[t].id for t in topics if t in self.topics]
+        if not ids:
+            return
+
+        query = f"SELECT topic_id, timestamp, data FROM messages WHERE topic_id IN ({','.join('?' * len(ids))})"
+        params = list(ids)
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if stop is not None:
+            query += " AND timestamp < ?"
+            params.append(stop)
+        if ordered:
+            query += " ORDER BY timestamp"
+
+        topic_names = self.topic_names
+        for topic_id, timestamp, data in self.conn.execute(query, params):
+            yield topic_names[topic_id], timestamp, data
+
+    def message_sizes(self, topics):
+        """Yield (topic, timestamp, size in bytes) for the given topics, in table order.
+
+        Payloads are not read: SQLite answers length() of a BLOB from the
+        record header, so the overflow pages of large messages stay untouched.
+        """
+        ids = [self.topics[t].id for t in topics if t in self.topics]
+        if not ids:
+            return
+
+        query = (f"SELECT topic_id, timestamp, length(data) FROM messages "
+                 f"WHERE topic_id IN ({','.join('?' * len(ids))})")
+        topic_names = self.topic_names
+        for topic_id, timestamp, size in self.conn.execute(query, ids):
+            yield topic_names[topic_id], timestamp, size
+
+    def message_counts(self):
+        """{topic: number of messages} for every topic in the file.
+
+        There is no topic_id index, so this scans the whole messages table:
+        payloads are not decoded, but small ones sit in the rows' pages and
+        are read with them. metadata_topic_counts() is free when it applies.
+        """
+        counts = dict.fromkeys(self.topics, 0)
+        for topic_id, count in self.conn.execute("SELECT topic_id, COUNT(*) FROM messages GROUP BY topic_id"):
+            if topic_id in self.topic_names:
+                counts[self.topic_names[topic_id]] = count
+        return counts
+
+
+def natural_sort_key(path):
+    """Sort file paths naturally: _0, _1, _2, ... _10, _11 (not _0, _1, _10, _11, _2)"""
+    name = os.path.basename(path)
+    return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', name)]
+
+
+# ====================================================================
+# metadata.yaml — skip files for topics that were never recorded
+# ====================================================================
+_metadata_cache = {}
+
+
+def load_bag_metadata(bag_dir):
+    """Parse <bag_dir>/metadata.yaml into {"topics": {name: count}, "files": {name: count}}.
+
+    Returns None when there is no metadata.yaml (e.g. loose .db3 files) or
+    it can't be parsed; callers then fall back to opening the file.
+    Results are cached per process.
+    """
+    bag_dir = os.path.abspath(bag_dir)
+    if bag_dir in _metadata_cache:
+        return _metadata_cache[bag_dir]
+
+    metadata = None
+    yaml_path = os.path.join(bag_dir, "metadata.yaml")
+    if os.path.exists(yaml_path):
+        try:
+            from ruamel.yaml import YAML  # installed with rosbags
+            with open(yaml_path) as f:
+                info = YAML(typ="safe").load(f)["rosbag2_bagfile_information"]
+            metadata = {
+                "topics": {
+                    entry["topic_metadata"]["name"]: int(entry["message_count"])
+                    for entry in info.get("topics_with_message_count", [])
+                },
+                "files": {
+                    os.path.basename(entry["path"]): int(entry["message_count"])
+                    for entry in info.get("files", [])
+                },
+            }
+        except Exception:
+            metadata = None
+
+    _metadata_cache[bag_dir] = metadata
+    return metadata
+
+
+def may_contain(bag_path, topics):
+    """False only if metadata.yaml proves none of `topics` is in this file.
+
+    metadata.yaml counts are per bag directory, so this can prove a topic
+    absent from every split file — or a split file empty — but not that a
+    recorded topic is absent from one particular split.
+    """
+    metadata = load_bag_metadata(os.path.dirname(bag_path))
+    if metadata is None:
+        return True
+
+    name = os.path.basename(bag_path)
+    if name not in metadata["files"]:
+        # Loose file next to another recording's metadata.yaml
+        return True
+    if metadata["files"][name] == 0:
+        return False
+    return any(metadata["topics"].get(topic, 0) > 0 for topic in topics)
+
+
+def metadata_topic_counts(bag_path):
+    """{topic: count} for this file from metadata.yaml, or None when it doesn't say.
+
+    metadata.yaml counts topics per bag directory, so they are this file's
+    own counts only when it is the recording's only file, or when the file
+    holds no messages at all. Split recordings need BagFile.message_counts().
+    """
+    metadata = load_bag_metadata(os.path.dirname(bag_path))
+    if metadata is None:
+        return None
+    name = os.path.basename(bag_path)
+    if name not in metadata["files"]:
+        return None
+    if metadata["files"][name] == 0:
+        return {}
+    if len(metadata["files"]) == 1:
+        return dict(metadata["topics"])
+    return None
@@ -0,0 +1,626 @@
+"""Sinks: where extract-bag.py's serialized points end up.
+
+Pass 2 hands a sink line-protocol chunks (bytes, up to BATCH_SIZE lines)
+and the summary passes hand it rows [(timestamp_ns, tags, fields)].
+InfluxSink writes to InfluxDB, LineProtocolFileSink to a local file and
+ParquetSink to a hive-partitioned Parquet dataset; NullSink and
+CountingSink discard everything for throughput tests. QueueSink and
+WriterPool put a pool of writer threads in the parent between the decode
+workers and the sink.
+
+influxdb_client is imported only by InfluxSink and create_point (the
+per-point fallback of Pass 2), and pyarrow only by the Parquet classes,
+so neither is needed for the other sinks.
+"""
+import glob
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import Queue
+from urllib.parse import quote
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for --sink parquet
+    pa = pq = None
+
+
+# Line-protocol sinks are driven by the WriterPool threads, so write()
+# must be thread-safe. Only InfluxDB and Parquet output is recorded in the
+# tracker; the file, null and counting sinks are for exports and
+# throughput tests and always process every bag.
+WRITE_RETRIES = 3         # extra attempts after a 429/503 response
+WRITE_RETRY_DELAY = 1.0   # seconds before the first retry (doubles), unless Retry-After says otherwise
+
+# Line protocol escaping, the way influxdb_client's Point writes it. Shared
+# with extract-bag.py's LineProtocolSerializer so summary rows and Pass 2
+# points go out without building a Point (or importing influxdb_client).
+ESCAPE_MEASUREMENT = str.maketrans({",": r"\,", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"})
+ESCAPE_KEY = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"})
+_ESCAPE_STRING = str.maketrans({'"': r"\"", "\\": r"\\"})
+
+
+def escape_tag_value(value):
+    escaped = str(value).translate(ESCAPE_KEY)
+    if escaped.endswith("\\"):
+        escaped += " "
+    return escaped
+
+
+def format_value(value):
+    """Field value as create_point + Point would write it, or None to skip."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        text = str(value)
+        return text[:-2] if text.endswith(".0") else text
+    return '"' + str(value).translate(_ESCAPE_STRING) + '"'
+
+
+def format_series(measurement, tags):
+    """Return "measurement,k=v,..." with tags sorted by key, leaving out None and empty tags."""
+    parts = [measurement.translate(ESCAPE_MEASUREMENT)]
+    for tag_name, tag_value in sorted(tags.items()):
+        if tag_value is None:
+            continue
+        key = str(tag_name).translate(ESCAPE_KEY)
+        value = escape_tag_value(tag_value)
+        if key and value:
+            parts.append(f"{key}={value}")
+    return ",".join(parts)
+
+
+def format_line(measurement, timestamp, tags, fields):
+    """One point as create_point(...).to_line_protocol() writes it; "" if no field is writable.
+
+    None fields are left out, as LineProtocolSerializer does (create_point
+    would write them as the string "None").
+    """
+    parts = []
+    for name, value in sorted(fields.items()):
+        text = None if value is None else format_value(value)
+        if text is not None:
+            parts.append(f"{str(name).translate(ESCAPE_KEY)}={text}")
+    if not parts:
+        return ""
+    return f"{format_series(measurement, tags)} {','.join(parts)} {timestamp}"
+
+
+def create_point(measurement, timestamp, fields, tags, extra_tags):
+    """InfluxDB Point from processed fields; NaN and Inf fields are left out."""
+    from influxdb_client import Point, WritePrecision
+
+    point = Point(measurement)
+
+    for tag_name, tag_value in tags.items():
+        point.tag(tag_name, tag_value)
+    for tag_name, tag_value in extra_tags.items():
+        point.tag(tag_name, str(tag_value))
+
+    for field_name, value in fields.items():
+        if isinstance(value, bool):
+            point.field(field_name, value)
+        elif isinstance(value, int):
+            point.field(field_name, value)
+        elif isinstance(value, float):
+            if math.isnan(value) or math.isinf(value):
+                continue
+            point.field(field_name, value)
+        else:
+            point.field(field_name, str(value))
+
+    point.time(timestamp, WritePrecision.NS)
+    return point
+
+
+class Sink:
+    """Base sink: subclasses implement write(body); summary rows go through format_line."""
+
+    label = "sink"
+    tracked = False         # record written bags in the tracker
+    line_protocol = True    # False: Pass 2 workers write decoded rows themselves (Parquet)
+    incremental = True      # write_rows upserts points by series and time; False: it replaces the table
+
+    def write(self, body):
+        """Write one line-protocol chunk (bytes)."""
+        raise NotImplementedError
+
+    def write_chunk(self, body, topic, points, last_ts):
+        """Write one Pass 2 chunk: points rows of topic, the last one at last_ts."""
+        self.write(body)
+
+    def delete(self, measurement, start, stop, tags):
+        """Delete measurement's points with these tag values and start <= time < stop."""
+
+    def write_rows(self, measurement, rows):
+        """Write summary rows [(timestamp_ns, tags, fields)]."""
+        lines = (format_line(measurement, timestamp, tags, fields) for timestamp, tags, fields in rows)
+        self.write("\n".join(line for line in lines if line).encode("utf-8"))
+
+    def close(self):
+        pass
+
+    def report(self):
+        """Extra lines for the end-of-run summary."""
+        return []
+
+
+class InfluxSink(Sink):
+    """InfluxDB /api/v2/write, with one keep-alive, gzip-enabled client per calling thread.
+
+    429 and 503 responses are retried WRITE_RETRIES times; any other
+    error (or running out of retries) is raised to the caller.
+    """
+
+    label = "InfluxDB"
+    tracked = True
+
+    def __init__(self, url, bucket, token, org):
+        self.url = url
+        self.bucket = bucket
+        self.token = token
+        self.org = org
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.clients = []
+        self.retries = 0
+        self.deletes = 0
+
+    def _client(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            from influxdb_client import InfluxDBClient
+            from influxdb_client.client.write_api import SYNCHRONOUS
+
+            client = self.local.client = InfluxDBClient(url=self.url, token=self.token, org=self.org,
+                                                        enable_gzip=True)
+            self.local.write_api = client.write_api(write_options=SYNCHRONOUS)
+            with self.lock:
+                self.clients.append(client)
+        return client
+
+    def write(self, body):
+        from influxdb_client import WritePrecision
+
+        self._client()
+        write_api = self.local.write_api
+        self._with_retries(lambda: write_api.write(bucket=self.bucket, record=body,
+                                                   write_precision=WritePrecision.NS))
+
+    def delete(self, measurement, start, stop, tags):
+        # /api/v2/delete takes an inclusive RFC3339 range and a tag predicate
+        predicate = " AND ".join([f'_measurement="{measurement}"']
+                                 + [f'{key}="{value}"' for key, value in tags.items()])
+        delete_api = self._client().delete_api()
+        self._with_retries(lambda: delete_api.delete(_rfc3339_ns(start), _rfc3339_ns(stop - 1), predicate,
+                                                     bucket=self.bucket, org=self.org))
+        with self.lock:
+            self.deletes += 1
+
+    def _with_retries(self, request):
+        from influxdb_client.rest import ApiException
+
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                request()
+                return
+            except ApiException as e:
+                if e.status not in (429, 503) or attempt == WRITE_RETRIES:
+                    raise
+                delay = WRITE_RETRY_DELAY * 2 ** attempt
+                try:
+                    delay = float(e.retry_after)
+                except (TypeError, ValueError):
+                    pass
+                with self.lock:
+                    self.retries += 1
+                time.sleep(delay)
+
+    def close(self):
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+    def report(self):
+        lines = [f"Retried writes: {self.retries} (429/503)"] if self.retries else []
+        if self.deletes:
+            lines.append(f"Deletes: {self.deletes} (points with a stale mode tag)")
+        return lines
+
+
+def _rfc3339_ns(timestamp):
+    """int ns → RFC3339 with nanoseconds, e.g. 2026-02-23T05:00:19.000000001Z."""
+    seconds, nanos = divmod(timestamp, 1_000_000_000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{nanos:09d}Z"
+
+
+class LineProtocolFileSink(Sink):
+    """Writes every chunk to one local line-protocol file (loadable later with `influx write`)."""
+
+    label = "line-protocol file"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.skipped_deletes = 0
+
+    def write(self, body):
+        if body:
+            with self.lock:
+                self.file.write(body + b"\n")
+
+    def delete(self, measurement, start, stop, tags):
+        # Append-only: points tagged with a superseded mode stay in the file
+        self.skipped_deletes += 1
+
+    def close(self):
+        self.file.close()
+
+    def report(self):
+        lines = [f"Line protocol: {self.path} ({os.path.getsize(self.path) / (1024 * 1024):.0f} MB)"]
+        if self.skipped_deletes:
+            lines.append(f"Deletes not applied: {self.skipped_deletes} (stale-mode points remain in the file)")
+        return lines
+
+
+class NullSink(Sink):
+    """Discards everything — measures decode, tagging and serialization alone."""
+
+    label = "null (discarded)"
+
+    def write(self, body):
+        pass
+
+
+class CountingSink(Sink):
+    """Discards points but counts lines per measurement, chunks and bytes."""
+
+    label = "counting (discarded)"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = {}
+        self.chunks = 0
+        self.bytes = 0
+
+    def write(self, body):
+        counts = {}
+        for line in body.split(b"\n"):
+            if line:
+                measurement = line.split(b",", 1)[0].decode("utf-8")
+                counts[measurement] = counts.get(measurement, 0) + 1
+        with self.lock:
+            self.chunks += 1
+            self.bytes += len(body)
+            for measurement, count in counts.items():
+                self.lines[measurement] = self.lines.get(measurement, 0) + count
+
+    def report(self):
+        lines = [f"Counted: {sum(self.lines.values())} lines in {self.chunks} chunks "
+                 f"({self.bytes / (1024 * 1024):.1f} MB)"]
+        lines += [f"  {measurement}: {count}" for measurement, count in sorted(self.lines.items())]
+        return lines
+
+
+# Writer stage: decode workers never wait on the sink. Each serialized
+# chunk is put on a bounded multiprocessing queue (a full queue blocks the
+# decoders — that's the backpressure) and a pool of writer threads in the
+# parent drains it into the sink (for InfluxDB: one keep-alive, gzip
+# client per thread). A bag counts as written only once all its chunks are;
+# until then the tracker journals its chunks as they are acknowledged, in
+# the order the worker produced them, so an interrupted bag can resume.
+class QueueSink(Sink):
+    """Worker-side sink that enqueues one bag's chunks for the WriterPool."""
+
+    def __init__(self, write_queue, bag_path, shard=None):
+        self.write_queue = write_queue
+        self.bag_path = bag_path
+        self.shard = shard or (0, 1)  # (index, count) of this worker's time shard of the bag
+        self.chunks = 0
+
+    def write(self, body):
+        self.write_chunk(body, None, 0, None)
+
+    def write_chunk(self, body, topic, points, last_ts):
+        # Chunks are numbered per shard so the writers can journal them in order
+        self.write_queue.put((self.bag_path, body, (self.shard[0], self.chunks, topic, points, last_ts)))
+        self.chunks += 1
+
+    def finish(self):
+        # End-of-shard marker: tells the writers how many chunks to expect
+        self.write_queue.put((self.bag_path, self.chunks, self.shard))
+
+
+class WriterPool:
+    """Writer threads draining the shared write queue into a sink.
+
+    A bag split into time shards arrives from several workers; it is
+    finished once every shard's end marker and chunks are through. With a
+    tracker, each bag's written chunks are journaled in (shard, chunk)
+    order up to the first one not yet written (still in flight, or
+    failed), so the journal never claims a chunk whose predecessors could
+    still be lost.
+    """
+
+    def __init__(self, sink, num_writers=4, queue_size=32, tracker=None):
+        self.sink = sink
+        self.tracker = tracker
+        self.queue = Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.expected = {}    # bag_path -> {shard: chunk count} (from the end-of-shard markers)
+        self.shards = {}      # bag_path -> number of shards
+        self.written = {}     # bag_path -> chunks written
+        self.failed = {}      # bag_path -> chunks that failed to write
+        self.acked = {}       # bag_path -> {(shard, chunk): (topic, points, last_ts)} written out of order
+        self.next_chunk = {}  # bag_path -> (shard, chunk) first not yet journaled
+        self.finished = []    # [(bag_path, failed_chunks)] not yet collected
+        self.bytes_written = 0
+        self.chunks_written = 0
+        self.sink_seconds = 0.0  # time spent inside sink.write, all threads
+        self.threads = [
+            threading.Thread(target=self._run, name=f"writer-{i}", daemon=True)
+            for i in range(num_writers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            bag_path, payload, progress = item
+            if isinstance(payload, int):
+                shard, shards = progress
+                with self.lock:
+                    self.expected.setdefault(bag_path, {})[shard] = payload
+                    self.shards[bag_path] = shards
+                    if self.tracker is not None:
+                        self._journal(bag_path)
+                    self._check_finished(bag_path)
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.sink.write(payload)
+                ok = True
+            except Exception as e:
+                print(f"  WARNING: write failed for {os.path.basename(bag_path)}: {e}")
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                counts = self.written if ok else self.failed
+                counts[bag_path] = counts.get(bag_path, 0) + 1
+                self.sink_seconds += elapsed
+                if ok:
+                    self.bytes_written += len(payload)
+                    self.chunks_written += 1
+                    if self.tracker is not None:
+                        self._acknowledge(bag_path, progress)
+                self._check_finished(bag_path)
+
+    def _acknowledge(self, bag_path, progress):
+        # Caller holds self.lock
+        shard, number, *chunk = progress
+        self.acked.setdefault(bag_path, {})[shard, number] = chunk
+        self._journal(bag_path)
+
+    def _journal(self, bag_path):
+        # Caller holds self.lock, which also keeps journal updates in chunk order
+        pending = self.acked.get(bag_path, {})
+        expected = self.expected.get(bag_path, {})
+        shard, number = self.next_chunk.get(bag_path, (0, 0))
+        acks = []
+        while True:
+            if (shard, number) in pending:
+                topic, points, last_ts = pending.pop((shard, number))
+                if topic is not None:
+                    acks.append((topic, points, last_ts))
+                number += 1
+            elif expected.get(shard) == number:
+                shard, number = shard + 1, 0  # all of this shard is journaled
+            else:
+                break
+        self.next_chunk[bag_path] = (shard, number)
+        if acks:
+            self.tracker.record_progress(bag_path, acks)
+
+    def _check_finished(self, bag_path):
+        # Caller holds self.lock
+        expected = self.expected.get(bag_path)
+        if expected is None or len(expected) < self.shards[bag_path]:
+            return
+        failed = self.failed.get(bag_path, 0)
+        if self.written.get(bag_path, 0) + failed == sum(expected.values()):
+            self.finished.append((bag_path, failed))
+            del self.expected[bag_path]
+            del self.shards[bag_path]
+            self.written.pop(bag_path, None)
+            self.failed.pop(bag_path, None)
+            self.acked.pop(bag_path, None)
+            self.next_chunk.pop(bag_path, None)
+
+    def pop_finished(self):
+        """Return [(bag_path, failed_chunks)] for bags fully written since the last call."""
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+    def close(self):
+        """Wait for the queue to drain and stop the writer threads."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+# Parquet (--sink parquet): one hive-partitioned dataset per measurement:
+#   <parquet-dir>/<measurement>/mission=<m>/mode=<mode>/hour=<YYYY-MM-DDTHH>/<bag>.parquet
+# Each bag writes its own files, so workers never share a file or a lock,
+# and re-extracting a bag replaces exactly its files. Columns are `time`,
+# `vessel`, the point's extra tags, then the fields typed as the topic
+# processors produce them. Non-finite floats become null, matching the
+# fields InfluxDB would have skipped.
+PARQUET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parquet")
+PARQUET_ROW_GROUP = 100_000
+
+
+def _partition_dir(root, measurement, mission, mode=None, hour=None):
+    parts = [root, measurement, f"mission={quote(mission, safe='')}"]
+    if mode is not None:
+        parts.append(f"mode={quote(mode, safe='')}")
+    if hour is not None:
+        parts.append(f"hour={time.strftime('%Y-%m-%dT%H', time.gmtime(hour * 3600))}")
+    return os.path.join(*parts)
+
+
+# One topic's files: its measurement, Arrow schema and the extra tags that get a column
+ParquetLayout = namedtuple("ParquetLayout", ["measurement", "schema", "tag_columns"])
+
+
+class ParquetBagWriter:
+    """Streams one bag's sensor rows into its partition files.
+
+    Rows are buffered per partition and written in row groups of
+    PARQUET_ROW_GROUP; files are written under a temp name and renamed on
+    close(), which also removes files this bag left in other partitions
+    of `measurements` by an earlier run (e.g. after its mode tags changed).
+    """
+
+    def __init__(self, root, mission, vessel, bag_path, measurements):
+        self.root = root
+        self.mission = mission
+        self.vessel = vessel
+        self.measurements = measurements
+        self.file_name = os.path.splitext(os.path.basename(bag_path))[0] + ".parquet"
+        self.pending = {}  # (measurement, mode, hour) -> [tables]
+        self.pending_rows = {}
+        self.writers = {}  # (measurement, mode, hour) -> (ParquetWriter, tmp_path, final_path)
+
+    def write_topic(self, layout, buffer, mode_codes, mode_names):
+        """Buffer one topic's rows (laid out as `layout`); returns the row count."""
+        schema = layout.schema
+        n = len(buffer["timestamps"])
+        timestamps = np.asarray(buffer["timestamps"], dtype=np.int64)
+        arrays = [
+            pa.array(timestamps, type=schema.field("time").type),
+            pa.array([self.vessel] * n, type=pa.string()),
+        ]
+        for tag in layout.tag_columns:
+            arrays.append(pa.array([tags.get(tag) if tags else None for tags in buffer["extra_tags"]],
+                                   type=pa.string()))
+        for field in list(schema)[len(arrays):]:
+            values = buffer["columns"].get(field.name, [None] * n)
+            if pa.types.is_floating(field.type):
+                values = np.asarray(values, dtype=np.float64)  # None -> NaN
+                arrays.append(pa.array(values, mask=~np.isfinite(values), type=field.type))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        table = pa.Table.from_arrays(arrays, schema=schema)
+
+        # Split into (mode, hour) partitions
+        codes = np.asarray(mode_codes, dtype=np.int64)
+        hours = timestamps // 3_600_000_000_000
+        order = np.lexsort((hours, codes))
+        table = table.take(pa.array(order))
+        keys = np.stack([codes[order], hours[order]], axis=1)
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            code, hour = keys[start].tolist()
+            key = (layout.measurement, mode_names[code], hour)
+            self.pending.setdefault(key, []).append(table.slice(start, end - start))
+            self.pending_rows[key] = self.pending_rows.get(key, 0) + end - start
+            if self.pending_rows[key] >= PARQUET_ROW_GROUP:
+                self._flush(key)
+        return n
+
+    def _flush(self, key):
+        tables = self.pending.pop(key, None)
+        self.pending_rows.pop(key, None)
+        if not tables:
+            return
+        if key not in self.writers:
+            measurement, mode, hour = key
+            directory = _partition_dir(self.root, measurement, self.mission, mode, hour)
+            os.makedirs(directory, exist_ok=True)
+            final_path = os.path.join(directory, self.file_name)
+            tmp_path = os.path.join(directory, f".{self.file_name}.tmp")
+            self.writers[key] = (pq.ParquetWriter(tmp_path, tables[0].schema), tmp_path, final_path)
+        writer = self.writers[key][0]
+        writer.write_table(pa.concat_tables(tables), row_group_size=PARQUET_ROW_GROUP)
+
+    def close(self):
+        for key in list(self.pending):
+            self._flush(key)
+        written = set()
+        for writer, tmp_path, final_path in self.writers.values():
+            writer.close()
+            os.replace(tmp_path, final_path)
+            written.add(final_path)
+        self.writers = {}
+
+        # Drop this bag's files from partitions it no longer writes to
+        for measurement in self.measurements:
+            pattern = os.path.join(_partition_dir(self.root, measurement, self.mission), "*", "*", self.file_name)
+            for stale in glob.glob(pattern):
+                if stale not in written:
+                    os.remove(stale)
+
+
+
+class ParquetSink(Sink):
+    """Summary tables (mission_segments, battery_rates) as Parquet; Pass 2 rows go through ParquetBagWriter."""
+
+    label = "Parquet"
+    tracked = True
+    line_protocol = False
+    incremental = False  # summary tables are rewritten whole; re-tagged bags are re-exported whole
+
+    def __init__(self, root, mission, vessel):
+        self.root = root
+        self.mission = mission
+        self.vessel = vessel
+
+    def write_rows(self, measurement, rows):
+        """Write rows as <root>/<measurement>/mission=<m>/<measurement>.parquet."""
+        records = []
+        for timestamp, tags, fields in rows:
+            record = {"time": timestamp, "vessel": self.vessel}
+            record.update((key, value) for key, value in tags.items() if key not in ("mission", "vessel"))
+            for name, value in fields.items():
+                if isinstance(value, float) and not math.isfinite(value):
+                    value = None
+                record[name] = value
+            records.append(record)
+        table = pa.Table.from_pylist(records)
+        table = table.set_column(0, "time", table.column("time").cast(pa.timestamp("ns", tz="UTC")))
+
+        directory = _partition_dir(self.root, measurement, self.mission)
+        os.makedirs(directory, exist_ok=True)
+        final_path = os.path.join(directory, f"{measurement}.parquet")
+        tmp_path = os.path.join(directory, f".{measurement}.parquet.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, final_path)
+
+
+SINKS = {
+    "influx": InfluxSink,
+    "parquet": ParquetSink,
+    "lp-file": LineProtocolFileSink,
+    "null": NullSink,
+    "count": CountingSink,
+}
+